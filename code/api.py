@@ -0,0 +1,230 @@
+# ============================================================
+# API LOCAL DE CONVERGENCIA (aiohttp)
+#
+# Carga una sola vez tabla_final y las capas preparadas (caché GeoParquet)
+# y responde consultas sin recalcular nada:
+#
+#   GET /salud
+#   GET /departamentos                       resumen de todos (tabla_final)
+#   GET /departamentos/{nombre}              un departamento
+#   GET /figuras/{capa}?departamento=Cauca   listado de zrc|res|cc|cfa
+#   GET /punto?lon=-76.6&lat=2.4             figuras que cubren la coordenada
+#
+# Las respuestas se serializan una vez y quedan en una caché LRU con su
+# ETag; si el cliente envía If-None-Match con el mismo ETag se responde 304.
+#
+# USO
+#   python api.py --puerto 8000
+#   python api.py --base-dir /ruta/al/proyecto
+# ============================================================
+
+import os
+import json
+import math
+import hashlib
+import argparse
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from aiohttp import web
+from pyproj import Transformer
+
+import conv
+
+
+def _json_simple(valor):
+    """Tipos NumPy/pandas a tipos nativos para json.dumps."""
+    if isinstance(valor, (np.integer, np.floating, np.bool_)):
+        return valor.item()
+    return str(valor)
+
+
+def _registros(df):
+    """DataFrame a lista de dicts con nulos como None."""
+    df = df.astype(object)
+    return df.where(df.notna(), None).to_dict(orient="records")
+
+
+def cargar_tabla_final(capas):
+    """
+    tabla_final exportada por conv.main (tablas/tabla_final_geografica.parquet);
+    si no existe se calcula a partir de las capas.
+    """
+    try:
+        return conv.leer_tabla_final()
+    except FileNotFoundError:
+        pass
+
+    cc, res, zrc, cfa, dep = capas
+    cortes = conv.cortar_por_departamento(cc, res, zrc, cfa, dep)
+    ranking = conv.construir_ranking_departamental(*cortes)
+    tabla_super = conv.calcular_superposiciones(zrc, res, cc, cfa, dep)
+    return conv.construir_tabla_final(ranking, tabla_super)
+
+
+class ServicioConvergencia:
+    """Datos precalculados y respuestas (con caché LRU) de la API."""
+
+    def __init__(self, tabla_final, capas, tam_cache=4096):
+        cc, res, zrc, cfa, dep = capas
+        self.tabla_final = tabla_final
+        self.capas = {"zrc": zrc, "res": res, "cc": cc, "cfa": cfa}
+        self.dep = dep.reset_index(drop=True)
+        self.nombres_dep = {
+            conv._normalizar_nombre(n): n for n in self.dep["dpto_cnmbr"]
+        }
+        self.a_3116 = Transformer.from_crs(4326, 3116, always_xy=True)
+
+        # Índices espaciales y atributos de cada capa (se construyen una vez)
+        self.arboles = {nombre: shapely.STRtree(gdf.geometry.values) for nombre, gdf in self.capas.items()}
+        self.arbol_dep = shapely.STRtree(self.dep.geometry.values)
+        self.atributos = {
+            nombre: _registros(gdf[[c for c in conv.CAMPOS_MAPA[nombre] if c in gdf.columns]])
+            for nombre, gdf in self.capas.items()
+        }
+
+        # Features de cada capa que tocan cada departamento
+        self.por_departamento = {}
+        for nombre, arbol in self.arboles.items():
+            idx_dep, idx_geom = arbol.query(self.dep.geometry.values, predicate="intersects")
+            orden = np.lexsort((idx_geom, idx_dep))
+            idx_dep, idx_geom = idx_dep[orden], idx_geom[orden]
+            self.por_departamento[nombre] = {
+                self.dep["dpto_cnmbr"].iloc[i]: idx_geom[idx_dep == i]
+                for i in range(len(self.dep))
+            }
+
+        self.responder = lru_cache(maxsize=tam_cache)(self._responder)
+
+    # --------------------------------------------------------
+    # Consultas
+    # --------------------------------------------------------
+    def _departamento(self, nombre):
+        return self.nombres_dep.get(conv._normalizar_nombre(nombre))
+
+    def resumen_departamentos(self):
+        tabla = self.tabla_final.reset_index()
+        return 200, {"departamentos": _registros(tabla)}
+
+    def resumen_departamento(self, nombre):
+        dep = self._departamento(nombre)
+        if dep is None:
+            return 404, {"error": f"Departamento '{nombre}' no encontrado."}
+        if dep in self.tabla_final.index:
+            fila = self.tabla_final.loc[[dep]].reset_index()
+        else:
+            fila = pd.DataFrame(0, index=[dep], columns=self.tabla_final.columns)
+            fila = fila.rename_axis(self.tabla_final.index.name or "dpto_cnmbr").reset_index()
+        figuras = {capa: len(idx[dep]) for capa, idx in self.por_departamento.items()}
+        return 200, {"departamento": _registros(fila)[0], "figuras_que_lo_tocan": figuras}
+
+    def listar_figuras(self, capa, departamento=None):
+        if capa not in self.capas:
+            return 404, {"error": f"Capa '{capa}' no existe. Opciones: {list(self.capas)}"}
+        if departamento:
+            dep = self._departamento(departamento)
+            if dep is None:
+                return 404, {"error": f"Departamento '{departamento}' no encontrado."}
+            idx = self.por_departamento[capa][dep]
+        else:
+            idx = np.arange(len(self.capas[capa]))
+        atributos = self.atributos[capa]
+        return 200, {"capa": capa, "total": len(idx),
+                     "figuras": [dict(atributos[i], id=int(i)) for i in idx]}
+
+    def figuras_en_punto(self, lon, lat):
+        x, y = self.a_3116.transform(lon, lat)
+        punto = shapely.Point(x, y)
+
+        idx_dep = self.arbol_dep.query(punto, predicate="intersects")
+        departamento = self.dep["dpto_cnmbr"].iloc[idx_dep[0]] if len(idx_dep) else None
+
+        figuras = {}
+        for capa, arbol in self.arboles.items():
+            idx = np.sort(arbol.query(punto, predicate="intersects"))
+            figuras[capa] = [dict(self.atributos[capa][i], id=int(i)) for i in idx]
+        return 200, {"lon": lon, "lat": lat, "departamento": departamento, "figuras": figuras}
+
+    # --------------------------------------------------------
+    # Enrutamiento y serialización (resultado cacheado)
+    # --------------------------------------------------------
+    def _responder(self, ruta, parametros):
+        """(estado, cuerpo JSON en bytes, ETag) para una ruta y sus parámetros (tupla ordenada)."""
+        params = dict(parametros)
+        partes = [p for p in ruta.strip("/").split("/") if p]
+
+        if partes == ["salud"]:
+            estado, datos = 200, {"estado": "ok", "departamentos": len(self.dep)}
+        elif partes == ["departamentos"]:
+            estado, datos = self.resumen_departamentos()
+        elif len(partes) == 2 and partes[0] == "departamentos":
+            estado, datos = self.resumen_departamento(partes[1])
+        elif len(partes) == 2 and partes[0] == "figuras":
+            estado, datos = self.listar_figuras(partes[1], params.get("departamento"))
+        elif partes == ["punto"]:
+            try:
+                lon, lat = float(params["lon"]), float(params["lat"])
+                if not (math.isfinite(lon) and math.isfinite(lat)):
+                    raise ValueError("coordenada no finita")
+            except (KeyError, ValueError):
+                estado, datos = 400, {"error": "Parámetros requeridos: lon y lat (grados, EPSG:4326)."}
+            else:
+                estado, datos = self.figuras_en_punto(lon, lat)
+        else:
+            estado, datos = 404, {"error": f"Ruta no encontrada: {ruta}"}
+
+        cuerpo = json.dumps(datos, ensure_ascii=False, default=_json_simple).encode("utf-8")
+        etag = '"' + hashlib.sha1(cuerpo).hexdigest()[:20] + '"'
+        return estado, cuerpo, etag
+
+
+def crear_app(servicio):
+    """Aplicación aiohttp con una sola ruta que delega en servicio.responder."""
+
+    async def manejar(request):
+        parametros = tuple(sorted(request.query.items()))
+        estado, cuerpo, etag = servicio.responder(request.path, parametros)
+        encabezados = {"ETag": etag, "Cache-Control": "public, max-age=300",
+                       "Access-Control-Allow-Origin": "*"}
+        if estado == 200 and request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers=encabezados)
+        return web.Response(status=estado, body=cuerpo, headers=encabezados,
+                            content_type="application/json", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/{ruta:.*}", manejar)
+    app["servicio"] = servicio
+    return app
+
+
+def iniciar_servicio(base_dir=None, tam_cache=4096):
+    """Carga capas y tabla_final (una sola vez) y devuelve el ServicioConvergencia."""
+    if base_dir:
+        conv.configurar_rutas(base_dir)
+    capas = conv.cargar_capas_preparadas()
+    tabla_final = cargar_tabla_final(capas)
+    print(f"API lista: {len(tabla_final)} departamentos en tabla_final")
+    return ServicioConvergencia(tabla_final, capas, tam_cache=tam_cache)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="API local de convergencia de figuras territoriales")
+    parser.add_argument("--host", default="127.0.0.1", help="Interfaz de escucha.")
+    parser.add_argument("--puerto", type=int, default=8000, help="Puerto HTTP.")
+    parser.add_argument("--base-dir", default=None,
+                        help="Carpeta base del proyecto (por defecto CONVERGENCIA_BASE_DIR del entorno/.env).")
+    parser.add_argument("--tam-cache", type=int, default=4096,
+                        help="Respuestas guardadas en la caché LRU.")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    conv.cargar_entorno()
+    servicio = iniciar_servicio(args.base_dir or os.getenv("CONVERGENCIA_BASE_DIR", conv.BASE_DIR),
+                                args.tam_cache)
+    web.run_app(crear_app(servicio), host=args.host, port=args.puerto)
@@ -0,0 +1,333 @@
+# ============================================================
+# BENCHMARK DEL PIPELINE CON CAPAS SINTÉTICAS
+#
+# Genera capas con la forma de las oficiales (partición departamental,
+# miles de resguardos/consejos con cientos de vértices, municipios CFA,
+# pocas ZRC grandes), las escribe como SHP en una carpeta temporal y
+# mide cada etapa de conv.py: tiempo, memoria pico y tamaño de salidas.
+#
+# USO
+# ---
+#   python benchmark.py --escala 1.0 --motor strtree
+#   python benchmark.py --escala 0.1 --comparar benchmarks/anterior.json
+# Los resultados quedan en benchmarks/benchmark_<fecha>.json
+# ============================================================
+
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+import conv
+from instrumentacion import MuestreoMemoria
+
+# Conteos aproximados a escala 1.0 (nacional)
+CONTEOS_NACIONALES = {
+    "dep": 33,
+    "municipios": 1100,
+    "res": 3000,
+    "cc": 1000,
+    "zrc": 12,
+}
+
+# Rectángulo aproximado de Colombia en EPSG:3116
+CENTRO_PAIS = (1_000_000, 1_000_000)
+SEMIEJES_PAIS = (650_000, 850_000)
+
+
+# ------------------------------------------------------------
+# 1. GENERACIÓN DE CAPAS SINTÉTICAS
+# ------------------------------------------------------------
+def _contorno_pais(n_vertices=2000, semilla=0):
+    """Polígono irregular tipo 'país' alrededor de CENTRO_PAIS."""
+    rng = np.random.default_rng(semilla)
+    ang = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    ruido = np.convolve(rng.normal(0, 0.08, n_vertices), np.ones(25) / 25, mode="same")
+    x = CENTRO_PAIS[0] + SEMIEJES_PAIS[0] * (1 + ruido) * np.cos(ang)
+    y = CENTRO_PAIS[1] + SEMIEJES_PAIS[1] * (1 + ruido) * np.sin(ang)
+    return shapely.Polygon(np.column_stack([x, y]))
+
+
+def _puntos_en(poligono, n, rng):
+    """n puntos aleatorios dentro de un polígono (muestreo por rechazo)."""
+    minx, miny, maxx, maxy = poligono.bounds
+    puntos = []
+    while len(puntos) < n:
+        xy = rng.uniform([minx, miny], [maxx, maxy], (n * 2, 2))
+        dentro = shapely.contains_xy(poligono, xy[:, 0], xy[:, 1])
+        puntos.extend(xy[dentro])
+    return np.array(puntos[:n])
+
+
+def _particion(pais, n, rng, densificar_m):
+    """Partición tipo Voronoi del país (departamentos o municipios), con bordes densificados."""
+    semillas = shapely.multipoints(_puntos_en(pais, n, rng))
+    celdas = shapely.get_parts(shapely.voronoi_polygons(semillas, extend_to=pais))
+    celdas = shapely.intersection(celdas, pais)
+    return shapely.segmentize(celdas[~shapely.is_empty(celdas)], densificar_m)
+
+
+def _poligonos_estrella(centros, radios, n_vertices, rng):
+    """Polígonos con borde irregular (cientos de vértices) alrededor de cada centro."""
+    ang = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    ruido = rng.normal(0, 0.15, (len(centros), n_vertices))
+    ruido = np.apply_along_axis(lambda r: np.convolve(r, np.ones(9) / 9, mode="same"), 1, ruido)
+    r = radios[:, None] * np.clip(1 + ruido, 0.3, None)
+    x = centros[:, :1] + r * np.cos(ang)
+    y = centros[:, 1:] + r * np.sin(ang)
+    anillos = np.stack([x, y], axis=-1)
+    anillos = np.concatenate([anillos, anillos[:, :1]], axis=1)
+    return shapely.polygons(anillos)
+
+
+def generar_capas_sinteticas(escala=1.0, vertices=300, semilla=0):
+    """
+    Devuelve cc, res, zrc, cfa, dep (EPSG:3116) con las columnas que usa conv.py.
+    `escala` multiplica los conteos de CONTEOS_NACIONALES (departamentos fijos en 33).
+    """
+    rng = np.random.default_rng(semilla)
+    pais = _contorno_pais(semilla=semilla)
+
+    def n(capa):
+        return max(1, int(round(CONTEOS_NACIONALES[capa] * escala)))
+
+    deps = _particion(pais, CONTEOS_NACIONALES["dep"], rng, densificar_m=2_000)
+    dep = gpd.GeoDataFrame(
+        {"dpto_ccdgo": [f"{i:02d}" for i in range(len(deps))],
+         "dpto_cnmbr": [f"DEPARTAMENTO {i:02d}" for i in range(len(deps))]},
+        geometry=deps, crs=3116
+    )
+
+    municipios = _particion(pais, n("municipios"), rng, densificar_m=1_000)
+    en_conflicto = municipios[rng.random(len(municipios)) < 0.6]
+    cfa = gpd.GeoDataFrame(
+        {"MpNombre": [f"Municipio {i}" for i in range(len(en_conflicto))],
+         "Departamen": rng.choice(dep["dpto_cnmbr"], len(en_conflicto)),
+         "Municipio": [f"{i:05d}" for i in range(len(en_conflicto))],
+         "MpCategor": rng.choice(["1", "2", "3", "4", "5", "6", "Especial"], len(en_conflicto)),
+         "MpAltitud": rng.integers(0, 3000, len(en_conflicto)),
+         "MpArea": shapely.area(en_conflicto) / 1e6},
+        geometry=en_conflicto, crs=3116
+    )
+
+    def figuras(capa, radio_medio):
+        cantidad = n(capa)
+        centros = _puntos_en(pais, cantidad, rng)
+        radios = rng.lognormal(np.log(radio_medio), 0.6, cantidad)
+        return _poligonos_estrella(centros, radios, vertices, rng)
+
+    geoms_res = figuras("res", 6_000)
+    res = gpd.GeoDataFrame(
+        {"NOMBRE": [f"Resguardo {i}" for i in range(len(geoms_res))],
+         "PUEBLO": rng.choice(["Nasa", "Wayuu", "Emberá", "Zenú", "Sikuani"], len(geoms_res)),
+         "DEPARTAMEN": rng.choice(dep["dpto_cnmbr"], len(geoms_res)),
+         "MUNICIPIO": [f"Municipio {i}" for i in rng.integers(0, 1100, len(geoms_res))],
+         "AREA_TOTAL": shapely.area(geoms_res) / 1e4},
+        geometry=geoms_res, crs=3116
+    )
+
+    geoms_cc = figuras("cc", 8_000)
+    cc = gpd.GeoDataFrame(
+        {"NOMBRE": [f"Consejo {i}" for i in range(len(geoms_cc))],
+         "DEPARTAMEN": rng.choice(dep["dpto_cnmbr"], len(geoms_cc)),
+         "MUNICIPIO": [f"Municipio {i}" for i in rng.integers(0, 1100, len(geoms_cc))],
+         "AREA_TOTAL": shapely.area(geoms_cc) / 1e4},
+        geometry=geoms_cc, crs=3116
+    )
+
+    geoms_zrc = figuras("zrc", 30_000)
+    zrc = gpd.GeoDataFrame(
+        {"NOMBRE_ZON": [f"ZRC {i}" for i in range(len(geoms_zrc))],
+         "DEPARTAMEN": rng.choice(dep["dpto_cnmbr"], len(geoms_zrc)),
+         "MUNICIPIOS": [f"Municipio {i}" for i in rng.integers(0, 1100, len(geoms_zrc))],
+         "Año": rng.integers(1996, 2024, len(geoms_zrc))},
+        geometry=geoms_zrc, crs=3116
+    )
+    return cc, res, zrc, cfa, dep
+
+
+def escribir_shapes_sinteticos(base_dir, escala=1.0, vertices=300, semilla=0):
+    """Escribe las capas sintéticas en base_dir/inputs/shapes (MAGNA-SIRGAS geográficas, EPSG:4686)."""
+    conv.configurar_rutas(base_dir)
+    capas = dict(zip(["cc", "res", "zrc", "cfa", "dep"],
+                     generar_capas_sinteticas(escala, vertices, semilla)))
+    for nombre, gdf in capas.items():
+        ruta = conv.RUTAS_CAPAS[nombre]
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        gdf.to_crs(4686).to_file(ruta)
+    return {nombre: len(gdf) for nombre, gdf in capas.items()}
+
+
+# ------------------------------------------------------------
+# 2. MEDICIÓN POR ETAPA
+# ------------------------------------------------------------
+def _bytes_en(directorio):
+    total = 0
+    for raiz, _, archivos in os.walk(directorio):
+        total += sum(os.path.getsize(os.path.join(raiz, a)) for a in archivos)
+    return total
+
+
+def _medir(nombre, funcion, *args, trazar=False, **kwargs):
+    """
+    Ejecuta funcion y devuelve (resultado, métricas de la etapa).
+    rss_pico_mb es el pico de RSS de la etapa (proceso + workers) y rss_aumento_mb
+    lo que sube sobre el RSS de entrada, como en Instrumentacion.etapa; con
+    trazar=True se agrega el pico de asignaciones Python/NumPy de la etapa
+    (tracemalloc, que encarece el tiempo).
+    """
+    bytes_antes = _bytes_en(conv.OUTPUT_DIR)
+    if trazar:
+        tracemalloc.start()
+    memoria = MuestreoMemoria()
+    t0, c0 = time.perf_counter(), time.process_time()
+    with memoria:
+        resultado = funcion(*args, **kwargs)
+    segundos, cpu = time.perf_counter() - t0, time.process_time() - c0
+
+    metricas = {
+        "etapa": nombre,
+        "segundos": round(segundos, 3),
+        "cpu_segundos": round(cpu, 3),
+        "rss_inicio_mb": round(memoria.inicio_mb, 1),
+        "rss_pico_mb": round(memoria.pico_mb, 1),
+        "rss_aumento_mb": round(memoria.pico_mb - memoria.inicio_mb, 1),
+        "bytes_salida": _bytes_en(conv.OUTPUT_DIR) - bytes_antes,
+    }
+    if trazar:
+        metricas["python_pico_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1)
+        tracemalloc.stop()
+    print(f"  {nombre:<28} {segundos:8.2f} s  RSS pico {metricas['rss_pico_mb']:8.0f} MB "
+          f"(+{metricas['rss_aumento_mb']:.0f} MB)")
+    return resultado, metricas
+
+
+def ejecutar_benchmark(base_dir, motor="strtree", mapas=True, trazar=False):
+    """Corre las etapas de conv.py sobre base_dir y devuelve la lista de métricas."""
+    conv.configurar_rutas(base_dir)
+    etapas = []
+
+    def medir(nombre, funcion, *args, **kwargs):
+        resultado, metricas = _medir(nombre, funcion, *args, trazar=trazar, **kwargs)
+        etapas.append(metricas)
+        return resultado
+
+    capas = medir("cargar_capas_base", conv.cargar_capas_base)
+    capas = medir("preparar_capas_geom", conv.preparar_capas_geom, *capas)
+    cc, res, zrc, cfa, dep = medir("reproyectar_a_3116", conv.reproyectar_a_3116, *capas)
+    cc, res, zrc, cfa = medir("calcular_areas_km2", conv.calcular_areas_km2, cc, res, zrc, cfa)
+
+    cortes = medir("cortar_por_departamento", conv.cortar_por_departamento, cc, res, zrc, cfa, dep)
+    ranking = medir("construir_ranking_departamental", conv.construir_ranking_departamental, *cortes)
+    tabla_super = medir("calcular_superposiciones", conv.calcular_superposiciones,
+                        zrc, res, cc, cfa, dep, motor=motor)
+    tabla_final = medir("construir_tabla_final", conv.construir_tabla_final, ranking, tabla_super)
+    medir("exportar_tablas", conv.exportar_tablas, tabla_super, tabla_final)
+
+    if mapas:
+        medir("construir_mapa_full", conv.construir_mapa_full, dep, zrc, res, cc, cfa, tabla_final)
+        medir("construir_mapa_light", conv.construir_mapa_light, dep, zrc, res, cc, cfa, tabla_final)
+    return etapas
+
+
+def comparar(actual, anterior):
+    """Tabla de tiempos y memoria de la corrida actual frente a un JSON anterior."""
+    previo = {e["etapa"]: e for e in anterior["etapas"]}
+    filas = []
+    for e in actual["etapas"]:
+        p = previo.get(e["etapa"])
+        if p is None:
+            continue
+        filas.append({
+            "etapa": e["etapa"],
+            "s_anterior": p["segundos"],
+            "s_actual": e["segundos"],
+            "razon": round(e["segundos"] / p["segundos"], 2) if p["segundos"] else np.nan,
+            "rss_anterior_mb": p["rss_pico_mb"],
+            "rss_actual_mb": e["rss_pico_mb"],
+            "aumento_anterior_mb": p.get("rss_aumento_mb", np.nan),
+            "aumento_actual_mb": e["rss_aumento_mb"],
+        })
+    return pd.DataFrame(filas)
+
+
+# ------------------------------------------------------------
+# 3. CLI
+# ------------------------------------------------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de conv.py con capas sintéticas")
+    parser.add_argument("--escala", type=float, default=1.0,
+                        help="Multiplicador de los conteos nacionales (1.0 ≈ escala Colombia).")
+    parser.add_argument("--vertices", type=int, default=300,
+                        help="Vértices por resguardo/consejo/ZRC sintético.")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--motor", choices=conv.MOTORES_SUPERPOSICION, default="strtree")
+    parser.add_argument("--sin-mapas", action="store_true", help="No mide los constructores de mapas.")
+    parser.add_argument("--salida", default="benchmarks", help="Carpeta para el JSON de resultados.")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar.")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="Agrega el pico de memoria Python/NumPy por etapa (más lento).")
+    parser.add_argument("--conservar", action="store_true", help="No borra la carpeta temporal con SHP y salidas.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    base_dir = tempfile.mkdtemp(prefix="bench_convergencia_")
+    try:
+        print(f"Generando capas sintéticas (escala {args.escala}) en {base_dir}")
+        conteos = escribir_shapes_sinteticos(base_dir, args.escala, args.vertices, args.semilla)
+        print("  Features:", conteos)
+
+        etapas = ejecutar_benchmark(base_dir, motor=args.motor, mapas=not args.sin_mapas,
+                                    trazar=args.tracemalloc)
+    finally:
+        if not args.conservar:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    resultado = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "parametros": {
+            "escala": args.escala,
+            "vertices": args.vertices,
+            "semilla": args.semilla,
+            "motor": args.motor,
+            "mapas": not args.sin_mapas,
+            "tracemalloc": args.tracemalloc,
+        },
+        "features": conteos,
+        "entorno": {
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "geopandas": gpd.__version__,
+            "shapely": shapely.__version__,
+            "pandas": pd.__version__,
+        },
+        "etapas": etapas,
+        "total_segundos": round(sum(e["segundos"] for e in etapas), 3),
+    }
+
+    os.makedirs(args.salida, exist_ok=True)
+    ruta = os.path.join(args.salida, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"Total: {resultado['total_segundos']:.1f} s — resultados en {ruta}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            print(comparar(resultado, json.load(f)).to_string(index=False))
+    return resultado
+
+
+if __name__ == "__main__":
+    main()
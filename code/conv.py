@@ -21,62 +21,180 @@
 # EJECUCIÓN
 # ---------
 # - Instala las librerías una vez en tu entorno:
-#   pip install geopandas folium shapely tabulate requests python-dotenv
+#   pip install geopandas folium shapely tabulate aiohttp python-dotenv
 # - Luego ejecuta este script. Genera:
-#   - Tablas (Excel + JSON) en outputs/tablas y outputs/micrositio
+#   - Tablas (Excel, Parquet/CSV y JSON) en outputs/tablas y outputs/micrositio
 #   - Mapas HTML (full y light) en outputs/mapas
 #   - Micrositio index.html en outputs/micrositio
 #   - (Opcional) análisis de texto en outputs/llm
+# - O una sola parte (python conv.py --help):
+#   python conv.py --base-dir D:\convergencia analizar
+#   python conv.py micrositio        (solo tablas ya exportadas: arranque rápido)
 # ============================================================
 
+from __future__ import annotations
+
 import os
+import sys
+import glob
+import json
+import time
+import shutil
+import hashlib
+import importlib
+import unicodedata
+import argparse
 import warnings
+import itertools
 
-import geopandas as gpd
-import pandas as pd
-import numpy as np
-import folium
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from shapely.geometry import shape
-from folium.features import GeoJsonTooltip
-from pandas.api.types import is_datetime64_any_dtype, is_datetime64tz_dtype
+import numpy as np
 
 # Opcionales (para LLM y markdown)
-from tabulate import tabulate
-import requests
-from dotenv import load_dotenv
+
+from etapas import GrafoEtapas
+from instrumentacion import Instrumentacion, PERFILADORES, memoria_pico_mb
+
+
+class _ModuloDiferido:
+    """
+    Módulo que se importa recién al usar uno de sus atributos (gpd.read_file, ...).
+    Los subcomandos sin geometría (micrositio, llm) no pagan geopandas/shapely/folium
+    y `--help` tampoco paga pandas; los módulos hermanos (ingesta, raster, teselas...)
+    se importan dentro de las funciones.
+    No se registra en sys.modules (a diferencia de importlib.util.LazyLoader), así
+    que `import geopandas` en otros módulos, pickle y los workers ven siempre el
+    módulo real.
+    """
+
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nombre)
+        return getattr(self._modulo, atributo)
+
+
+pd = _ModuloDiferido("pandas")
+gpd = _ModuloDiferido("geopandas")
+shapely = _ModuloDiferido("shapely")
+folium = _ModuloDiferido("folium")
 
 # ------------------------------------------------------------
 # 0. CONFIGURACIÓN BÁSICA
 # ------------------------------------------------------------
 warnings.filterwarnings("ignore")
-load_dotenv()
 
-# Carpeta base del proyecto
-BASE_DIR   = r"C:\Users\fredy\Desktop\convergencia_territorio"
-INPUT_DIR  = os.path.join(BASE_DIR, "inputs")
-OUTPUT_DIR = os.path.join(BASE_DIR, "outputs")
-SHAPES_DIR = os.path.join(INPUT_DIR, "shapes")
+# Carpeta base del proyecto (CONVERGENCIA_BASE_DIR en el entorno/.env o --base-dir)
+BASE_DIR = os.getenv("CONVERGENCIA_BASE_DIR", r"C:\Users\fredy\Desktop\convergencia_territorio")
+
+
+def cargar_entorno():
+    """
+    Lleva las variables del .env (CONVERGENCIA_BASE_DIR, HF_API_KEY, HF_API_URL)
+    al entorno. python-dotenv se importa aquí y no al importar el módulo; las
+    variables que ya están en el entorno no se sobrescriben.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def configurar_rutas(base_dir, crear=True):
+    """
+    Define (o redefine) todas las rutas de entrada/salida a partir de base_dir.
+    crear=False solo define las rutas (al importar el módulo no se crea nada).
+    """
+    global BASE_DIR, INPUT_DIR, SHAPES_DIR, CACHE_DIR
+    global CC_PATH, RES_PATH, ZRC_PATH, CFA_PATH, CO_PATH, DEP_PATH, MPIO_PATH
+    global RUTAS_CAPAS, RUTAS_UNIDADES
+
+    BASE_DIR   = base_dir
+    INPUT_DIR  = os.path.join(BASE_DIR, "inputs")
+    SHAPES_DIR = os.path.join(INPUT_DIR, "shapes")
+
+    # Caché de capas ya limpias y reproyectadas (GeoParquet); se crea al primer uso
+    CACHE_DIR  = os.path.join(BASE_DIR, "cache")
+
+    configurar_salidas(os.path.join(BASE_DIR, "outputs"), crear=crear)
+
+    # Rutas de SHP (manteniendo la lógica que ya usabas)
+    CC_PATH  = os.path.join(SHAPES_DIR, "Consejo_Comunitario_Titulado", "Consejo_Comunitario_Titulado.shp")
+    RES_PATH = os.path.join(SHAPES_DIR, "Resguardo_Indigena_Formalizado", "Resguardo_Indigena_Formalizado.shp")
+    ZRC_PATH = os.path.join(SHAPES_DIR, "Zonas_de_Reserva_Campesina_Constituida", "Zonas_de_Reserva_Campesina_Constituida.shp")
+    CFA_PATH = os.path.join(SHAPES_DIR, "Zonas_en_conflicto", "Municipios_2025_join.shp")
+
+    CO_PATH  = os.path.join(SHAPES_DIR, "COLOMBIA", "COLOMBIA.shp")
+    DEP_PATH = os.path.join(SHAPES_DIR, "ADMINISTRATIVO", "MGN_ADM_DPTO_POLITICO.shp")
+    MPIO_PATH = os.path.join(SHAPES_DIR, "ADMINISTRATIVO", "MGN_ADM_MPIO_GRAFICO.shp")
+
+    # Capas del análisis en el orden que devuelve cargar_capas_base
+    RUTAS_CAPAS = {
+        "cc":  CC_PATH,
+        "res": RES_PATH,
+        "zrc": ZRC_PATH,
+        "cfa": CFA_PATH,
+        "dep": DEP_PATH,
+    }
+
+    # Unidades administrativas más finas (solo con --nivel municipio)
+    RUTAS_UNIDADES = {
+        "mpio": MPIO_PATH,
+    }
+
+
+def configurar_salidas(output_dir, crear=True):
+    """Define OUTPUT_DIR y sus subcarpetas (tablas, mapas, micrositio, llm)."""
+    global OUTPUT_DIR, TABLAS_DIR, MAPAS_DIR, MICRO_DIR, LLM_DIR
+
+    OUTPUT_DIR = output_dir
+    TABLAS_DIR = os.path.join(OUTPUT_DIR, "tablas")
+    MAPAS_DIR  = os.path.join(OUTPUT_DIR, "mapas")
+    MICRO_DIR  = os.path.join(OUTPUT_DIR, "micrositio")
+    LLM_DIR    = os.path.join(OUTPUT_DIR, "llm")
+
+    if crear:
+        crear_directorios_salida()
+
+
+def configurar_salidas_departamento(departamento):
+    """
+    Salidas de una corrida filtrada (--departamento) en outputs/<DEPARTAMENTO>/,
+    para que no reemplacen las tablas, mapas y micrositio nacionales que leen
+    api.py y los demás subcomandos.
+    """
+    configurar_salidas(os.path.join(BASE_DIR, "outputs", _nombre_archivo(departamento)))
+    print("Salidas del departamento en:", OUTPUT_DIR)
+
+
+def crear_directorios_salida():
+    """Crea las subcarpetas de outputs/ si no existen."""
+    for carpeta in (TABLAS_DIR, MAPAS_DIR, MICRO_DIR, LLM_DIR):
+        os.makedirs(carpeta, exist_ok=True)
+
 
-# Subcarpetas de salida
-TABLAS_DIR = os.path.join(OUTPUT_DIR, "tablas")
-MAPAS_DIR  = os.path.join(OUTPUT_DIR, "mapas")
-MICRO_DIR  = os.path.join(OUTPUT_DIR, "micrositio")
-LLM_DIR    = os.path.join(OUTPUT_DIR, "llm")
+configurar_rutas(BASE_DIR, crear=False)
 
-os.makedirs(TABLAS_DIR, exist_ok=True)
-os.makedirs(MAPAS_DIR,  exist_ok=True)
-os.makedirs(MICRO_DIR,  exist_ok=True)
-os.makedirs(LLM_DIR,    exist_ok=True)
+# Columnas de atributos que se muestran en los mapas (tooltips) por capa
+CAMPOS_MAPA = {
+    "zrc": ["NOMBRE_ZON", "DEPARTAMEN", "MUNICIPIOS", "Año", "area_km2"],
+    "res": ["NOMBRE", "PUEBLO", "DEPARTAMEN", "MUNICIPIO", "AREA_TOTAL", "area_km2"],
+    "cc":  ["NOMBRE", "DEPARTAMEN", "MUNICIPIO", "AREA_TOTAL", "area_km2"],
+    "cfa": ["MpNombre", "Departamen", "Municipio", "MpCategor", "MpAltitud", "MpArea"],
+}
 
-# Rutas de SHP (manteniendo la lógica que ya usabas)
-CC_PATH  = os.path.join(SHAPES_DIR, "Consejo_Comunitario_Titulado", "Consejo_Comunitario_Titulado.shp")
-RES_PATH = os.path.join(SHAPES_DIR, "Resguardo_Indigena_Formalizado", "Resguardo_Indigena_Formalizado.shp")
-ZRC_PATH = os.path.join(SHAPES_DIR, "Zonas_de_Reserva_Campesina_Constituida", "Zonas_de_Reserva_Campesina_Constituida.shp")
-CFA_PATH = os.path.join(SHAPES_DIR, "Zonas_en_conflicto", "Municipios_2025_join.shp")
+# Columnas que se leen de cada SHP (tooltips + departamento); el resto del DBF no se carga.
+# area_km2 se calcula después de reproyectar.
+COLUMNAS_CAPAS = {
+    nombre: [c for c in campos if c != "area_km2"] for nombre, campos in CAMPOS_MAPA.items()
+}
+COLUMNAS_CAPAS["dep"] = ["dpto_cnmbr"]
+COLUMNAS_CAPAS["mpio"] = ["dpto_cnmbr", "mpio_cdpmp", "mpio_cnmbr"]
 
-CO_PATH  = os.path.join(SHAPES_DIR, "COLOMBIA", "COLOMBIA.shp")
-DEP_PATH = os.path.join(SHAPES_DIR, "ADMINISTRATIVO", "MGN_ADM_DPTO_POLITICO.shp")
+# Capas de unidades de agregación: no llevan área_km2 propia
+CAPAS_UNIDADES = ("dep", "mpio", "unidades")
 
 
 # ------------------------------------------------------------
@@ -89,43 +207,157 @@ def formato_col(x):
     return x
 
 
-def fix_dates_any(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    """Convierte columnas datetime a texto para evitar problemas al exportar a JSON/GeoJSON."""
-    gdf = gdf.copy()
+# Texto de cada grupo de miles: "7" (grupo inicial) y ".007" (grupos siguientes)
+_GRUPO_INICIAL = np.array([str(i) for i in range(1000)])
+_GRUPO_SIGUIENTE = np.char.add(".", np.char.zfill(_GRUPO_INICIAL, 3))
+
+
+def formatear_columna(serie):
+    """
+    Versión vectorizada de formato_col para una columna completa: redondea a
+    entero, parte en grupos de miles y los une con operaciones de texto de
+    NumPy sobre todo el arreglo (sin una llamada de Python por celda).
+    Da el mismo texto que df.map(formato_col): nulos como "nan", infinitos
+    como "inf"/"-inf", negativos que redondean a cero como "-0" y booleanos
+    como "1"/"0". Columnas no numéricas se devuelven sin cambios.
+    """
+    if not pd.api.types.is_numeric_dtype(serie):
+        return serie
+    x = serie.to_numpy(dtype=float, na_value=np.nan)
+    finitos = np.isfinite(x)
+    enteros = np.rint(np.where(finitos, x, 0)).astype(np.int64)
+    absolutos = np.abs(enteros)
+
+    # Grupos de tres dígitos, del menos al más significativo
+    grupos, resto = [], absolutos
+    while True:
+        grupos.append(resto % 1000)
+        resto = resto // 1000
+        if not (resto > 0).any():
+            break
+    n_grupos = 1 + sum((absolutos >= 1000 ** k).astype(int) for k in range(1, len(grupos)))
+
+    # El signo sale de x y no del entero, como "{:,.0f}": -0.4 -> "-0"
+    texto = np.where(np.signbit(x), "-", "")
+    for k in reversed(range(len(grupos))):
+        pieza = np.where(k == n_grupos - 1, _GRUPO_INICIAL[grupos[k]], "")
+        pieza = np.where(k < n_grupos - 1, _GRUPO_SIGUIENTE[grupos[k]], pieza)
+        texto = np.char.add(texto, pieza)
+
+    no_finitos = np.where(np.isnan(x), "nan", np.where(x > 0, "inf", "-inf"))
+    texto = np.where(finitos, texto, no_finitos)
+    return pd.Series(texto, index=serie.index, name=serie.name, dtype=object)
+
+
+def formatear_tabla(df):
+    """Aplica formatear_columna columna por columna (ver formato_col)."""
+    return df.apply(formatear_columna)
+
+
+def fix_dates_any(gdf: gpd.GeoDataFrame, copiar: bool = True) -> gpd.GeoDataFrame:
+    """
+    Convierte columnas datetime a texto para evitar problemas al exportar a JSON/GeoJSON.
+    Con copiar=False modifica gdf en el sitio (solo si nadie más usa ese objeto).
+    """
+    if copiar:
+        gdf = gdf.copy()
+    tipos = pd.api.types
     for col in gdf.columns:
-        if is_datetime64_any_dtype(gdf[col]) or is_datetime64tz_dtype(gdf[col]):
+        if tipos.is_datetime64_any_dtype(gdf[col]) or tipos.is_datetime64tz_dtype(gdf[col]):
             gdf[col] = gdf[col].astype(str)
     return gdf
 
 
-def limpiar_geometrias(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    """Repara geometrías inválidas aplicando buffer(0)."""
-    gdf = gdf.copy()
-    gdf["geometry"] = gdf.geometry.buffer(0)
+def ejecutar_en_paralelo(funcion, tareas, workers=1):
+    """
+    Aplica funcion(*args) a cada tupla de `tareas` y devuelve los resultados en el
+    mismo orden. Con workers > 1 reparte las tareas en un pool de procesos.
+    Cada proceso vuelve a definir las rutas con el BASE_DIR actual: con el
+    arranque "spawn" (Windows) los workers importan conv de nuevo y, sin esto,
+    usarían el BASE_DIR por defecto en lugar del de --base-dir.
+    """
+    tareas = list(tareas)
+    if workers <= 1 or len(tareas) <= 1:
+        return [funcion(*args) for args in tareas]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tareas)),
+                             initializer=configurar_rutas, initargs=(BASE_DIR, False)) as pool:
+        futuros = [pool.submit(funcion, *args) for args in tareas]
+        return [f.result() for f in futuros]
+
+
+def limpiar_geometrias(gdf: gpd.GeoDataFrame, copiar: bool = True, nombre: str = "") -> gpd.GeoDataFrame:
+    """
+    Repara solo las geometrías inválidas con make_valid (método "structure",
+    que devuelve polígonos sin perder partes, a diferencia de buffer(0)).
+    La validez se evalúa en bloque; con datos limpios no se reconstruye nada.
+    Con copiar=False modifica gdf en el sitio (p. ej. recién leído del SHP).
+    """
+    geoms = gdf.geometry.values
+    invalidas = ~shapely.is_valid(geoms) & ~shapely.is_missing(geoms)
+    if not invalidas.any():
+        return gdf
+
+    motivos = pd.Series(shapely.is_valid_reason(geoms[invalidas])).str.split("[", regex=False).str[0]
+    resumen = ", ".join(f"{m.strip()}: {n}" for m, n in motivos.value_counts().items())
+    print(f"  {nombre or 'capa'}: {invalidas.sum()} geometrías inválidas reparadas ({resumen})")
+
+    if copiar:
+        gdf = gdf.copy()
+    reparadas = np.asarray(geoms).copy()
+    reparadas[invalidas] = shapely.make_valid(
+        reparadas[invalidas], method="structure", keep_collapsed=False
+    )
+    gdf["geometry"] = gpd.GeoSeries(reparadas, index=gdf.index, crs=gdf.crs)
     return gdf
 
 
 # ------------------------------------------------------------
 # 2. CARGA Y PREPARACIÓN DE CAPAS
 # ------------------------------------------------------------
-def cargar_capas_base():
-    """Carga las capas geográficas desde inputs/shapes."""
+def cargar_capas_base(workers=1):
+    """Carga las capas geográficas desde inputs/shapes (solo las columnas de COLUMNAS_CAPAS)."""
+    from ingesta import leer_capa
     print("Cargando capas geográficas desde:", SHAPES_DIR)
-    cc  = gpd.read_file(CC_PATH)
-    res = gpd.read_file(RES_PATH)
-    zrc = gpd.read_file(ZRC_PATH)
-    cfa = gpd.read_file(CFA_PATH)
-    dep = gpd.read_file(DEP_PATH)
+    tareas = [(RUTAS_CAPAS[n], COLUMNAS_CAPAS[n]) for n in ("cc", "res", "zrc", "cfa", "dep")]
+    cc, res, zrc, cfa, dep = ejecutar_en_paralelo(leer_capa, tareas, workers)
     return cc, res, zrc, cfa, dep
 
 
-def preparar_capas_geom(cc, res, zrc, cfa, dep):
+def _normalizar_nombre(texto):
+    """Mayúsculas sin tildes, para comparar nombres de departamento."""
+    texto = unicodedata.normalize("NFKD", str(texto).strip().upper())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def _nombre_archivo(texto):
+    """Nombre normalizado apto para archivo (p. ej. VALLE_DEL_CAUCA)."""
+    return "".join(c if c.isalnum() else "_" for c in _normalizar_nombre(texto))
+
+
+def filtro_departamento(departamento):
+    """
+    Geometría de un departamento (por dpto_cnmbr, sin distinguir tildes ni
+    mayúsculas) para filtrar la lectura de las demás capas.
+    Devuelve {"departamento", "geometria", "crs"}.
+    """
+    from ingesta import leer_capa
+    dep = leer_capa(DEP_PATH, COLUMNAS_CAPAS["dep"])
+    buscado = _normalizar_nombre(departamento)
+    fila = dep[dep["dpto_cnmbr"].map(_normalizar_nombre) == buscado]
+    if fila.empty:
+        disponibles = ", ".join(sorted(dep["dpto_cnmbr"].astype(str)))
+        raise ValueError(f"Departamento '{departamento}' no encontrado. Disponibles: {disponibles}")
+    return {
+        "departamento": fila["dpto_cnmbr"].iloc[0],
+        "geometria": shapely.make_valid(fila.geometry.iloc[0]),
+        "crs": dep.crs,
+    }
+
+
+def preparar_capas_geom(cc, res, zrc, cfa, dep, workers=1):
     """Limpieza básica de geometrías para todas las capas."""
-    cc  = limpiar_geometrias(cc)
-    res = limpiar_geometrias(res)
-    zrc = limpiar_geometrias(zrc)
-    cfa = limpiar_geometrias(cfa)
-    dep = limpiar_geometrias(dep)
+    capas = [(cc, True, "cc"), (res, True, "res"), (zrc, True, "zrc"), (cfa, True, "cfa"), (dep, True, "dep")]
+    cc, res, zrc, cfa, dep = ejecutar_en_paralelo(limpiar_geometrias, capas, workers)
     return cc, res, zrc, cfa, dep
 
 
@@ -143,36 +375,214 @@ def calcular_areas_km2(cc_3116, res_3116, zrc_3116, cfa_3116):
 
 
 # ------------------------------------------------------------
-# 3. CORTES POR DEPARTAMENTO Y RANKING
+# 2.1 CACHÉ DE CAPAS PREPARADAS (GeoParquet)
 # ------------------------------------------------------------
-def cortar_por_departamento(cc_3116, res_3116, zrc_3116, cfa_3116, dep_3116):
-    """Intersecta cada capa temática con departamentos y calcula área_km2 en cada corte."""
-    campos_dep = ["dpto_cnmbr", "geometry"]
+# Subir este valor si cambia la preparación (limpieza, CRS, columnas calculadas)
+VERSION_CACHE = "3"
+EXTENSIONES_SHP = (".shp", ".dbf", ".shx", ".prj", ".cpg")
+
+
+def huella_shapefile(path_shp):
+    """Hash de los archivos que componen el shapefile (.shp/.dbf/.shx/.prj/.cpg)."""
+    h = hashlib.sha256(VERSION_CACHE.encode())
+    base = os.path.splitext(path_shp)[0]
+    for ext in EXTENSIONES_SHP:
+        ruta = base + ext
+        if not os.path.exists(ruta):
+            continue
+        h.update(ext.encode())
+        with open(ruta, "rb") as f:
+            for bloque in iter(lambda: f.read(1 << 20), b""):
+                h.update(bloque)
+    return h.hexdigest()[:16]
+
+
+def _ruta_cache(nombre, huella, filtro=None):
+    if filtro is None:
+        return os.path.join(CACHE_DIR, f"{nombre}_{huella}.parquet")
+    return os.path.join(CACHE_DIR, f"{nombre}_{huella}_{_nombre_archivo(filtro['departamento'])}.parquet")
+
+
+def _transformar_capa(gdf, nombre):
+    """Limpieza, reproyección a EPSG:3116 y área_km2 (salvo unidades de agregación) de un lote."""
+    gdf = limpiar_geometrias(gdf, copiar=False, nombre=nombre)
+    gdf = reproyectar_a_3116(gdf)[0]
+    if nombre not in CAPAS_UNIDADES:
+        gdf["area_km2"] = gdf.geometry.area / 1e6
+    return gdf
 
-    zrc_dep = gpd.overlay(zrc_3116, dep_3116[campos_dep], how="intersection")
-    res_dep = gpd.overlay(res_3116, dep_3116[campos_dep], how="intersection")
-    cc_dep  = gpd.overlay(cc_3116,  dep_3116[campos_dep], how="intersection")
-    cfa_dep = gpd.overlay(cfa_3116, dep_3116[campos_dep], how="intersection")
 
-    for gdf in (zrc_dep, res_dep, cc_dep, cfa_dep):
-        gdf["area_km2"] = gdf.geometry.area / 1e6
+def preparar_capa(nombre, path_shp, filtro=None, lote=None):
+    """
+    Carga (solo COLUMNAS_CAPAS), limpia, reproyecta a EPSG:3116 y calcula área_km2.
+    filtro (ver filtro_departamento) limita la lectura a las features que tocan
+    el departamento; lote lee y transforma por lotes de ese número de features.
+    """
+    from ingesta import leer_capa
+    mascara, crs_mascara = (filtro["geometria"], filtro["crs"]) if filtro else (None, None)
+    gdf = leer_capa(
+        path_shp, COLUMNAS_CAPAS.get(nombre), mascara=mascara, crs_mascara=crs_mascara,
+        lote=lote, transformar=lambda parte: _transformar_capa(parte, nombre)
+    )
+    if filtro and nombre in ("dep", "mpio"):
+        gdf = gdf[gdf["dpto_cnmbr"] == filtro["departamento"]].reset_index(drop=True)
+    return gdf
+
+
+def _guardar_en_cache(nombre, huella, gdf, filtro=None):
+    """Escribe la capa en caché y elimina versiones anteriores de la misma capa."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    ruta = _ruta_cache(nombre, huella, filtro)
+    try:
+        gdf.to_parquet(ruta)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar '{nombre}' en caché ({e}); se continúa sin caché.")
+        return
+    # Se conservan los recortes por departamento de la misma huella
+    for viejo in glob.glob(os.path.join(CACHE_DIR, f"{nombre}_*.parquet")):
+        if not os.path.basename(viejo).startswith(f"{nombre}_{huella}"):
+            os.remove(viejo)
+
+
+def cargar_capa_preparada(nombre, usar_cache=True, filtro=None, lote=None, path_shp=None):
+    """
+    Devuelve una capa en EPSG:3116 ya limpia y con área_km2.
+    Se lee de la caché si la huella de su shapefile no ha cambiado;
+    si cambió (o no hay caché) se prepara desde el SHP y se vuelve a guardar.
+    Con filtro (ver filtro_departamento) se cachea aparte el recorte del departamento.
+    path_shp permite capas fuera de RUTAS_CAPAS/RUTAS_UNIDADES (p. ej. unidades propias).
+    """
+    path_shp = path_shp or RUTAS_CAPAS.get(nombre) or RUTAS_UNIDADES[nombre]
+    if not usar_cache:
+        return preparar_capa(nombre, path_shp, filtro, lote)
+
+    huella = huella_shapefile(path_shp)
+    ruta = _ruta_cache(nombre, huella, filtro)
+    if os.path.exists(ruta):
+        print(f"  {nombre}: desde caché ({huella})")
+        return gpd.read_parquet(ruta)
+
+    print(f"  {nombre}: preparando desde SHP ({huella})")
+    gdf = preparar_capa(nombre, path_shp, filtro, lote)
+    _guardar_en_cache(nombre, huella, gdf, filtro)
+    return gdf
+
+
+def cargar_capas_preparadas(usar_cache=True, workers=1, departamento=None, lote=None):
+    """
+    Devuelve cc_3116, res_3116, zrc_3116, cfa_3116, dep_3116 (ver cargar_capa_preparada).
+    departamento limita todas las capas a las features que tocan ese departamento.
+    """
+    print("Cargando capas geográficas desde:", SHAPES_DIR)
+    filtro = filtro_departamento(departamento) if departamento else None
+    if filtro:
+        print(f"  Filtro espacial: {filtro['departamento']}")
+    tareas = [(nombre, usar_cache, filtro, lote) for nombre in RUTAS_CAPAS]
+    return tuple(ejecutar_en_paralelo(cargar_capa_preparada, tareas, workers))
+
+
+def limpiar_cache():
+    """Borra todas las capas guardadas en la caché."""
+    if os.path.isdir(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
+    print("Caché eliminada:", CACHE_DIR)
 
+
+# ------------------------------------------------------------
+# 3. CORTES POR DEPARTAMENTO Y RANKING
+# ------------------------------------------------------------
+# Identificadores de tipo de shapely (get_type_id); constantes para no importar shapely al cargar el módulo
+TIPO_COLECCION = 7
+TIPOS_POLIGONO = (3, 6)  # Polygon, MultiPolygon
+
+
+def _solo_poligonos(geoms):
+    """
+    Parte poligonal de cada geometría (como gpd.overlay con keep_geom_type):
+    las colecciones se reducen a la unión de sus polígonos; lo que no es
+    polígono (contactos de borde en línea o punto) queda como None.
+    """
+    geoms = geoms.copy()
+    tipos = shapely.get_type_id(geoms)
+    for i in np.flatnonzero(tipos == TIPO_COLECCION):
+        partes = shapely.get_parts(geoms[i])
+        partes = partes[np.isin(shapely.get_type_id(partes), TIPOS_POLIGONO)]
+        geoms[i] = shapely.union_all(partes) if len(partes) else None
+    poligonal = np.isin(shapely.get_type_id(geoms), TIPOS_POLIGONO) & ~shapely.is_empty(geoms)
+    geoms[~poligonal] = None
+    return geoms
+
+
+def cortar_capa_por_departamento(gdf_3116, dep_3116, columnas=("dpto_cnmbr",)):
+    """
+    Intersecta una capa temática con departamentos (o con las unidades de otro
+    nivel, conservando `columnas`) y calcula área_km2 en cada corte.
+    Cada corte lleva id_figura (posición de la figura en su capa) para contar
+    figuras distintas al agregar cortes de varias unidades.
+
+    Mismo resultado que gpd.overlay(how="intersection"), pero los pares
+    figura-unidad salen de un STRtree y las figuras que la unidad contiene por
+    completo (la gran mayoría) conservan su geometría y su área sin recortarse;
+    solo se intersectan las que cruzan un límite.
+    """
+    gdf = gdf_3116.assign(id_figura=np.arange(len(gdf_3116)))
+    geoms = _geometrias(gdf)
+    geoms_dep = _geometrias(dep_3116)
+
+    # Árbol sobre las figuras y consulta con las unidades: cada unidad (pocas, con
+    # muchos vértices) se prepara una sola vez para todos sus predicados
+    shapely.prepare(geoms_dep)
+    idx_dep, idx_fig = shapely.STRtree(geoms).query(geoms_dep, predicate="intersects")
+    orden = np.lexsort((idx_dep, idx_fig))
+    idx_fig, idx_dep = idx_fig[orden], idx_dep[orden]
+
+    contenida = shapely.contains_properly(geoms_dep[idx_dep], geoms[idx_fig])
+    cortes = geoms[idx_fig]
+    borde = ~contenida
+    recortes = _solo_poligonos(shapely.intersection(geoms[idx_fig[borde]], geoms_dep[idx_dep[borde]]))
+    invalidos = ~shapely.is_valid(recortes) & ~shapely.is_missing(recortes)
+    recortes[invalidos] = _solo_poligonos(shapely.make_valid(recortes[invalidos]))
+    cortes[borde] = recortes
+
+    validos = ~shapely.is_missing(cortes)
+    idx_fig, idx_dep, cortes = idx_fig[validos], idx_dep[validos], cortes[validos]
+    gdf_dep = pd.concat([
+        gdf.drop(columns="geometry").iloc[idx_fig].reset_index(drop=True),
+        dep_3116[list(columnas)].iloc[idx_dep].reset_index(drop=True),
+    ], axis=1)
+    gdf_dep = gpd.GeoDataFrame(gdf_dep, geometry=cortes, crs=gdf_3116.crs)
+    gdf_dep["area_km2"] = shapely.area(cortes) / 1e6
+    print(f"  Cortes: {contenida[validos].sum()} de {len(cortes)} sin recorte (figura contenida en la unidad)")
+    return gdf_dep
+
+
+def cortar_por_departamento(cc_3116, res_3116, zrc_3116, cfa_3116, dep_3116, workers=1,
+                            columnas=("dpto_cnmbr",)):
+    """Intersecta cada capa temática con departamentos (o unidades) y calcula área_km2 en cada corte."""
+    tareas = [(gdf, dep_3116, columnas) for gdf in (zrc_3116, res_3116, cc_3116, cfa_3116)]
+    zrc_dep, res_dep, cc_dep, cfa_dep = ejecutar_en_paralelo(cortar_capa_por_departamento, tareas, workers)
     return zrc_dep, res_dep, cc_dep, cfa_dep
 
 
-def construir_ranking_departamental(zrc_dep, res_dep, cc_dep, cfa_dep):
-    """Construye tabla de conteos y áreas por departamento para cada figura."""
-    # Conteos
-    ranking_zrc = zrc_dep.groupby("dpto_cnmbr").size().rename("n_zrc")
-    ranking_res = res_dep.groupby("dpto_cnmbr").size().rename("n_res")
-    ranking_cc  = cc_dep.groupby("dpto_cnmbr").size().rename("n_cc")
-    ranking_cfa = cfa_dep.groupby("dpto_cnmbr").size().rename("n_cfa")
+def construir_ranking_departamental(zrc_dep, res_dep, cc_dep, cfa_dep, clave="dpto_cnmbr"):
+    """
+    Construye tabla de conteos y áreas por departamento para cada figura.
+    clave es la columna (o lista de columnas) de agrupación: con cortes por
+    municipio sirve tanto ["dpto_cnmbr", "mpio_cdpmp", "mpio_cnmbr"] como
+    "dpto_cnmbr", sin repetir el overlay. Una figura partida en varios cortes
+    de la misma unidad se cuenta una vez.
+    """
+    # Conteos (figuras distintas)
+    ranking_zrc = zrc_dep.groupby(clave)["id_figura"].nunique().rename("n_zrc")
+    ranking_res = res_dep.groupby(clave)["id_figura"].nunique().rename("n_res")
+    ranking_cc  = cc_dep.groupby(clave)["id_figura"].nunique().rename("n_cc")
+    ranking_cfa = cfa_dep.groupby(clave)["id_figura"].nunique().rename("n_cfa")
 
     # Áreas
-    area_zrc = zrc_dep.groupby("dpto_cnmbr")["area_km2"].sum().rename("area_zrc_km2")
-    area_res = res_dep.groupby("dpto_cnmbr")["area_km2"].sum().rename("area_res_km2")
-    area_cc  = cc_dep.groupby("dpto_cnmbr")["area_km2"].sum().rename("area_cc_km2")
-    area_cfa = cfa_dep.groupby("dpto_cnmbr")["area_km2"].sum().rename("area_cfa_km2")
+    area_zrc = zrc_dep.groupby(clave)["area_km2"].sum().rename("area_zrc_km2")
+    area_res = res_dep.groupby(clave)["area_km2"].sum().rename("area_res_km2")
+    area_cc  = cc_dep.groupby(clave)["area_km2"].sum().rename("area_cc_km2")
+    area_cfa = cfa_dep.groupby(clave)["area_km2"].sum().rename("area_cfa_km2")
 
     ranking_dep = pd.concat(
         [ranking_zrc, ranking_res, ranking_cc, ranking_cfa,
@@ -181,62 +591,147 @@ def construir_ranking_departamental(zrc_dep, res_dep, cc_dep, cfa_dep):
     ).fillna(0)
 
     ranking_dep = ranking_dep.sort_values("area_res_km2", ascending=False)
-    print("Ranking departamental construido. Filas:", ranking_dep.shape[0])
+    print(f"Ranking por {clave} construido. Filas:", ranking_dep.shape[0])
     return ranking_dep
 
 
 # ------------------------------------------------------------
 # 4. CÁLCULO DE SUPERPOSICIONES
 # ------------------------------------------------------------
+MOTORES_SUPERPOSICION = ("overlay", "strtree", "particion", "raster")
+
+# Figuras temáticas y su bit en la máscara de la partición planar
+FIGURAS = ("zrc", "res", "cc", "cfa")
+BIT_FIGURA = {nombre: 1 << i for i, nombre in enumerate(FIGURAS)}
+
+# Pares de figuras: (capa 1, capa 2, columna de salida en tabla_super)
+PARES_SUPERPOSICION = [
+    ("zrc", "res", "area_zrc_res_km2"),
+    ("zrc", "cc",  "area_zrc_cc_km2"),
+    ("zrc", "cfa", "area_zrc_cfa_km2"),
+    ("res", "cc",  "area_res_cc_km2"),
+    ("res", "cfa", "area_res_cfa_km2"),
+    ("cc",  "cfa", "area_cc_cfa_km2"),
+]
+
+
 def _overlay_geom(gdf1, gdf2):
     """Overlay de dos capas usando solo geometría."""
     return gpd.overlay(gdf1[["geometry"]], gdf2[["geometry"]], how="intersection")
 
 
-def _superficie_por_departamento(inter_geom, dep_3116, nombre_col):
+def _superficie_por_departamento(inter_geom, dep_3116, nombre_col, clave="dpto_cnmbr"):
     """Intersecta la geometría de superposición con departamentos y suma área_km2_inter."""
     inter_dep = gpd.overlay(
         inter_geom,
-        dep_3116[["dpto_cnmbr", "geometry"]],
+        dep_3116[[clave, "geometry"]],
         how="intersection"
     )
     inter_dep["area_km2_inter"] = inter_dep.geometry.area / 1e6
-    serie = inter_dep.groupby("dpto_cnmbr")["area_km2_inter"].sum().rename(nombre_col)
+    serie = inter_dep.groupby(clave)["area_km2_inter"].sum().rename(nombre_col)
     return serie
 
 
-def calcular_superposiciones(zrc_3116, res_3116, cc_3116, cfa_3116, dep_3116):
+def _geometrias(gdf):
+    """Arreglo NumPy de geometrías shapely de una capa."""
+    return np.asarray(gdf.geometry.values)
+
+
+def _intersecciones_strtree(geoms1, geoms2, arbol2):
     """
-    Calcula áreas de superposición entre:
-    - ZRC ∩ Resguardos
-    - ZRC ∩ CC
-    - ZRC ∩ CFA
-    - Resguardos ∩ CC
-    - Resguardos ∩ CFA
-    - CC ∩ CFA
-    Devuelve tabla_super por dpto.
+    Intersecciones reales entre dos arreglos de geometrías.
+    Consulta en bloque el STRtree de la segunda capa y solo construye
+    la geometría de los pares candidatos que efectivamente se intersectan.
     """
-    # 1. Intersecciones geométricas
-    zrc_res_inter = _overlay_geom(zrc_3116, res_3116)
-    zrc_cc_inter  = _overlay_geom(zrc_3116, cc_3116)
-    zrc_cfa_inter = _overlay_geom(zrc_3116, cfa_3116)
-    res_cc_inter  = _overlay_geom(res_3116, cc_3116)
-    res_cfa_inter = _overlay_geom(res_3116, cfa_3116)
-    cc_cfa_inter  = _overlay_geom(cc_3116,  cfa_3116)
-
-    # 2. Asignar departamento y sumar áreas
-    area_zrc_res = _superficie_por_departamento(zrc_res_inter, dep_3116, "area_zrc_res_km2")
-    area_zrc_cc  = _superficie_por_departamento(zrc_cc_inter,  dep_3116, "area_zrc_cc_km2")
-    area_zrc_cfa = _superficie_por_departamento(zrc_cfa_inter, dep_3116, "area_zrc_cfa_km2")
-    area_res_cc  = _superficie_por_departamento(res_cc_inter,  dep_3116, "area_res_cc_km2")
-    area_res_cfa = _superficie_por_departamento(res_cfa_inter, dep_3116, "area_res_cfa_km2")
-    area_cc_cfa  = _superficie_por_departamento(cc_cfa_inter,  dep_3116, "area_cc_cfa_km2")
-
-    tabla_super = pd.concat(
-        [area_zrc_res, area_zrc_cc, area_zrc_cfa,
-         area_res_cc, area_res_cfa, area_cc_cfa],
-        axis=1
-    ).fillna(0)
+    idx1, idx2 = arbol2.query(geoms1, predicate="intersects")
+    # Orden (idx1, idx2) fijo: las sumas por departamento no dependen del recorrido del árbol
+    orden = np.lexsort((idx2, idx1))
+    idx1, idx2 = idx1[orden], idx2[orden]
+    inter = shapely.intersection(geoms1[idx1], geoms2[idx2])
+    return inter[shapely.area(inter) > 0]
+
+
+def _superficie_por_departamento_strtree(inter, geoms_dep, nombres_dep, arbol_dep, nombre_col,
+                                         clave="dpto_cnmbr"):
+    """Reparte las intersecciones entre departamentos (STRtree) y suma área en km²."""
+    idx_inter, idx_dep = arbol_dep.query(inter, predicate="intersects")
+    areas = shapely.area(shapely.intersection(inter[idx_inter], geoms_dep[idx_dep])) / 1e6
+    serie = pd.Series(areas).groupby(nombres_dep[idx_dep]).sum().rename(nombre_col)
+    serie.index.name = clave
+    return serie[serie > 0]
+
+
+def _superposiciones_overlay(capas, dep_3116, clave="dpto_cnmbr"):
+    """Motor original: seis gpd.overlay entre figuras y seis más contra departamentos."""
+    series = []
+    for c1, c2, nombre_col in PARES_SUPERPOSICION:
+        inter_geom = _overlay_geom(capas[c1], capas[c2])
+        series.append(_superficie_por_departamento(inter_geom, dep_3116, nombre_col, clave))
+    return series
+
+
+def _superposiciones_un_departamento(capas, geom_dep, nombre_dep, clave="dpto_cnmbr"):
+    """
+    Seis superposiciones de un solo departamento (tarea del modo por departamento).
+    `capas` trae solo las figuras que tocan el departamento, en su orden original,
+    por lo que las sumas coinciden con las del motor strtree nacional.
+    """
+    geoms = {nombre: _geometrias(gdf) for nombre, gdf in capas.items()}
+    geoms_dep = np.array([geom_dep], dtype=object)
+    nombres_dep = np.array([nombre_dep], dtype=object)
+    arbol_dep = shapely.STRtree(geoms_dep)
+
+    series = []
+    for c1, c2, nombre_col in PARES_SUPERPOSICION:
+        inter = _intersecciones_strtree(geoms[c1], geoms[c2], shapely.STRtree(geoms[c2]))
+        series.append(_superficie_por_departamento_strtree(
+            inter, geoms_dep, nombres_dep, arbol_dep, nombre_col, clave
+        ))
+    return series
+
+
+def _superposiciones_por_departamento(capas, dep_3116, workers=1, clave="dpto_cnmbr"):
+    """Reparte el cálculo strtree por departamento (o unidad `clave`) entre varios procesos."""
+    arboles = {nombre: shapely.STRtree(_geometrias(gdf)) for nombre, gdf in capas.items()}
+
+    tareas = []
+    for nombre_dep, geom_dep in zip(dep_3116[clave], dep_3116.geometry):
+        subconjunto = {}
+        for nombre, gdf in capas.items():
+            idx = np.sort(arboles[nombre].query(geom_dep, predicate="intersects"))
+            subconjunto[nombre] = gdf.iloc[idx][["geometry"]]
+        tareas.append((subconjunto, geom_dep, nombre_dep, clave))
+
+    resultados = ejecutar_en_paralelo(_superposiciones_un_departamento, tareas, workers)
+
+    # Una serie por par, con los departamentos en el orden del groupby nacional
+    series = []
+    for i in range(len(PARES_SUPERPOSICION)):
+        serie = pd.concat([r[i] for r in resultados]).sort_index()
+        series.append(serie.groupby(level=0).sum())
+    return series
+
+
+def calcular_superposicion_par(gdf1, gdf2, dep_3116, nombre_col, motor="strtree", clave="dpto_cnmbr"):
+    """Área de superposición de un solo par de figuras por departamento (Serie nombre_col)."""
+    if motor == "overlay":
+        return _superficie_por_departamento(_overlay_geom(gdf1, gdf2), dep_3116, nombre_col, clave)
+    if motor != "strtree":
+        raise ValueError(f"Motor de superposición por pares no soportado: {motor!r}")
+
+    geoms2 = _geometrias(gdf2)
+    inter = _intersecciones_strtree(_geometrias(gdf1), geoms2, shapely.STRtree(geoms2))
+    geoms_dep = _geometrias(dep_3116)
+    return _superficie_por_departamento_strtree(
+        inter, geoms_dep, dep_3116[clave].to_numpy(), shapely.STRtree(geoms_dep), nombre_col, clave
+    )
+
+
+def armar_tabla_super(series, clave="dpto_cnmbr"):
+    """Une las seis series por par en tabla_super y calcula area_total_super_km2."""
+    tabla_super = pd.concat(series, axis=1).fillna(0)
+    # Garantiza las seis columnas aunque algún par no tenga superposición
+    tabla_super = tabla_super.reindex(columns=[p[2] for p in PARES_SUPERPOSICION], fill_value=0)
 
     tabla_super["area_total_super_km2"] = (
         tabla_super["area_zrc_res_km2"] +
@@ -246,12 +741,400 @@ def calcular_superposiciones(zrc_3116, res_3116, cc_3116, cfa_3116, dep_3116):
         tabla_super["area_res_cfa_km2"] +
         tabla_super["area_cc_cfa_km2"]
     )
+    tabla_super.index.name = clave
+    return tabla_super.sort_values("area_total_super_km2", ascending=False)
+
+
+def construir_particion_planar(capas, dep_3116, clave="dpto_cnmbr"):
+    """
+    Une los bordes de las cuatro capas temáticas y de departamentos en un único
+    arreglo planar (caras sin traslape) y etiqueta cada cara con:
+    - dpto_cnmbr (o `clave`): departamento que la contiene
+    - mascara: bits de las figuras (ZRC/RES/CC/CFA) que la cubren
+    - area_km2
+    Las caras fuera de todo departamento se descartan.
+    """
+    geoms = {nombre: _geometrias(gdf) for nombre, gdf in capas.items()}
+    geoms_dep = _geometrias(dep_3116)
+
+    # 1. Nodado de todos los bordes y poligonización en caras
+    bordes = shapely.boundary(np.concatenate([geoms_dep] + [geoms[f] for f in FIGURAS]))
+    red = shapely.union_all(bordes[~shapely.is_empty(bordes)])
+    caras = shapely.get_parts(shapely.polygonize(shapely.get_parts(red)))
+    puntos = shapely.point_on_surface(caras)
+
+    # 2. Departamento de cada cara
+    idx_cara, idx_dep = shapely.STRtree(geoms_dep).query(puntos, predicate="within")
+    dpto = np.full(len(caras), None, dtype=object)
+    dpto[idx_cara] = dep_3116[clave].to_numpy()[idx_dep]
+
+    # 3. Máscara de figuras que cubren cada cara
+    mascara = np.zeros(len(caras), dtype=np.uint8)
+    for nombre in FIGURAS:
+        idx_f, _ = shapely.STRtree(geoms[nombre]).query(puntos, predicate="within")
+        mascara[np.unique(idx_f)] |= BIT_FIGURA[nombre]
+
+    particion = gpd.GeoDataFrame(
+        {clave: dpto, "mascara": mascara, "area_km2": shapely.area(caras) / 1e6},
+        geometry=caras,
+        crs=dep_3116.crs
+    )
+    return particion[particion[clave].notna()].reset_index(drop=True)
+
+
+def _columna_combinacion(combo):
+    """Nombre de columna para una combinación de figuras, p. ej. area_zrc_res_cc_km2."""
+    return "area_" + "_".join(combo) + "_km2"
+
+
+# Pares, tríos y la combinación de las cuatro figuras
+COMBINACIONES_FIGURAS = [
+    combo for k in range(2, len(FIGURAS) + 1) for combo in itertools.combinations(FIGURAS, k)
+]
+
+
+def _superposiciones_particion(capas, dep_3116, clave="dpto_cnmbr"):
+    """
+    Motor de partición planar: una sola pasada geométrica para todas las combinaciones.
+    Cada columna area_<figuras>_km2 es el área cubierta al menos por esas figuras,
+    y area_total_super_km2 es el área cubierta por dos o más figuras (sin doble conteo).
+    """
+    return _tabla_desde_particion(construir_particion_planar(capas, dep_3116, clave), clave)
+
+
+def _tabla_desde_particion(particion, clave="dpto_cnmbr"):
+    """tabla_super a partir de áreas por (dpto_cnmbr, mascara), vectorial o en grilla."""
+    # Área por departamento y máscara (a lo sumo 16 máscaras por dpto)
+    por_mascara = particion.groupby([clave, "mascara"])["area_km2"].sum().unstack(fill_value=0)
+    mascaras = por_mascara.columns.to_numpy().astype(int)
+
+    tabla_super = pd.DataFrame(index=por_mascara.index)
+    for combo in COMBINACIONES_FIGURAS:
+        bits = sum(BIT_FIGURA[f] for f in combo)
+        cols = por_mascara.columns[(mascaras & bits) == bits]
+        tabla_super[_columna_combinacion(combo)] = por_mascara[cols].sum(axis=1)
+
+    n_figuras = np.array([bin(m).count("1") for m in mascaras])
+    tabla_super["area_total_super_km2"] = por_mascara[por_mascara.columns[n_figuras >= 2]].sum(axis=1)
+
+    # Solo departamentos con alguna superposición, como en los otros motores
+    tabla_super = tabla_super[tabla_super["area_total_super_km2"] > 0]
+    tabla_super.columns.name = None
+    return tabla_super
+
+
+def convergencia_raster(capas, dep_3116, resolucion=1000, clave="dpto_cnmbr"):
+    """Rasteriza las figuras y departamentos (o unidades `clave`) en una grilla EPSG:3116 de `resolucion` m."""
+    from raster import ConvergenciaRaster
+    t0 = time.perf_counter()
+    convergencia = ConvergenciaRaster(capas, BIT_FIGURA, dep_3116, resolucion, clave)
+    alto, ancho = convergencia.grilla.forma
+    print(f"Grilla {ancho}×{alto} celdas de {resolucion:g} m rasterizada en {time.perf_counter() - t0:.1f} s")
+    return convergencia
+
+
+def superposiciones_desde_raster(convergencia):
+    """
+    Motor raster: mismas columnas que el motor de partición (pares, tríos,
+    cuádruple y total sin doble conteo), aproximadas al tamaño de celda.
+    """
+    return _tabla_desde_particion(convergencia.particion(), convergencia.clave)
+
+
+def comparar_superposiciones(aproximada, exacta):
+    """
+    Error de una tabla_super aproximada frente a la exacta, por columna:
+    total exacto, total aproximado, error relativo del total y error absoluto
+    máximo por departamento (km²).
+    """
+    columnas = [c for c in aproximada.columns if c in exacta.columns]
+    deptos = aproximada.index.union(exacta.index)
+    a = aproximada.reindex(index=deptos, columns=columnas, fill_value=0)
+    e = exacta.reindex(index=deptos, columns=columnas, fill_value=0)
+    total_e, total_a = e.sum(), a.sum()
+    errores = pd.DataFrame({
+        "total_exacto_km2": total_e,
+        "total_aproximado_km2": total_a,
+        "error_relativo_pct": (total_a - total_e).abs() / total_e.where(total_e > 0) * 100,
+        "error_max_departamento_km2": (a - e).abs().max(),
+    })
+    errores.index.name = "columna"
+    return errores
+
+
+def calcular_superposiciones(zrc_3116, res_3116, cc_3116, cfa_3116, dep_3116, motor="strtree",
+                             workers=1, por_departamento=False, resolucion=1000, convergencia=None,
+                             clave="dpto_cnmbr"):
+    """
+    Calcula áreas de superposición entre:
+    - ZRC ∩ Resguardos
+    - ZRC ∩ CC
+    - ZRC ∩ CFA
+    - Resguardos ∩ CC
+    - Resguardos ∩ CFA
+    - CC ∩ CFA
+    Devuelve tabla_super por dpto.
+
+    motor:
+    - "strtree": índice espacial por capa + intersecciones vectorizadas (por defecto);
+      pasa por la tabla de hechos de fragmentos (ver construir_hechos_superposicion).
+    - "overlay": doce gpd.overlay (ruta original, útil para comparar resultados).
+    - "particion": partición planar única; agrega tríos y cuádruple, y un
+      area_total_super_km2 sin doble conteo (ver _superposiciones_particion).
+    - "raster": las mismas columnas que "particion", aproximadas en una grilla
+      de `resolucion` m (segundos a escala nacional; ver raster.py). Se puede
+      pasar una `convergencia` ya rasterizada para no repetir la grilla.
+
+    workers > 1 calcula los seis pares en procesos separados; con
+    por_departamento=True (motor strtree) reparte en cambio los departamentos.
+    El resultado es idéntico al de la ruta secuencial.
+
+    clave: columna de dep_3116 que identifica cada unidad (dpto_cnmbr, o
+    id_unidad con las unidades de cargar_unidades; ver agregar_por_unidad).
+    """
+    if motor not in MOTORES_SUPERPOSICION:
+        raise ValueError(f"Motor de superposición no soportado: {motor!r}")
+    if por_departamento and motor != "strtree":
+        raise ValueError("El modo por departamento solo está disponible con el motor strtree.")
+
+    capas = {"zrc": zrc_3116, "res": res_3116, "cc": cc_3116, "cfa": cfa_3116}
+    t0 = time.perf_counter()
+
+    if motor == "particion":
+        tabla_super = _superposiciones_particion(capas, dep_3116, clave)
+    elif motor == "raster":
+        convergencia = convergencia or convergencia_raster(capas, dep_3116, resolucion, clave)
+        tabla_super = superposiciones_desde_raster(convergencia)
+    elif motor == "strtree" and not por_departamento:
+        # Fragmentos (par × unidad) con índice espacial, resumidos por unidad
+        hechos = construir_hechos_superposicion(capas, dep_3116, [clave], workers)
+        tabla_super = resumir_superposiciones(hechos, clave)
+    else:
+        # 1. Intersecciones geométricas y 2. asignación a departamento
+        if por_departamento:
+            series = _superposiciones_por_departamento(capas, dep_3116, workers, clave)
+        elif workers > 1:
+            tareas = [(capas[c1], capas[c2], dep_3116, col, motor, clave) for c1, c2, col in PARES_SUPERPOSICION]
+            series = ejecutar_en_paralelo(calcular_superposicion_par, tareas, workers)
+        else:
+            series = _superposiciones_overlay(capas, dep_3116, clave)
+        tabla_super = armar_tabla_super(series, clave)
+
+    tabla_super.index.name = clave
 
     tabla_super = tabla_super.sort_values("area_total_super_km2", ascending=False)
-    print("Tabla de superposiciones construida. Filas:", tabla_super.shape[0])
+    print(f"Tabla de superposiciones construida (motor {motor}, {time.perf_counter() - t0:.1f} s). "
+          f"Filas: {tabla_super.shape[0]}")
     return tabla_super
 
 
+# ------------------------------------------------------------
+# 4.1 NIVELES DE AGREGACIÓN (MUNICIPIO → DEPARTAMENTO)
+# ------------------------------------------------------------
+# Los cortes y las superposiciones se calculan una sola vez en la unidad más
+# fina; las tablas por municipio (o por unidad propia) y por departamento se
+# obtienen sumando esas áreas, sin otro overlay por nivel.
+NIVELES_AGREGACION = ("departamento", "municipio", "personalizado")
+
+
+def cargar_unidades(nivel, dep_3116, usar_cache=True, ruta=None, campo=None,
+                    departamento=None, lote=None):
+    """
+    Unidades mínimas de cálculo (EPSG:3116) para un nivel de agregación.
+    Devuelve (unidades, clave, columnas):
+    - unidades: GeoDataFrame con id_unidad, dpto_cnmbr, las columnas del nivel y geometría
+    - clave: columna con la que corren cortes y motores de superposición
+    - columnas: columnas que identifican una unidad en las tablas del nivel
+
+    departamento: las unidades son los propios departamentos (clave dpto_cnmbr).
+    municipio: MGN_ADM_MPIO_GRAFICO.shp (cada municipio ya trae su dpto_cnmbr).
+    personalizado: polígonos de `ruta` identificados por `campo`; se cortan por
+    departamento para que cada pieza pertenezca a uno solo y se pueda agregar a ambos niveles.
+    """
+    if nivel == "departamento":
+        return dep_3116, "dpto_cnmbr", ["dpto_cnmbr"]
+
+    filtro = filtro_departamento(departamento) if departamento else None
+    if nivel == "municipio":
+        unidades = cargar_capa_preparada("mpio", usar_cache, filtro, lote)
+        columnas = COLUMNAS_CAPAS["mpio"]
+    elif nivel == "personalizado":
+        if not ruta or not campo:
+            raise ValueError("El nivel personalizado requiere la ruta de las unidades y su campo identificador.")
+        unidades = cargar_capa_preparada("unidades", usar_cache, filtro, lote, path_shp=ruta)
+        if campo not in unidades.columns:
+            raise ValueError(f"{ruta} no tiene el campo '{campo}'.")
+        unidades = gpd.overlay(
+            unidades[[campo, "geometry"]], dep_3116[["dpto_cnmbr", "geometry"]], how="intersection"
+        )
+        columnas = [campo]
+    else:
+        raise ValueError(f"Nivel de agregación no soportado: {nivel!r}. Opciones: {NIVELES_AGREGACION}")
+
+    unidades = unidades[list(dict.fromkeys(["dpto_cnmbr"] + columnas)) + ["geometry"]].reset_index(drop=True)
+    unidades.insert(0, "id_unidad", np.arange(len(unidades)))
+    print(f"Unidades de nivel {nivel}: {len(unidades)}")
+    return unidades, "id_unidad", columnas
+
+
+def agregar_por_unidad(tabla, unidades, columnas):
+    """
+    Suma una tabla indexada por id_unidad (p. ej. tabla_super de las unidades
+    mínimas) en las unidades de `columnas`, p. ej. ["dpto_cnmbr"].
+    Todas las áreas de superposición son aditivas entre piezas disjuntas.
+    """
+    claves = unidades.set_index("id_unidad").loc[tabla.index, columnas]
+    agregada = tabla.groupby([claves[c].to_numpy() for c in columnas]).sum()
+    agregada.index.names = columnas
+    return agregada.sort_values("area_total_super_km2", ascending=False)
+
+
+# ------------------------------------------------------------
+# 4.2 TABLA DE HECHOS DE SUPERPOSICIÓN
+# ------------------------------------------------------------
+# Cada fila es un fragmento: la intersección de una figura de cada capa del
+# par dentro de una unidad administrativa, con su área. Las tablas por
+# departamento, región, municipio o total nacional son sumas de esta tabla
+# (pandas puro, milisegundos), sin volver a tocar geometrías.
+
+# Regiones del Plan Nacional de Desarrollo 2018-2022, por dpto_cnmbr normalizado
+REGIONES = {
+    "Caribe": ["ATLANTICO", "BOLIVAR", "CESAR", "CORDOBA", "LA GUAJIRA", "MAGDALENA", "SUCRE"],
+    "Seaflower": ["ARCHIPIELAGO DE SAN ANDRES, PROVIDENCIA Y SANTA CATALINA"],
+    "Pacífico": ["CHOCO", "VALLE DEL CAUCA", "CAUCA", "NARIÑO"],
+    "Central": ["BOGOTA, D.C.", "CUNDINAMARCA", "BOYACA", "TOLIMA", "HUILA"],
+    "Santanderes": ["SANTANDER", "NORTE DE SANTANDER"],
+    "Eje Cafetero y Antioquia": ["ANTIOQUIA", "CALDAS", "RISARALDA", "QUINDIO"],
+    "Llanos-Orinoquía": ["META", "CASANARE", "ARAUCA", "VICHADA"],
+    "Amazonía": ["AMAZONAS", "CAQUETA", "GUAINIA", "GUAVIARE", "PUTUMAYO", "VAUPES"],
+}
+REGION_DEPARTAMENTO = {
+    _normalizar_nombre(dep): region for region, deps in REGIONES.items() for dep in deps
+}
+
+
+def region_de_departamento(nombres):
+    """Región (ver REGIONES) de cada dpto_cnmbr; "Sin región" si el nombre no está en la lista."""
+    nombres = pd.Series(nombres)
+    unicos = pd.unique(nombres)
+    mapa = {n: REGION_DEPARTAMENTO.get(_normalizar_nombre(n), "Sin región") for n in unicos}
+    return nombres.map(mapa)
+
+
+def _fragmentos_par(geoms1, geoms2, arbol2, geoms_dep, arbol_dep):
+    """
+    Fragmentos de un par de capas: índices de figura 1, figura 2 y unidad, y
+    área (km²) de cada (figura 1 ∩ figura 2 ∩ unidad). Mismo recorrido que
+    _intersecciones_strtree + _superficie_por_departamento_strtree.
+    """
+    idx1, idx2 = arbol2.query(geoms1, predicate="intersects")
+    orden = np.lexsort((idx2, idx1))
+    idx1, idx2 = idx1[orden], idx2[orden]
+    inter = shapely.intersection(geoms1[idx1], geoms2[idx2])
+    validas = shapely.area(inter) > 0
+    idx1, idx2, inter = idx1[validas], idx2[validas], inter[validas]
+
+    idx_inter, idx_dep = arbol_dep.query(inter, predicate="intersects")
+    areas = shapely.area(shapely.intersection(inter[idx_inter], geoms_dep[idx_dep])) / 1e6
+    return idx1[idx_inter], idx2[idx_inter], idx_dep, areas
+
+
+def _tabla_fragmentos(par, fragmentos, dep_3116, columnas):
+    """DataFrame de los fragmentos de un par con las columnas de la unidad (sin los de área 0)."""
+    c1, c2, nombre_col = par
+    idx1, idx2, idx_dep, areas = fragmentos
+    tabla = pd.DataFrame({"par": nombre_col, "figura_1": c1, "id_1": idx1, "figura_2": c2, "id_2": idx2})
+    for col in columnas:
+        tabla[col] = dep_3116[col].to_numpy()[idx_dep]
+    tabla["area_km2"] = areas
+    return tabla[areas > 0]
+
+
+def hechos_superposicion_par(gdf1, gdf2, dep_3116, par, columnas=("dpto_cnmbr",)):
+    """Fragmentos de un solo par (tarea de construir_hechos_superposicion con workers > 1)."""
+    geoms2 = _geometrias(gdf2)
+    geoms_dep = _geometrias(dep_3116)
+    fragmentos = _fragmentos_par(
+        _geometrias(gdf1), geoms2, shapely.STRtree(geoms2), geoms_dep, shapely.STRtree(geoms_dep)
+    )
+    return _tabla_fragmentos(par, fragmentos, dep_3116, columnas)
+
+
+def construir_hechos_superposicion(capas, dep_3116, columnas=("dpto_cnmbr",), workers=1):
+    """
+    Tabla de hechos de las seis superposiciones por pares:
+    fragmento, par, figura_1, id_1, figura_2, id_2, <columnas de la unidad>, [region], area_km2.
+
+    id_1/id_2 son posiciones en cada capa; `columnas` son columnas de dep_3116
+    (dpto_cnmbr, o id_unidad y las del municipio con cargar_unidades). Si
+    incluye dpto_cnmbr se agrega la región. Ver resumir_superposiciones.
+    """
+    columnas = list(columnas)
+    if workers > 1:
+        tareas = [(capas[par[0]], capas[par[1]], dep_3116, par, columnas) for par in PARES_SUPERPOSICION]
+        partes = ejecutar_en_paralelo(hechos_superposicion_par, tareas, workers)
+    else:
+        geoms = {nombre: _geometrias(gdf) for nombre, gdf in capas.items()}
+        arboles = {nombre: shapely.STRtree(g) for nombre, g in geoms.items()}
+        geoms_dep = _geometrias(dep_3116)
+        arbol_dep = shapely.STRtree(geoms_dep)
+        partes = [
+            _tabla_fragmentos(par, _fragmentos_par(geoms[par[0]], geoms[par[1]], arboles[par[1]],
+                                                   geoms_dep, arbol_dep), dep_3116, columnas)
+            for par in PARES_SUPERPOSICION
+        ]
+
+    return _completar_hechos(partes, columnas)
+
+
+def _completar_hechos(partes, columnas):
+    """Une tablas de fragmentos: numera los fragmentos, pasa par/figuras a category y agrega la región."""
+    hechos = pd.concat(partes, ignore_index=True)
+    hechos.insert(0, "fragmento", np.arange(len(hechos)))
+    for col in ("par", "figura_1", "figura_2"):
+        hechos[col] = hechos[col].astype(str).astype("category")
+    if "dpto_cnmbr" in columnas:
+        hechos.insert(hechos.columns.get_loc("area_km2"), "region",
+                      region_de_departamento(hechos["dpto_cnmbr"]).astype("category").array)
+    return hechos
+
+
+def resumir_superposiciones(hechos, por="dpto_cnmbr"):
+    """
+    tabla_super (seis pares y area_total_super_km2) agrupando la tabla de hechos por
+    una columna o lista de columnas (dpto_cnmbr, region, id_unidad, ...);
+    por=None da el total nacional en una sola fila.
+    """
+    if por is None:
+        claves = [pd.Series("Nacional", index=hechos.index, name="total")]
+    else:
+        claves = [hechos[c] for c in ([por] if isinstance(por, str) else por)]
+    nombres = [c.name for c in claves]
+
+    por_par = (
+        hechos.groupby(claves + [hechos["par"]], observed=True)["area_km2"].sum()
+        .unstack("par", fill_value=0)
+        .reindex(columns=[p[2] for p in PARES_SUPERPOSICION], fill_value=0.0)
+    )
+    tabla_super = armar_tabla_super([por_par[col] for col in por_par.columns], nombres[0])
+    tabla_super.index.names = nombres
+    return tabla_super
+
+
+def exportar_hechos(hechos):
+    """
+    Tabla de hechos en tablas/hechos_superposicion.parquet y sus resúmenes por
+    región y nacional en tablas/superposicion_<nivel>.parquet/.csv.
+    """
+    hechos.to_parquet(os.path.join(TABLAS_DIR, "hechos_superposicion.parquet"), index=False)
+    resumenes = {"nacional": resumir_superposiciones(hechos, None)}
+    if "region" in hechos.columns:
+        resumenes["region"] = resumir_superposiciones(hechos, "region")
+    for nivel, tabla in resumenes.items():
+        _escribir_columnar(tabla, os.path.join(TABLAS_DIR, f"superposicion_{nivel}"))
+    print(f"Tabla de hechos ({len(hechos)} fragmentos) y resúmenes en:", TABLAS_DIR)
+
+
 # ------------------------------------------------------------
 # 5. TABLAS FINALES Y EXPORTACIÓN (EXCEL + JSON)
 # ------------------------------------------------------------
@@ -262,64 +1145,144 @@ def construir_tabla_final(ranking_dep, tabla_super):
     return tabla_final
 
 
-def exportar_tablas(tabla_super, tabla_final):
-    """Exporta tablas a Excel y JSON para el micrositio."""
-    path_super_xlsx = os.path.join(TABLAS_DIR, "tabla_superposicion_departamento.xlsx")
-    path_final_num  = os.path.join(TABLAS_DIR, "tabla_final_geografica_numeric.xlsx")
-    path_final_form = os.path.join(TABLAS_DIR, "tabla_final_geografica_formateada.xlsx")
-    path_json_min   = os.path.join(MICRO_DIR,  "tabla_final_min.json")
+def _motor_excel():
+    """xlsxwriter (más rápido) si está instalado; si no, el motor por defecto de pandas."""
+    return "xlsxwriter" if importlib.util.find_spec("xlsxwriter") else None
 
-    # Versiones formateadas
-    tabla_super_form = tabla_super.applymap(formato_col)
-    tabla_final_form = tabla_final.applymap(formato_col)
 
-    tabla_super_form.to_excel(path_super_xlsx)
-    tabla_final.to_excel(path_final_num)
-    tabla_final_form.to_excel(path_final_form)
+def _escribir_libro(ruta, hojas):
+    """Un solo libro Excel con una hoja por tabla ({nombre_hoja: DataFrame})."""
+    with pd.ExcelWriter(ruta, engine=_motor_excel()) as libro:
+        for nombre, df in hojas.items():
+            df.to_excel(libro, sheet_name=nombre)
 
-    # JSON mínimo para frontend
-    cols_min = [
+
+def _escribir_columnar(df, ruta_base):
+    """tabla en <ruta_base>.parquet y <ruta_base>.csv (índice como columna)."""
+    plano = df.reset_index()
+    plano.to_parquet(ruta_base + ".parquet", index=False)
+    plano.to_csv(ruta_base + ".csv", index=False, encoding="utf-8-sig")
+
+
+def columnas_micrositio(tabla_final):
+    """Columnas de tabla_final que se publican en el micrositio (JSON mínimo y fragmentos)."""
+    columnas = [
         "n_zrc", "n_res", "n_cc", "n_cfa",
         "area_zrc_km2", "area_res_km2", "area_cc_km2", "area_cfa_km2",
         "area_zrc_res_km2", "area_zrc_cc_km2", "area_zrc_cfa_km2",
         "area_res_cc_km2", "area_res_cfa_km2", "area_cc_cfa_km2",
         "area_total_super_km2"
     ]
-    tabla_min = tabla_final[cols_min].reset_index()
-    tabla_min.to_json(path_json_min, orient="records", force_ascii=False, indent=2)
+    # Tríos y cuádruple (solo con el motor "particion")
+    columnas += [
+        _columna_combinacion(c) for c in COMBINACIONES_FIGURAS
+        if len(c) > 2 and _columna_combinacion(c) in tabla_final.columns
+    ]
+    return columnas
+
+
+def exportar_tablas(tabla_super, tabla_final):
+    """
+    Exporta las tablas en una sola etapa:
+    - tablas/tablas_convergencia.xlsx: un libro con hojas numéricas y formateadas
+    - tablas/<tabla>.parquet y .csv: salidas columnares para otros procesos
+    - micrositio/tabla_final_min.json
+    Las escrituras son independientes y se hacen en paralelo (hilos: E/S).
+    """
+    path_libro     = os.path.join(TABLAS_DIR, "tablas_convergencia.xlsx")
+    path_super     = os.path.join(TABLAS_DIR, "tabla_superposicion_departamento")
+    path_final     = os.path.join(TABLAS_DIR, "tabla_final_geografica")
+    path_json_min  = os.path.join(MICRO_DIR,  "tabla_final_min.json")
+
+    # Versiones formateadas (vectorizadas por columna)
+    hojas = {
+        "tabla_final": tabla_final,
+        "tabla_final_formateada": formatear_tabla(tabla_final),
+        "superposiciones": tabla_super,
+        "superposiciones_formateada": formatear_tabla(tabla_super),
+    }
+
+    # JSON mínimo para frontend
+    tabla_min = tabla_final[columnas_micrositio(tabla_final)].reset_index()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futuros = [
+            pool.submit(_escribir_libro, path_libro, hojas),
+            pool.submit(_escribir_columnar, tabla_final, path_final),
+            pool.submit(_escribir_columnar, tabla_super, path_super),
+            pool.submit(tabla_min.to_json, path_json_min, orient="records", force_ascii=False, indent=2),
+        ]
+        for futuro in futuros:
+            futuro.result()
 
     print("Tablas exportadas en:", TABLAS_DIR)
     print("JSON para micrositio en:", path_json_min)
 
 
+def exportar_tabla_nivel(tabla, nivel):
+    """tabla_final de un nivel en tablas/tabla_final_<nivel>.xlsx (numérica y formateada), .parquet y .csv."""
+    ruta_base = os.path.join(TABLAS_DIR, f"tabla_final_{nivel}")
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futuros = [
+            pool.submit(_escribir_libro, ruta_base + ".xlsx", {
+                "tabla_final": tabla,
+                "tabla_final_formateada": formatear_tabla(tabla),
+            }),
+            pool.submit(_escribir_columnar, tabla, ruta_base),
+        ]
+        for futuro in futuros:
+            futuro.result()
+    print(f"Tabla por {nivel} en:", ruta_base + ".xlsx")
+
+
 # ------------------------------------------------------------
 # 6. MAPAS INTERACTIVOS (FULL Y LIGHT)
 # ------------------------------------------------------------
-def construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final):
-    """Mapa multicapas detallado (no optimizado para web masiva)."""
-    dep_map = dep_3116.to_crs(4326).copy()
-    zrc_map = zrc_3116.to_crs(4326).copy()
-    res_map = res_3116.to_crs(4326).copy()
-    cc_map  = cc_3116.to_crs(4326).copy()
-    cfa_map = cfa_3116.to_crs(4326).copy()
-
-    # Unir tabla_final por departamento
-    dep_map = dep_map.merge(
+def _geojson_capa(gdf, nombre, campos, datos_externos=False, geometria=None, **kwargs):
+    """
+    Capa folium con el GeoJSON compacto de gdf: solo `campos`, coordenadas
+    redondeadas y escritura por lotes. `geometria` reemplaza la geometría de
+    gdf (p. ej. la simplificada) sin copiar la capa.
+    Incrustada, el texto compacto se inserta tal cual en el HTML (sin archivo
+    intermedio ni volver a serializarlo). Con datos_externos=True se escribe
+    en mapas/datos/<nombre>.geojson y el navegador lo descarga al abrir el mapa
+    (requiere servirlo por HTTP, p. ej. GitHub Pages).
+    """
+    from geojson_compacto import GeoJsonCompacto, escribir_geojson_compacto, geojson_compacto
+
+    if not datos_externos:
+        return GeoJsonCompacto(gdf, campos, texto=geojson_compacto(gdf, campos, geometria=geometria,
+                                                                   con_id=True), **kwargs)
+
+    ruta = os.path.join(MAPAS_DIR, "datos", f"{nombre}.geojson")
+    escribir_geojson_compacto(gdf, ruta, campos, geometria=geometria, con_id=True)
+    return GeoJsonCompacto(gdf, campos, url=os.path.relpath(ruta, MAPAS_DIR).replace(os.sep, "/"),
+                           **kwargs)
+
+
+def preparar_departamentos_mapa(dep_3116, tabla_final):
+    """
+    Departamentos con tabla_final y columnas *_txt para tooltips (solo dpto_cnmbr + geometría
+    de la capa original). Se construye una vez y lo comparten todos los mapas.
+    """
+    dep_map = dep_3116[["dpto_cnmbr", "geometry"]].merge(
         tabla_final,
         how="left",
         left_on="dpto_cnmbr",
         right_index=True
     ).fillna(0)
 
-    # Columnas *_txt para tooltips
-    for col in tabla_final.columns:
-        dep_map[col + "_txt"] = dep_map[col].apply(formato_col)
+    textos = formatear_tabla(dep_map[tabla_final.columns]).add_suffix("_txt")
+    return dep_map.join(textos)
 
-    dep_map = fix_dates_any(dep_map)
-    zrc_map = fix_dates_any(zrc_map)
-    res_map = fix_dates_any(res_map)
-    cc_map  = fix_dates_any(cc_map)
-    cfa_map = fix_dates_any(cfa_map)
+
+def construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final,
+                        datos_externos=False, dep_map=None):
+    """Mapa multicapas detallado (no optimizado para web masiva)."""
+    # Unir tabla_final por departamento (columnas *_txt para tooltips)
+    if dep_map is None:
+        dep_map = preparar_departamentos_mapa(dep_3116, tabla_final)
+    campos_dep = ["dpto_cnmbr"] + [col + "_txt" for col in tabla_final.columns]
 
     m = folium.Map(
         location=[4.5, -74.1],
@@ -328,8 +1291,8 @@ def construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_f
     )
 
     # Departamentos (resumen)
-    folium.GeoJson(
-        dep_map,
+    _geojson_capa(
+        dep_map, "full_dep", campos_dep, datos_externos,
         name="Departamentos (resumen por dpto)",
         style_function=lambda x: {
             "fillColor": "#ffffff",
@@ -343,7 +1306,7 @@ def construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_f
             "weight": 2,
             "fillOpacity": 0.4
         },
-        tooltip=GeoJsonTooltip(
+        tooltip=folium.GeoJsonTooltip(
             fields=[
                 "dpto_cnmbr",
                 "n_zrc_txt", "n_res_txt", "n_cc_txt", "n_cfa_txt",
@@ -375,8 +1338,8 @@ def construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_f
     ).add_to(m)
 
     # ZRC
-    folium.GeoJson(
-        zrc_map,
+    _geojson_capa(
+        zrc_3116, "full_zrc", CAMPOS_MAPA["zrc"], datos_externos,
         name="Zonas de Reserva Campesina (ZRC)",
         style_function=lambda x: {
             "fillColor": "#52ee2b",
@@ -390,15 +1353,15 @@ def construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_f
             "weight": 2,
             "fillOpacity": 0.45
         },
-        tooltip=GeoJsonTooltip(
+        tooltip=folium.GeoJsonTooltip(
             fields=["NOMBRE_ZON", "DEPARTAMEN", "MUNICIPIOS", "Año", "area_km2"],
             aliases=["ZRC:", "Departamento (original):", "Municipios:", "Año acto:", "Área (km²):"]
         )
     ).add_to(m)
 
     # Resguardos
-    folium.GeoJson(
-        res_map,
+    _geojson_capa(
+        res_3116, "full_res", CAMPOS_MAPA["res"], datos_externos,
         name="Resguardos Indígenas",
         style_function=lambda x: {
             "fillColor": "#1aa0e3",
@@ -412,15 +1375,15 @@ def construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_f
             "weight": 2,
             "fillOpacity": 0.45
         },
-        tooltip=GeoJsonTooltip(
+        tooltip=folium.GeoJsonTooltip(
             fields=["NOMBRE", "PUEBLO", "DEPARTAMEN", "MUNICIPIO", "AREA_TOTAL", "area_km2"],
             aliases=["Resguardo:", "Pueblo:", "Departamento (original):", "Municipio:", "Área fuente (ha):", "Área calculada (km²):"]
         )
     ).add_to(m)
 
     # Consejos Comunitarios
-    folium.GeoJson(
-        cc_map,
+    _geojson_capa(
+        cc_3116, "full_cc", CAMPOS_MAPA["cc"], datos_externos,
         name="Consejos Comunitarios Titulados",
         style_function=lambda x: {
             "fillColor": "#eb31b9",
@@ -434,15 +1397,15 @@ def construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_f
             "weight": 2,
             "fillOpacity": 0.45
         },
-        tooltip=GeoJsonTooltip(
+        tooltip=folium.GeoJsonTooltip(
             fields=["NOMBRE", "DEPARTAMEN", "MUNICIPIO", "AREA_TOTAL", "area_km2"],
             aliases=["Consejo:", "Departamento (original):", "Municipio:", "Área fuente (ha):", "Área calculada (km²):"]
         )
     ).add_to(m)
 
     # CFA
-    folium.GeoJson(
-        cfa_map,
+    _geojson_capa(
+        cfa_3116, "full_cfa", CAMPOS_MAPA["cfa"], datos_externos,
         name="Zonas en Conflicto Armado (CFA)",
         style_function=lambda x: {
             "fillColor": "#e31a1c",
@@ -456,7 +1419,7 @@ def construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_f
             "weight": 2,
             "fillOpacity": 0.45
         },
-        tooltip=GeoJsonTooltip(
+        tooltip=folium.GeoJsonTooltip(
             fields=["MpNombre", "Departamen", "Municipio", "MpCategor", "MpAltitud", "MpArea"],
             aliases=[
                 "Municipio (CFA):",
@@ -477,63 +1440,30 @@ def construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_f
     print("Mapa FULL creado en:", output_map_full)
 
 
-def construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final):
+def construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final,
+                         datos_externos=False, dep_map=None):
     """Mapa multicapas simplificado (geometrías simplificadas, menos columnas)."""
-    # Simplificar geometrías en EPSG:3116
-    dep_s = dep_3116.copy()
-    dep_s["geometry"] = dep_s.geometry.simplify(1500)
-
-    zrc_s = zrc_3116.copy()
-    zrc_s["geometry"] = zrc_s.geometry.simplify(1000)
-
-    res_s = res_3116.copy()
-    res_s["geometry"] = res_s.geometry.simplify(1000)
-
-    cc_s = cc_3116.copy()
-    cc_s["geometry"] = cc_s.geometry.simplify(1000)
-
-    cfa_s = cfa_3116.copy()
-    cfa_s["geometry"] = cfa_s.geometry.simplify(1000)
-
-    # Pasar a WGS84
-    dep_map = dep_s.to_crs(4326)
-    zrc_map = zrc_s.to_crs(4326)
-    res_map = res_s.to_crs(4326)
-    cc_map  = cc_s.to_crs(4326)
-    cfa_map = cfa_s.to_crs(4326)
-
-    # Unir tabla_final con departamentos
-    dep_map = dep_map.merge(
-        tabla_final,
-        how="left",
-        left_on="dpto_cnmbr",
-        right_index=True
-    ).fillna(0)
-
-    # *_txt para tooltips
-    for col in tabla_final.columns:
-        dep_map[col + "_txt"] = dep_map[col].apply(formato_col)
-
-    # Fix fechas
-    dep_map = fix_dates_any(dep_map)
-    zrc_map = fix_dates_any(zrc_map)
-    res_map = fix_dates_any(res_map)
-    cc_map  = fix_dates_any(cc_map)
-    cfa_map = fix_dates_any(cfa_map)
-
-    # Dejar solo columnas necesarias
-    dep_keep = ["dpto_cnmbr"] + [c for c in dep_map.columns if c.endswith("_txt")] + ["geometry"]
-    dep_map = dep_map[dep_keep]
-
-    zrc_keep = ["NOMBRE_ZON", "DEPARTAMEN", "MUNICIPIOS", "Año", "area_km2", "geometry"]
-    res_keep = ["NOMBRE", "PUEBLO", "DEPARTAMEN", "MUNICIPIO", "AREA_TOTAL", "area_km2", "geometry"]
-    cc_keep  = ["NOMBRE", "DEPARTAMEN", "MUNICIPIO", "AREA_TOTAL", "area_km2", "geometry"]
-    cfa_keep = ["MpNombre", "Departamen", "Municipio", "MpCategor", "MpAltitud", "MpArea", "geometry"]
-
-    zrc_map = zrc_map[zrc_keep]
-    res_map = res_map[res_keep]
-    cc_map  = cc_map[cc_keep]
-    cfa_map = cfa_map[cfa_keep]
+    from simplificacion import simplificar_topologia
+    # Simplificar geometrías en EPSG:3116 sobre arcos compartidos (sin huecos entre vecinos).
+    # Solo se generan las geometrías; los atributos se leen de las capas originales.
+    dep_s = simplificar_topologia(dep_3116, 1500)
+    zrc_s = simplificar_topologia(zrc_3116, 1000)
+    res_s = simplificar_topologia(res_3116, 1000)
+    cc_s  = simplificar_topologia(cc_3116,  1000)
+    cfa_s = simplificar_topologia(cfa_3116, 1000)
+
+    for nombre, original, simple in (("dep", dep_3116, dep_s), ("zrc", zrc_3116, zrc_s),
+                                     ("res", res_3116, res_s), ("cc", cc_3116, cc_s),
+                                     ("cfa", cfa_3116, cfa_s)):
+        print(f"  {nombre}: {shapely.get_num_coordinates(original.geometry.values).sum()} → "
+              f"{shapely.get_num_coordinates(simple).sum()} vértices")
+
+    # Unir tabla_final con departamentos (*_txt para tooltips)
+    if dep_map is None:
+        dep_map = preparar_departamentos_mapa(dep_3116, tabla_final)
+    campos_dep = ["dpto_cnmbr"] + [col + "_txt" for col in tabla_final.columns]
+
+    # Las columnas necesarias, fechas y WGS84 las resuelve el GeoJSON compacto
 
     m_light = folium.Map(
         location=[4.5, -74.1],
@@ -542,8 +1472,8 @@ def construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_
     )
 
     # Departamentos
-    folium.GeoJson(
-        dep_map,
+    _geojson_capa(
+        dep_map, "light_dep", campos_dep, datos_externos, geometria=dep_s,
         name="Departamentos (resumen por dpto)",
         style_function=lambda x: {
             "fillColor": "#ffffff",
@@ -557,7 +1487,7 @@ def construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_
             "weight": 2,
             "fillOpacity": 0.4
         },
-        tooltip=GeoJsonTooltip(
+        tooltip=folium.GeoJsonTooltip(
             fields=[
                 "dpto_cnmbr",
                 "n_zrc_txt", "n_res_txt", "n_cc_txt", "n_cfa_txt",
@@ -589,8 +1519,8 @@ def construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_
     ).add_to(m_light)
 
     # ZRC
-    folium.GeoJson(
-        zrc_map,
+    _geojson_capa(
+        zrc_3116, "light_zrc", CAMPOS_MAPA["zrc"], datos_externos, geometria=zrc_s,
         name="Zonas de Reserva Campesina (ZRC)",
         style_function=lambda x: {
             "fillColor": "#57e719",
@@ -598,15 +1528,15 @@ def construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_
             "weight": 1,
             "fillOpacity": 0.25
         },
-        tooltip=GeoJsonTooltip(
+        tooltip=folium.GeoJsonTooltip(
             fields=["NOMBRE_ZON", "DEPARTAMEN", "MUNICIPIOS", "Año", "area_km2"],
             aliases=["ZRC:", "Departamento:", "Municipios:", "Año:", "Área (km²):"]
         )
     ).add_to(m_light)
 
     # Resguardos
-    folium.GeoJson(
-        res_map,
+    _geojson_capa(
+        res_3116, "light_res", CAMPOS_MAPA["res"], datos_externos, geometria=res_s,
         name="Resguardos Indígenas",
         style_function=lambda x: {
             "fillColor": "#1aa3e3",
@@ -614,15 +1544,15 @@ def construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_
             "weight": 1,
             "fillOpacity": 0.25
         },
-        tooltip=GeoJsonTooltip(
+        tooltip=folium.GeoJsonTooltip(
             fields=["NOMBRE", "PUEBLO", "DEPARTAMEN", "MUNICIPIO", "AREA_TOTAL", "area_km2"],
             aliases=["Resguardo:", "Pueblo:", "Departamento:", "Municipio:", "Área (ha):", "Área (km²):"]
         )
     ).add_to(m_light)
 
     # CC
-    folium.GeoJson(
-        cc_map,
+    _geojson_capa(
+        cc_3116, "light_cc", CAMPOS_MAPA["cc"], datos_externos, geometria=cc_s,
         name="Consejos Comunitarios Titulados",
         style_function=lambda x: {
             "fillColor": "#e313c0",
@@ -630,15 +1560,15 @@ def construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_
             "weight": 1,
             "fillOpacity": 0.25
         },
-        tooltip=GeoJsonTooltip(
+        tooltip=folium.GeoJsonTooltip(
             fields=["NOMBRE", "DEPARTAMEN", "MUNICIPIO", "AREA_TOTAL", "area_km2"],
             aliases=["Consejo:", "Departamento:", "Municipio:", "Área (ha):", "Área (km²):"]
         )
     ).add_to(m_light)
 
     # CFA
-    folium.GeoJson(
-        cfa_map,
+    _geojson_capa(
+        cfa_3116, "light_cfa", CAMPOS_MAPA["cfa"], datos_externos, geometria=cfa_s,
         name="Zonas en Conflicto Armado (CFA)",
         style_function=lambda x: {
             "fillColor": "#e31a1c",
@@ -646,7 +1576,7 @@ def construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_
             "weight": 1,
             "fillOpacity": 0.25
         },
-        tooltip=GeoJsonTooltip(
+        tooltip=folium.GeoJsonTooltip(
             fields=["MpNombre", "Departamen", "Municipio", "MpCategor", "MpAltitud", "MpArea"],
             aliases=[
                 "Municipio (CFA):",
@@ -667,17 +1597,162 @@ def construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_
     print("Mapa LIGHT creado en:", output_map_light)
 
 
+def reportar_niveles_detalle(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116):
+    """Vértices y bytes por capa y nivel de detalle (NIVELES_DETALLE) en tablas/niveles_detalle.csv."""
+    from simplificacion import niveles_de_detalle
+    capas = {"dep": dep_3116, "zrc": zrc_3116, "res": res_3116, "cc": cc_3116, "cfa": cfa_3116}
+    reporte = pd.concat(
+        [niveles_de_detalle(gdf, nombre)[1] for nombre, gdf in capas.items()],
+        ignore_index=True
+    )
+    path_csv = os.path.join(TABLAS_DIR, "niveles_detalle.csv")
+    reporte.to_csv(path_csv, index=False)
+    print(reporte.to_string(index=False))
+    print("Reporte de niveles de detalle en:", path_csv)
+    return reporte
+
+
+# ------------------------------------------------------------
+# 6.1 MAPA CON TESELAS VECTORIALES (CARGA BAJO DEMANDA)
+# ------------------------------------------------------------
+# Estilo y nombre visible de cada capa en el mapa de teselas
+ESTILOS_TESELAS = {
+    "dep": ("Departamentos (resumen por dpto)", "#555555", "#ffffff", 0.1),
+    "zrc": ("Zonas de Reserva Campesina (ZRC)", "#57e719", "#57e719", 0.25),
+    "res": ("Resguardos Indígenas", "#1aa3e3", "#1aa3e3", 0.25),
+    "cc":  ("Consejos Comunitarios Titulados", "#e313c0", "#e313c0", 0.25),
+    "cfa": ("Zonas en Conflicto Armado (CFA)", "#e31a1c", "#e31a1c", 0.25),
+}
+
+
+def construir_mapa_teselas(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final,
+                           zoom_min=4, zoom_max=10, dep_map=None):
+    """
+    Exporta una pirámide MVT por capa en mapas/teselas/<capa>/ y un mapa que
+    las carga bajo demanda (Leaflet.VectorGrid), en lugar de GeoJSON incrustado.
+    """
+    from teselas import PopupTeselas, exportar_teselas
+    from folium.plugins import VectorGridProtobuf
+    dir_teselas = os.path.join(MAPAS_DIR, "teselas")
+
+    if dep_map is None:
+        dep_map = preparar_departamentos_mapa(dep_3116, tabla_final)
+    dep_t = dep_map[["dpto_cnmbr"] + [col + "_txt" for col in tabla_final.columns] + ["geometry"]]
+
+    capas = {
+        "dep": dep_t,
+        "zrc": zrc_3116[CAMPOS_MAPA["zrc"] + ["geometry"]],
+        "res": res_3116[CAMPOS_MAPA["res"] + ["geometry"]],
+        "cc":  cc_3116[CAMPOS_MAPA["cc"] + ["geometry"]],
+        "cfa": cfa_3116[CAMPOS_MAPA["cfa"] + ["geometry"]],
+    }
+
+    m = folium.Map(
+        location=[4.5, -74.1],
+        zoom_start=5.2,
+        tiles="CartoDB positron"
+    )
+
+    for nombre, gdf in capas.items():
+        exportar_teselas(
+            fix_dates_any(gdf, copiar=False), os.path.join(dir_teselas, nombre), nombre,
+            zoom_min=zoom_min, zoom_max=zoom_max
+        )
+        titulo, color, relleno, opacidad = ESTILOS_TESELAS[nombre]
+        capa = VectorGridProtobuf(
+            f"teselas/{nombre}/{{z}}/{{x}}/{{y}}.pbf",
+            titulo,
+            {
+                "interactive": True,
+                "maxNativeZoom": zoom_max,
+                "vectorTileLayerStyles": {
+                    nombre: {
+                        "fill": True,
+                        "fillColor": relleno,
+                        "color": color,
+                        "weight": 1,
+                        "fillOpacity": opacidad
+                    }
+                }
+            }
+        ).add_to(m)
+        PopupTeselas().add_to(capa)
+
+    folium.LayerControl(collapsed=False).add_to(m)
+
+    output_map = os.path.join(MAPAS_DIR, "mapa_multicapas_superposicion_teselas.html")
+    m.save(output_map)
+    print("Mapa TESELAS creado en:", output_map)
+
+
+# ------------------------------------------------------------
+# 6.2 MAPA DE DENSIDAD DE CONVERGENCIA (GRILLA)
+# ------------------------------------------------------------
+def construir_mapa_densidad(dep_3116, convergencia, ancho_px=1200):
+    """
+    Mapa con el número de figuras superpuestas por celda (ver raster.py) sobre
+    los límites departamentales simplificados.
+    """
+    from simplificacion import simplificar_topologia
+    from raster import COLORES_DENSIDAD
+    from branca.colormap import StepColormap
+    imagen, limites = convergencia.imagen_densidad(ancho_px=ancho_px)
+
+    m = folium.Map(
+        location=[4.5, -74.1],
+        zoom_start=5.2,
+        tiles="CartoDB positron"
+    )
+
+    folium.raster_layers.ImageOverlay(
+        image=imagen,
+        bounds=limites,
+        name=f"Figuras superpuestas (celdas de {convergencia.grilla.resolucion:g} m)",
+        mercator_project=False,
+        interactive=False,
+    ).add_to(m)
+
+    _geojson_capa(
+        dep_3116, "densidad_dep", ["dpto_cnmbr"], geometria=simplificar_topologia(dep_3116, 1500),
+        name="Departamentos",
+        style_function=lambda x: {
+            "fillColor": "#ffffff",
+            "color": "#555555",
+            "weight": 1,
+            "fillOpacity": 0
+        },
+        tooltip=folium.GeoJsonTooltip(fields=["dpto_cnmbr"], aliases=["Departamento:"])
+    ).add_to(m)
+
+    leyenda = StepColormap(
+        [c[:3].tolist() for c in COLORES_DENSIDAD[1:]],
+        index=[1, 2, 3, 4, 5], vmin=1, vmax=5,
+        caption="Número de figuras superpuestas (ZRC, resguardo, consejo, CFA)"
+    )
+    leyenda.add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
+
+    output_map = os.path.join(MAPAS_DIR, "mapa_densidad_convergencia.html")
+    m.save(output_map)
+    print("Mapa DENSIDAD creado en:", output_map)
+
+
 # ------------------------------------------------------------
 # 7. LLM (OPCIONAL) – ANÁLISIS AUTOMÁTICO
 # ------------------------------------------------------------
 def configurar_llm():
-    """Configura el endpoint de Hugging Face desde variables de entorno."""
+    """
+    Configura el endpoint de Hugging Face desde variables de entorno.
+    HF_API_URL permite apuntar a otro endpoint compatible (p. ej. el simulador
+    local de llm.py para pruebas).
+    """
+    cargar_entorno()
     api_key = os.getenv("HF_API_KEY", "")
     if not api_key:
         print("HF_API_KEY no encontrado en .env – el análisis LLM será omitido.")
         return None, None
 
-    api_url = "https://api-inference.huggingface.co/models/google/gemma-1.1-7b-it"
+    api_url = os.getenv("HF_API_URL", "https://api-inference.huggingface.co/models/google/gemma-1.1-7b-it")
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -685,51 +1760,28 @@ def configurar_llm():
     return api_url, headers
 
 
-def llamar_llm(prompt: str, api_url: str, headers: dict, max_tokens: int = 700) -> str:
-    """Llama al modelo en Hugging Face. Devuelve texto generado o cadena vacía si falla."""
-    if not api_url or not headers:
-        return ""
+def _dir_cache_llm():
+    """Respuestas del LLM guardadas por hash de (endpoint, prompt, parámetros)."""
+    return os.path.join(CACHE_DIR, "llm")
 
-    payload = {
-        "inputs": prompt,
-        "parameters": {
-            "max_new_tokens": max_tokens,
-            "temperature": 0.3,
-            "do_sample": True,
-            "top_p": 0.9,
-            "return_full_text": False
-        }
-    }
 
-    try:
-        resp = requests.post(api_url, headers=headers, json=payload, timeout=120)
-        resp.raise_for_status()
-    except requests.HTTPError:
-        print("⚠️ Error al llamar al modelo de Hugging Face.")
-        try:
-            print("Status code:", resp.status_code)
-            print("Respuesta (primeros 500 caracteres):")
-            print(resp.text[:500])
-        except Exception:
-            pass
+def llamar_llm(prompt: str, api_url: str, headers: dict, max_tokens: int = 700) -> str:
+    """
+    Llama al modelo (con reintentos y caché en disco, ver llm.py).
+    Devuelve texto generado o cadena vacía si falla.
+    """
+    from llm import generar_textos
+    if not api_url or not headers:
         return ""
+    return generar_textos({"texto": prompt}, api_url, headers, _dir_cache_llm(), max_tokens=max_tokens)["texto"]
 
-    data = resp.json()
-    if isinstance(data, list) and len(data) > 0 and "generated_text" in data[0]:
-        return data[0]["generated_text"]
-    return str(data)
-
-
-def generar_analisis_llm(tabla_final: pd.DataFrame) -> str:
-    """Genera un análisis narrativo usando LLM (si hay API key)."""
-    api_url, headers = configurar_llm()
-    if not api_url:
-        return ""
 
+def prompt_general(tabla_final: pd.DataFrame) -> str:
+    """Prompt del análisis nacional a partir de tabla_final."""
     resumen_head = tabla_final.head(10).to_markdown()
     resumen_stats = tabla_final.describe().to_markdown()
 
-    prompt = f"""
+    return f"""
 Eres un analista de datos territoriales del Ministerio de Minas y Energía de Colombia.
 Tienes una tabla llamada 'tabla_final' con indicadores por departamento sobre cuatro figuras territoriales:
 - Zonas de Reserva Campesina (ZRC)
@@ -748,7 +1800,51 @@ Escribe un análisis narrado, claro y conciso (500-900 palabras) para un microsi
 Explica qué mide la tabla, resalta patrones y departamentos críticos, y la utilidad para planeación y transición energética.
 No repitas literalmente los números.
 """
-    texto = llamar_llm(prompt, api_url, headers)
+
+
+def prompt_departamento(nombre_dep, tabla_final: pd.DataFrame) -> str:
+    """Prompt del análisis de un departamento: su fila, su puesto y su peso en el total nacional."""
+    fila = tabla_final.loc[[nombre_dep]]
+    puesto = int(tabla_final["area_total_super_km2"].rank(ascending=False, method="min")[nombre_dep])
+    total = tabla_final["area_total_super_km2"].sum()
+    participacion = fila["area_total_super_km2"].iloc[0] / total * 100 if total > 0 else 0
+
+    return f"""
+Eres un analista de datos territoriales del Ministerio de Minas y Energía de Colombia.
+Estos son los indicadores del departamento {nombre_dep} sobre cuatro figuras territoriales
+(Zonas de Reserva Campesina, Resguardos Indígenas, Consejos Comunitarios y zonas afectadas
+por conflicto armado): conteos, áreas (km²) y áreas de superposición entre figuras.
+
+{formatear_tabla(fila).T.to_markdown()}
+
+Por área total superpuesta ocupa el puesto {puesto} de {len(tabla_final)} departamentos
+y concentra el {participacion:.1f} % del total nacional.
+
+Escribe un análisis breve (150-300 palabras) para la ficha del departamento en un micrositio público:
+qué figuras predominan, dónde se superponen y qué implica para la planeación y la transición energética.
+No repitas literalmente los números.
+"""
+
+
+def generar_analisis_llm(tabla_final: pd.DataFrame, departamentos: bool = False,
+                         concurrencia: int = 4) -> str:
+    """
+    Genera un análisis narrativo usando LLM (si hay API key).
+    Con departamentos=True genera además uno por departamento en la misma tanda
+    (a lo sumo `concurrencia` solicitudes simultáneas): llm/departamentos/<NOMBRE>.txt
+    y llm/analisis_departamentos.json. Las respuestas quedan en caché (cache/llm).
+    """
+    api_url, headers = configurar_llm()
+    if not api_url:
+        return ""
+    from llm import generar_textos
+
+    prompts = {None: prompt_general(tabla_final)}
+    if departamentos:
+        prompts.update({dep: prompt_departamento(dep, tabla_final) for dep in tabla_final.index})
+    textos = generar_textos(prompts, api_url, headers, _dir_cache_llm(), concurrencia=concurrencia)
+
+    texto = textos.pop(None)
     if texto:
         path_txt = os.path.join(LLM_DIR, "analisis_llm.txt")
         with open(path_txt, "w", encoding="utf-8") as f:
@@ -756,16 +1852,33 @@ No repitas literalmente los números.
         print("Análisis LLM guardado en:", path_txt)
     else:
         print("No se obtuvo respuesta del LLM.")
+
+    if departamentos:
+        dir_dep = os.path.join(LLM_DIR, "departamentos")
+        os.makedirs(dir_dep, exist_ok=True)
+        for dep, texto_dep in textos.items():
+            if texto_dep:
+                with open(os.path.join(dir_dep, f"{_nombre_archivo(dep)}.txt"), "w", encoding="utf-8") as f:
+                    f.write(texto_dep)
+        path_json = os.path.join(LLM_DIR, "analisis_departamentos.json")
+        with open(path_json, "w", encoding="utf-8") as f:
+            json.dump(textos, f, ensure_ascii=False, indent=2)
+        print(f"Análisis por departamento ({sum(map(bool, textos.values()))}/{len(textos)}) en:", dir_dep)
     return texto
 
 
 # ------------------------------------------------------------
 # 8. MICROSITIO – index.html
 # ------------------------------------------------------------
-def construir_micrositio(tabla_final: pd.DataFrame, texto_explicativo: str = None):
+def construir_micrositio(tabla_final: pd.DataFrame, texto_explicativo: str = None,
+                         mapa_rel: str = "../mapas/mapa_multicapas_superposicion_light.html",
+                         datos_rel: str = None):
     """
     Construye el archivo index.html del micrositio, incrustando el mapa LIGHT
-    y un bloque de texto explicativo (del LLM o generado automáticamente).
+    (o el indicado en mapa_rel, p. ej. el de teselas) y un bloque de texto
+    explicativo (del LLM o generado automáticamente).
+    Con datos_rel (p. ej. "datos") no hay iframe: la página dibuja el mapa con
+    Leaflet a partir de los datos fragmentados de construir_datos_micrositio.
     """
     if texto_explicativo is None or not texto_explicativo.strip():
         # Borrador simple con top 5 y total
@@ -792,14 +1905,27 @@ ordenamiento territorial, fundamentales para avanzar en la transición energéti
 enfoque territorial y diferencial.
 """.strip()
 
-    mapa_rel = "../mapas/mapa_multicapas_superposicion_light.html"
     salida_html = os.path.join(MICRO_DIR, "index.html")
 
+    cabecera, script = "", ""
+    mapa_html = f'<iframe src="{mapa_rel}" title="Mapa de superposición territorial"></iframe>'
+    detalle_html = ""
+    if datos_rel is not None:
+        from micrositio import cabecera_mapa, script_mapa
+        cabecera, script = cabecera_mapa(), script_mapa(datos_rel)
+        mapa_html = '<div id="mapa"></div>'
+        detalle_html = """<label for="selector-departamento">Departamento:</label>
+        <select id="selector-departamento">
+            <option value="">Selecciona un departamento o haz clic en el mapa</option>
+        </select>
+        <div id="detalle-departamento"></div>"""
+
     html = f"""<!DOCTYPE html>
 <html lang="es">
 <head>
     <meta charset="UTF-8">
     <title>Micrositio – Convergencia de figuras territoriales</title>
+    {cabecera}
     <style>
         body {{
             margin: 0;
@@ -827,12 +1953,30 @@ enfoque territorial y diferencial.
             flex: 2;
             min-width: 0;
         }}
-        .mapa-container iframe {{
+        .mapa-container iframe, #mapa {{
             width: 100%;
             height: 100%;
             border: none;
             box-shadow: 0 0 8px rgba(0,0,0,0.15);
         }}
+        #selector-departamento {{
+            width: 100%;
+            margin: 4px 0 12px;
+        }}
+        #detalle-departamento table {{
+            width: 100%;
+            border-collapse: collapse;
+            font-size: 13px;
+            margin-bottom: 16px;
+        }}
+        #detalle-departamento th {{
+            text-align: left;
+            font-weight: normal;
+            color: #555555;
+        }}
+        #detalle-departamento td {{
+            text-align: right;
+        }}
         .texto-container {{
             flex: 1;
             min-width: 280px;
@@ -873,58 +2017,1089 @@ enfoque territorial y diferencial.
 </header>
 <main>
     <section class="mapa-container">
-        <iframe src="{mapa_rel}" title="Mapa de superposición territorial"></iframe>
+        {mapa_html}
     </section>
     <section class="texto-container">
+        {detalle_html}
         <h2>¿Qué muestra este mapa?</h2>
         <pre>{texto_explicativo}</pre>
     </section>
 </main>
+{script}
 </body>
 </html>
 """
-    with open(salida_html, "w", encoding="utf-8") as f:
-        f.write(html)
+    if datos_rel is not None:
+        # También precomprimido: es parte de la primera carga
+        from micrositio import escribir_precomprimido
+        escribir_precomprimido(salida_html, html)
+    else:
+        with open(salida_html, "w", encoding="utf-8") as f:
+            f.write(html)
+        # Variantes precomprimidas de una corrida anterior quedarían desactualizadas
+        for extension in (".gz", ".br"):
+            if os.path.exists(salida_html + extension):
+                os.remove(salida_html + extension)
 
     print("Micrositio creado en:", salida_html)
 
 
 # ------------------------------------------------------------
-# 9. FUNCIÓN PRINCIPAL
+# 8.1 DATOS FRAGMENTADOS DEL MICROSITIO (CARGA BAJO DEMANDA)
 # ------------------------------------------------------------
-def main():
-    # 1. Carga
-    cc, res, zrc, cfa, dep = cargar_capas_base()
+# Etiquetas de las estadísticas de cada departamento (mismas que el mapa light)
+ETIQUETAS_MICROSITIO = {
+    "n_zrc": "N° ZRC",
+    "n_res": "N° Resguardos",
+    "n_cc": "N° Consejos",
+    "n_cfa": "N° CFA",
+    "area_zrc_km2": "Área ZRC (km²)",
+    "area_res_km2": "Área Resguardos (km²)",
+    "area_cc_km2": "Área CC (km²)",
+    "area_cfa_km2": "Área CFA (km²)",
+    "area_total_super_km2": "Área total superpuesta (km²)",
+}
+ABREVIATURAS_FIGURA = {"zrc": "ZRC", "res": "Res", "cc": "CC", "cfa": "CFA"}
+ETIQUETAS_MICROSITIO.update({
+    _columna_combinacion(c): "Área " + "∩".join(ABREVIATURAS_FIGURA[f] for f in c) + " (km²)"
+    for c in COMBINACIONES_FIGURAS
+})
+
+# Alias de CAMPOS_MAPA en los tooltips de los fragmentos
+ALIAS_MAPA = {
+    "zrc": ["ZRC", "Departamento", "Municipios", "Año", "Área (km²)"],
+    "res": ["Resguardo", "Pueblo", "Departamento", "Municipio", "Área (ha)", "Área (km²)"],
+    "cc":  ["Consejo", "Departamento", "Municipio", "Área (ha)", "Área (km²)"],
+    "cfa": ["Municipio (CFA)", "Departamento", "Municipio (Divipola)", "Categoría", "Altitud",
+            "Área oficial (km²)"],
+}
+
+
+def _fragmentos_capa(gdf, capa, dep_regional, tolerancia):
+    """
+    {departamento: FeatureCollection (texto)} con las figuras de una capa
+    simplificadas a `tolerancia` y recortadas a cada departamento. area_km2 es
+    la de la figura completa, como en los demás mapas.
+    """
+    from geojson_compacto import geojson_compacto
+    from simplificacion import simplificar_topologia
+
+    campos = CAMPOS_MAPA[capa]
+    simple = gpd.GeoDataFrame(gdf[campos], geometry=simplificar_topologia(gdf, tolerancia), crs=gdf.crs)
+    cortes = cortar_capa_por_departamento(simple, dep_regional)
+    if "area_km2" in campos:
+        cortes["area_km2"] = gdf["area_km2"].to_numpy()[cortes["id_figura"].to_numpy()]
+    decimales = cortes[campos].select_dtypes("float").columns
+    cortes[decimales] = cortes[decimales].round(2)
+    cortes = cortes.to_crs(4326)
+    return {
+        nombre: geojson_compacto(grupo, campos, decimales=4)
+        for nombre, grupo in cortes.groupby("dpto_cnmbr", sort=False)
+    }
 
-    # 2. Limpieza geométrica
-    cc, res, zrc, cfa, dep = preparar_capas_geom(cc, res, zrc, cfa, dep)
 
-    # 3. Reproyección y áreas
-    cc_3116, res_3116, zrc_3116, cfa_3116, dep_3116 = reproyectar_a_3116(cc, res, zrc, cfa, dep)
-    cc_3116, res_3116, zrc_3116, cfa_3116 = calcular_areas_km2(cc_3116, res_3116, zrc_3116, cfa_3116)
+def construir_datos_micrositio(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final,
+                               dep_map=None):
+    """
+    Datos del micrositio en micrositio/datos/, para que index.html cargue solo
+    lo que se ve:
+    - nacional.json: departamentos con la tolerancia "nacional" y su área superpuesta
+    - dep/<DEPARTAMENTO>.json: figuras de cada capa recortadas al departamento
+      (tolerancia "regional") y sus estadísticas de tabla_final
+    - manifest.json: índice de fragmentos, estilos y campos de cada capa
+    Cada archivo se escribe también como .gz (y .br si brotli está instalado).
+    Devuelve el manifiesto.
+    """
+    from geojson_compacto import geojson_compacto
+    from simplificacion import NIVELES_DETALLE, simplificar_topologia
+    from micrositio import (MANIFIESTO, VISTA_NACIONAL, DIR_FRAGMENTOS, VERSION_DATOS,
+                            compresiones_disponibles, escribir_precomprimido, bytes_primera_carga)
+
+    dir_datos = os.path.join(MICRO_DIR, "datos")
+    # Sin fragmentos de una corrida anterior (p. ej. de departamentos que ya no están)
+    shutil.rmtree(dir_datos, ignore_errors=True)
+    if dep_map is None:
+        dep_map = preparar_departamentos_mapa(dep_3116, tabla_final)
+
+    # Vista nacional: lo único que se descarga al abrir la página
+    escribir_precomprimido(
+        os.path.join(dir_datos, VISTA_NACIONAL),
+        geojson_compacto(
+            dep_map, ["dpto_cnmbr", "area_total_super_km2_txt"], decimales=3,
+            geometria=simplificar_topologia(dep_3116, NIVELES_DETALLE["nacional"]["tolerancia"])
+        )
+    )
+
+    # Figuras por departamento, recortadas a los departamentos simplificados con la misma tolerancia
+    tolerancia = NIVELES_DETALLE["regional"]["tolerancia"]
+    dep_regional = gpd.GeoDataFrame(
+        dep_3116[["dpto_cnmbr"]], geometry=simplificar_topologia(dep_3116, tolerancia), crs=dep_3116.crs
+    )
+    capas = {"zrc": zrc_3116, "res": res_3116, "cc": cc_3116, "cfa": cfa_3116}
+    por_capa = {capa: _fragmentos_capa(gdf, capa, dep_regional, tolerancia) for capa, gdf in capas.items()}
+
+    columnas = columnas_micrositio(tabla_final)
+    textos = dep_map.set_index("dpto_cnmbr")
+    vacia = '{"type":"FeatureCollection","features":[]}'
+    departamentos = {}
+    for nombre in dep_map["dpto_cnmbr"]:
+        fila = textos.loc[nombre]
+        encabezado = json.dumps({
+            "version": VERSION_DATOS,
+            "departamento": nombre,
+            "estadisticas": [[ETIQUETAS_MICROSITIO.get(c, c), fila[f"{c}_txt"]] for c in columnas],
+        }, ensure_ascii=False, separators=(",", ":"))
+        capas_json = ",".join(f'"{capa}":{por_capa[capa].get(nombre, vacia)}' for capa in capas)
+        archivo = f"{DIR_FRAGMENTOS}/{_nombre_archivo(nombre)}.json"
+        tam = escribir_precomprimido(os.path.join(dir_datos, archivo),
+                                     f'{encabezado[:-1]},"capas":{{{capas_json}}}}}')
+        departamentos[nombre] = {"archivo": archivo, "bytes": tam["json"], "bytes_gz": tam["gz"]}
+
+    manifiesto = {
+        "version": VERSION_DATOS,
+        "vista_nacional": VISTA_NACIONAL,
+        "comprimidos": compresiones_disponibles(),
+        "capas": {
+            capa: {
+                "nombre": ESTILOS_TESELAS[capa][0],
+                "color": ESTILOS_TESELAS[capa][1],
+                "relleno": ESTILOS_TESELAS[capa][2],
+                "opacidad": ESTILOS_TESELAS[capa][3],
+                "campos": [list(par) for par in zip(CAMPOS_MAPA[capa], ALIAS_MAPA[capa])],
+            }
+            for capa in capas
+        },
+        "departamentos": departamentos,
+    }
+    escribir_precomprimido(os.path.join(dir_datos, MANIFIESTO),
+                           json.dumps(manifiesto, ensure_ascii=False, separators=(",", ":")))
+
+    total_gz = sum(d["bytes_gz"] for d in departamentos.values())
+    print(f"Datos del micrositio en: {dir_datos}")
+    print(f"  Primera carga: {bytes_primera_carga(dir_datos) / 1024:.1f} KB (.gz); "
+          f"{len(departamentos)} fragmentos por departamento: {total_gz / 1024:.0f} KB (.gz) en total, "
+          f"máx. {max((d['bytes_gz'] for d in departamentos.values()), default=0) / 1024:.1f} KB")
+    return manifiesto
+
+
+# ------------------------------------------------------------
+# 9. EJECUCIÓN INCREMENTAL (GRAFO DE ETAPAS)
+# ------------------------------------------------------------
+CAPAS_TEMATICAS = ("zrc", "res", "cc", "cfa")
+
+
+def construir_grafo_pipeline(motor="strtree", usar_cache=True):
+    """
+    Declara el pipeline como grafo de etapas (ver etapas.py):
+    - capa:<x>     fuentes, con la huella del SHP como hash de contenido
+    - corte:<x>    capa temática cortada por departamento
+    - super:<a_b>  superposición de un par por departamento
+    - ranking, tabla_super, tabla_final, exportar, mapa_full, mapa_light, llm, micrositio
+    Con una nueva versión de CFA solo se recalculan corte:cfa, los tres pares
+    con CFA y lo que está aguas abajo de ellos.
+    """
+    grafo = GrafoEtapas(os.path.join(CACHE_DIR, "etapas"))
+
+    for nombre, path_shp in RUTAS_CAPAS.items():
+        grafo.fuente(
+            f"capa:{nombre}",
+            huella_shapefile(path_shp),
+            lambda nombre=nombre: cargar_capa_preparada(nombre, usar_cache)
+        )
+
+    for nombre in CAPAS_TEMATICAS:
+        grafo.etapa(f"corte:{nombre}", cortar_capa_por_departamento, [f"capa:{nombre}", "capa:dep"],
+                    version="3")
+
+    grafo.etapa(
+        "ranking", construir_ranking_departamental,
+        [f"corte:{nombre}" for nombre in CAPAS_TEMATICAS]
+    )
+
+    if motor in ("particion", "raster"):
+        grafo.etapa(
+            "tabla_super",
+            lambda zrc, res, cc, cfa, dep: calcular_superposiciones(zrc, res, cc, cfa, dep, motor=motor),
+            [f"capa:{nombre}" for nombre in CAPAS_TEMATICAS] + ["capa:dep"],
+            parametros={"motor": motor}
+        )
+    else:
+        for c1, c2, nombre_col in PARES_SUPERPOSICION:
+            grafo.etapa(
+                f"super:{c1}_{c2}",
+                lambda g1, g2, dep, nombre_col=nombre_col: calcular_superposicion_par(
+                    g1, g2, dep, nombre_col, motor=motor
+                ),
+                [f"capa:{c1}", f"capa:{c2}", "capa:dep"],
+                parametros={"motor": motor}
+            )
+        grafo.etapa(
+            "tabla_super",
+            lambda *series: armar_tabla_super(series),
+            [f"super:{c1}_{c2}" for c1, c2, _ in PARES_SUPERPOSICION]
+        )
+
+    grafo.etapa("tabla_final", construir_tabla_final, ["ranking", "tabla_super"])
+    grafo.etapa(
+        "exportar", exportar_tablas, ["tabla_super", "tabla_final"],
+        salidas=[os.path.join(MICRO_DIR, "tabla_final_min.json")]
+    )
+
+    capas_mapa = ["capa:dep", "capa:zrc", "capa:res", "capa:cc", "capa:cfa", "tabla_final"]
+    grafo.etapa(
+        "mapa_full", construir_mapa_full, capas_mapa,
+        salidas=[os.path.join(MAPAS_DIR, "mapa_multicapas_superposicion_full.html")]
+    )
+    grafo.etapa(
+        "mapa_light", construir_mapa_light, capas_mapa,
+        salidas=[os.path.join(MAPAS_DIR, "mapa_multicapas_superposicion_light.html")]
+    )
 
-    # 4. Cortes por departamento y ranking
-    zrc_dep, res_dep, cc_dep, cfa_dep = cortar_por_departamento(cc_3116, res_3116, zrc_3116, cfa_3116, dep_3116)
+    # El texto del LLM depende de tabla_final y de si hay API key configurada
+    cargar_entorno()
+    grafo.etapa(
+        "llm", generar_analisis_llm, ["tabla_final"],
+        parametros={"hf_api_key": bool(os.getenv("HF_API_KEY"))}
+    )
+    grafo.etapa(
+        "micrositio",
+        lambda tabla_final, texto_llm: construir_micrositio(tabla_final, texto_llm or None),
+        ["tabla_final", "llm"],
+        salidas=[os.path.join(MICRO_DIR, "index.html")]
+    )
+    return grafo
+
+
+def main_incremental(motor="strtree", usar_cache=True):
+    """Ejecuta el pipeline re-calculando solo las etapas afectadas por cambios en los SHP."""
+    crear_directorios_salida()
+    grafo = construir_grafo_pipeline(motor=motor, usar_cache=usar_cache)
+    grafo.ejecutar()
+    if grafo.ejecutadas:
+        print("Re-ejecutadas:", ", ".join(grafo.ejecutadas))
+    return grafo
+
+
+# ------------------------------------------------------------
+# 9.1 CONSULTA POR DEPARTAMENTO
+# ------------------------------------------------------------
+def recortar_a_departamento(capas, departamento):
+    """
+    Restringe (cc, res, zrc, cfa, dep) en EPSG:3116 a las features que tocan el
+    departamento, usando el índice espacial de cada capa. dep queda con una sola fila.
+    """
+    cc, res, zrc, cfa, dep = capas
+    dep_sel = dep[dep["dpto_cnmbr"].map(_normalizar_nombre) == _normalizar_nombre(departamento)]
+    if dep_sel.empty:
+        disponibles = ", ".join(sorted(dep["dpto_cnmbr"].astype(str)))
+        raise ValueError(f"Departamento '{departamento}' no encontrado. Disponibles: {disponibles}")
+
+    geom_dep = shapely.union_all(dep_sel.geometry.values)
+    recortes = []
+    for gdf in (cc, res, zrc, cfa):
+        idx = np.sort(gdf.sindex.query(geom_dep, predicate="intersects"))
+        recortes.append(gdf.iloc[idx])
+    return (*recortes, dep_sel)
+
+
+def analizar_departamento(departamento, capas=None, motor="strtree", usar_cache=True):
+    """
+    Ranking y superposiciones de un solo departamento (mismas columnas que
+    tabla_final), sin correr el pipeline nacional.
+    - capas=None: lee de los SHP solo las features del departamento (caché propia)
+    - capas=(cc, res, zrc, cfa, dep) ya cargadas: se recortan con el índice espacial
+    Devuelve un DataFrame de una fila indexado por dpto_cnmbr.
+    """
+    t0 = time.perf_counter()
+    if capas is None:
+        capas = cargar_capas_preparadas(usar_cache=usar_cache, departamento=departamento)
+    else:
+        capas = recortar_a_departamento(capas, departamento)
+    cc_3116, res_3116, zrc_3116, cfa_3116, dep_3116 = capas
+    nombre_dep = dep_3116["dpto_cnmbr"].iloc[0]
+
+    zrc_dep, res_dep, cc_dep, cfa_dep = cortar_por_departamento(
+        cc_3116, res_3116, zrc_3116, cfa_3116, dep_3116
+    )
     ranking_dep = construir_ranking_departamental(zrc_dep, res_dep, cc_dep, cfa_dep)
+    tabla_super = calcular_superposiciones(
+        zrc_3116, res_3116, cc_3116, cfa_3116, dep_3116, motor=motor
+    )
+    tabla = construir_tabla_final(ranking_dep, tabla_super)
+
+    # Un departamento sin ninguna figura también tiene su fila (en ceros)
+    tabla = tabla.reindex([nombre_dep], fill_value=0)
+    tabla.index.name = "dpto_cnmbr"
+    print(f"Análisis de {nombre_dep}: {time.perf_counter() - t0:.1f} s")
+    return tabla
+
+
+def exportar_departamento(tabla):
+    """Guarda la fila de analizar_departamento en tablas/departamentos/<nombre>.json."""
+    nombre_dep = tabla.index[0]
+    ruta = os.path.join(TABLAS_DIR, "departamentos", f"{_nombre_archivo(nombre_dep)}.json")
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    tabla.reset_index().to_json(ruta, orient="records", force_ascii=False, indent=2)
+    print("Tabla del departamento en:", ruta)
+    return ruta
+
+
+# ------------------------------------------------------------
+# 9.2 ACTUALIZACIÓN POR FEATURES ENTRE VERSIONES (DELTA)
+# ------------------------------------------------------------
+# Las capas oficiales se republican con pocas features cambiadas. Cada
+# feature se identifica por una huella (WKB normalizado + atributos); se
+# compara contra la versión anterior (cache/delta, una por nivel) y solo se cortan y se
+# superponen las features nuevas o modificadas. Las eliminadas salen de los
+# cortes y de la tabla de hechos, y tabla_super/tabla_final se recalculan
+# únicamente en los departamentos que tocan los cambios.
+
+# Sube si cambia el formato del estado guardado (fuerza una reconstrucción completa)
+VERSION_DELTA = 1
+
+
+def _dir_delta(columnas):
+    """Estado por nivel de agregación (cache/delta/<columnas de la unidad>)."""
+    return os.path.join(CACHE_DIR, "delta", _nombre_archivo("_".join(columnas)))
+
+
+def huellas_features(gdf):
+    """
+    Huella (uint64) de cada feature: WKB de la geometría normalizada más los
+    atributos (sin area_km2, que se deriva de la geometría). Dos features
+    idénticas se distinguen por su número de aparición.
+    """
+    wkb = shapely.to_wkb(shapely.normalize(_geometrias(gdf)))
+    atributos = pd.DataFrame(gdf.drop(columns=[gdf.geometry.name, "area_km2"], errors="ignore"))
+    atributos["_wkb"] = pd.util.hash_array(wkb)
+    huella = pd.util.hash_pandas_object(atributos, index=False).to_numpy()
+    aparicion = pd.Series(huella).groupby(huella).cumcount().to_numpy()
+    return pd.util.hash_pandas_object(
+        pd.DataFrame({"huella": huella, "aparicion": aparicion}), index=False
+    ).to_numpy()
+
+
+def diferencia_features(huellas_previas, huellas):
+    """
+    (nueva posición de cada feature previa, -1 si ya no está; posiciones de las
+    features que no estaban en la versión previa).
+    """
+    posiciones = pd.Series(np.arange(len(huellas)), index=huellas)
+    mapa = posiciones.reindex(huellas_previas).fillna(-1).to_numpy(dtype=np.int64)
+    agregadas = np.flatnonzero(~np.isin(huellas, huellas_previas))
+    return mapa, agregadas
+
+
+def leer_estado_delta(columnas, huella_unidades):
+    """Estado de la corrida anterior (cache/delta) o None si no existe o no es comparable."""
+    ruta = os.path.join(_dir_delta(columnas), "estado.json")
+    if not os.path.exists(ruta):
+        print("Delta: no hay versión anterior; se calcula todo.")
+        return None
+    with open(ruta, encoding="utf-8") as f:
+        meta = json.load(f)
+    comparable = (
+        meta.get("version") == VERSION_DELTA
+        and meta.get("columnas") == list(columnas)
+        and meta.get("huella_unidades") == huella_unidades
+    )
+    if not comparable:
+        print("Delta: cambiaron las unidades o el formato del estado; se calcula todo.")
+        return None
+
+    def leer(nombre):
+        return pd.read_parquet(os.path.join(_dir_delta(columnas), f"{nombre}.parquet"))
+
+    return {
+        "huellas": {c: leer(f"huellas_{c}") for c in CAPAS_TEMATICAS},
+        "cortes": {c: leer(f"cortes_{c}") for c in CAPAS_TEMATICAS},
+        "hechos": leer("hechos"),
+        "tabla_super": leer("tabla_super"),
+        "tabla_final": leer("tabla_final"),
+    }
+
+
+def guardar_estado_delta(capas, huellas, cortes, hechos, tabla_super, tabla_final, columnas,
+                         huella_unidades):
+    """Guarda en cache/delta lo necesario para comparar la próxima versión de las capas."""
+    directorio = _dir_delta(columnas)
+    os.makedirs(directorio, exist_ok=True)
+    for capa in CAPAS_TEMATICAS:
+        pd.DataFrame({
+            "huella": huellas[capa],
+            "nombre": capas[capa][CAMPOS_MAPA[capa][0]].astype(str).to_numpy(),
+        }).to_parquet(os.path.join(directorio, f"huellas_{capa}.parquet"), index=False)
+        cortes[capa].to_parquet(os.path.join(directorio, f"cortes_{capa}.parquet"), index=False)
+    hechos.to_parquet(os.path.join(directorio, "hechos.parquet"), index=False)
+    tabla_super.to_parquet(os.path.join(directorio, "tabla_super.parquet"))
+    tabla_final.to_parquet(os.path.join(directorio, "tabla_final.parquet"))
+    # estado.json al final: si algo falla antes, la próxima corrida no usa un estado a medias
+    with open(os.path.join(directorio, "estado.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": VERSION_DELTA, "columnas": list(columnas),
+                   "huella_unidades": huella_unidades}, f, indent=2)
+
+
+def _cortes_sin_geometria(cortes, columnas):
+    """Lo que el ranking necesita de los cortes: id_figura, columnas de la unidad y area_km2."""
+    return pd.DataFrame(cortes[["id_figura"] + list(columnas) + ["area_km2"]])
+
+
+def _fragmentos_delta(par, geoms, agregadas, geoms_dep, arbol_dep):
+    """
+    Fragmentos de un par que involucran alguna feature agregada: agregadas de
+    la capa 1 contra toda la capa 2, y el resto de la capa 1 contra las
+    agregadas de la capa 2. Índices en la numeración de la versión nueva.
+    """
+    c1, c2, _ = par
+    geoms1, geoms2 = geoms[c1], geoms[c2]
+    nuevas1, nuevas2 = agregadas[c1], agregadas[c2]
+    resto1 = np.setdiff1d(np.arange(len(geoms1)), nuevas1)
+    partes = []
+    if len(nuevas1):
+        idx1, idx2, idx_dep, areas = _fragmentos_par(
+            geoms1[nuevas1], geoms2, shapely.STRtree(geoms2), geoms_dep, arbol_dep
+        )
+        partes.append((nuevas1[idx1], idx2, idx_dep, areas))
+    if len(nuevas2) and len(resto1):
+        idx1, idx2, idx_dep, areas = _fragmentos_par(
+            geoms1[resto1], geoms2[nuevas2], shapely.STRtree(geoms2[nuevas2]), geoms_dep, arbol_dep
+        )
+        partes.append((resto1[idx1], nuevas2[idx2], idx_dep, areas))
+    if not partes:
+        vacio = np.array([], dtype=np.int64)
+        return vacio, vacio, vacio, np.array([], dtype=float)
+    return tuple(np.concatenate(arrays) for arrays in zip(*partes))
+
+
+def actualizar_por_delta(capas, unidades, columnas, workers=1):
+    """
+    Cortes, tabla de hechos, tabla_super y tabla_final (por departamento) a
+    partir de la versión anterior guardada en cache/delta, recalculando solo
+    las features agregadas/modificadas/eliminadas y los departamentos que tocan.
+    Sin versión anterior comparable se calcula todo (y queda guardado).
+    capas: {"zrc", "res", "cc", "cfa": GeoDataFrame EPSG:3116}.
+    Devuelve (cortes zrc, res, cc, cfa), hechos, tabla_super, tabla_final.
+    """
+    columnas = list(columnas)
+    huellas = {capa: huellas_features(capas[capa]) for capa in CAPAS_TEMATICAS}
+    huella_unidades = hashlib.sha1(huellas_features(unidades[columnas + ["geometry"]]).tobytes()).hexdigest()[:16]
+    estado = leer_estado_delta(columnas, huella_unidades)
+
+    if estado is None:
+        cortes = cortar_por_departamento(capas["cc"], capas["res"], capas["zrc"], capas["cfa"],
+                                         unidades, workers=workers, columnas=columnas)
+        cortes = dict(zip(("zrc", "res", "cc", "cfa"), (_cortes_sin_geometria(c, columnas) for c in cortes)))
+        hechos = construir_hechos_superposicion(capas, unidades, columnas, workers)
+        tabla_super = resumir_superposiciones(hechos, "dpto_cnmbr")
+        ranking_dep = construir_ranking_departamental(*(cortes[c] for c in CAPAS_TEMATICAS))
+        tabla_final = construir_tabla_final(ranking_dep, tabla_super)
+    else:
+        # 1. Qué cambió en cada capa
+        mapas, agregadas = {}, {}
+        for capa in CAPAS_TEMATICAS:
+            previas = estado["huellas"][capa]
+            mapas[capa], agregadas[capa] = diferencia_features(previas["huella"].to_numpy(), huellas[capa])
+            eliminadas = mapas[capa] < 0
+            nombres_nuevos = set(capas[capa][CAMPOS_MAPA[capa][0]].astype(str).to_numpy()[agregadas[capa]])
+            modificadas = len(nombres_nuevos & set(previas["nombre"].to_numpy()[eliminadas]))
+            print(f"Delta {capa}: {len(agregadas[capa]) - modificadas} nuevas, "
+                  f"{eliminadas.sum() - modificadas} eliminadas, {modificadas} modificadas")
+
+        afectados = set()
+
+        # 2. Cortes: se conservan los de features que siguen (renumerados) y se cortan las agregadas
+        cortes = {}
+        for capa in CAPAS_TEMATICAS:
+            previos = estado["cortes"][capa]
+            nuevo_id = mapas[capa][previos["id_figura"].to_numpy()]
+            afectados.update(previos.loc[nuevo_id < 0, "dpto_cnmbr"])
+            conservados = previos[nuevo_id >= 0].assign(id_figura=nuevo_id[nuevo_id >= 0])
+            nuevos = _cortes_sin_geometria(
+                cortar_capa_por_departamento(capas[capa].iloc[agregadas[capa]], unidades, columnas), columnas
+            )
+            nuevos["id_figura"] = agregadas[capa][nuevos["id_figura"].to_numpy()]
+            afectados.update(nuevos["dpto_cnmbr"])
+            cortes[capa] = (
+                pd.concat([conservados, nuevos], ignore_index=True)
+                .sort_values("id_figura", kind="stable", ignore_index=True)
+            )
+
+        # 3. Hechos: fragmentos previos entre features que siguen + fragmentos con alguna agregada
+        previos = estado["hechos"].drop(columns=["fragmento", "region"], errors="ignore")
+        geoms = {capa: _geometrias(capas[capa]) for capa in CAPAS_TEMATICAS}
+        geoms_dep = _geometrias(unidades)
+        arbol_dep = shapely.STRtree(geoms_dep)
+        partes = []
+        for orden, par in enumerate(PARES_SUPERPOSICION):
+            c1, c2, nombre_col = par
+            del_par = previos[previos["par"] == nombre_col]
+            id_1 = mapas[c1][del_par["id_1"].to_numpy()]
+            id_2 = mapas[c2][del_par["id_2"].to_numpy()]
+            siguen = (id_1 >= 0) & (id_2 >= 0)
+            afectados.update(del_par.loc[~siguen, "dpto_cnmbr"])
+            nuevos = _tabla_fragmentos(par, _fragmentos_delta(par, geoms, agregadas, geoms_dep, arbol_dep),
+                                       unidades, columnas)
+            afectados.update(nuevos["dpto_cnmbr"])
+            partes.append(
+                pd.concat([del_par[siguen].assign(id_1=id_1[siguen], id_2=id_2[siguen]), nuevos],
+                          ignore_index=True)
+                .sort_values(["id_1", "id_2"], kind="stable", ignore_index=True)
+            )
+        hechos = _completar_hechos(partes, columnas)
+
+        # 4. tabla_super y tabla_final: solo se recalculan las filas de los departamentos afectados
+        tabla_super, tabla_final = estado["tabla_super"], estado["tabla_final"]
+        if afectados:
+            afectados = sorted(afectados)
+            ranking_af = construir_ranking_departamental(
+                *(cortes[c][cortes[c]["dpto_cnmbr"].isin(afectados)] for c in CAPAS_TEMATICAS)
+            )
+            super_af = resumir_superposiciones(hechos[hechos["dpto_cnmbr"].isin(afectados)], "dpto_cnmbr")
+            tabla_super = (
+                pd.concat([tabla_super.drop(index=afectados, errors="ignore"), super_af])
+                .sort_values("area_total_super_km2", ascending=False)
+            )
+            tabla_final = (
+                pd.concat([tabla_final.drop(index=afectados, errors="ignore"),
+                           construir_tabla_final(ranking_af, super_af)])
+                .sort_values("area_res_km2", ascending=False)
+            )
+        print(f"Delta: {len(afectados)} de {len(tabla_final)} departamentos recalculados")
+
+    guardar_estado_delta(capas, huellas, cortes, hechos, tabla_super, tabla_final, columnas, huella_unidades)
+    return tuple(cortes[c] for c in ("zrc", "res", "cc", "cfa")), hechos, tabla_super, tabla_final
+
+
+# ------------------------------------------------------------
+# 10. FUNCIÓN PRINCIPAL Y SUBCOMANDOS
+# ------------------------------------------------------------
+def leer_tabla_final():
+    """
+    tabla_final exportada por un análisis anterior (tablas/tabla_final_geografica.parquet),
+    para los subcomandos que no recalculan geometría (mapas, llm, micrositio).
+    """
+    ruta = os.path.join(TABLAS_DIR, "tabla_final_geografica.parquet")
+    if not os.path.exists(ruta):
+        raise FileNotFoundError(
+            f"No existe {ruta}. Ejecuta primero: python conv.py analizar"
+        )
+    return pd.read_parquet(ruta).set_index("dpto_cnmbr")
+
+
+def leer_analisis_llm():
+    """Texto de llm/analisis_llm.txt si un análisis anterior lo generó; si no, None."""
+    ruta = os.path.join(LLM_DIR, "analisis_llm.txt")
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding="utf-8") as f:
+        return f.read() or None
 
-    # 5. Superposiciones
-    tabla_super = calcular_superposiciones(zrc_3116, res_3116, cc_3116, cfa_3116, dep_3116)
+
+def etapa_cargar(inst, usar_cache=True, workers=1, departamento=None, lote=None):
+    """1-3. Carga, limpieza geométrica, reproyección y áreas (con caché por capa)."""
+    with inst.etapa("cargar_capas") as e:
+        return e.salida(cargar_capas_preparadas(
+            usar_cache=usar_cache, workers=workers, departamento=departamento, lote=lote
+        ))
+
+
+def etapa_analizar(inst, capas, motor="strtree", usar_cache=True, workers=1,
+                   por_departamento=False, departamento=None, lote=None, resolucion=1000,
+                   validar_raster=False, nivel="departamento", unidades_shp=None,
+                   campo_unidad=None, delta=False):
+    """
+    4-6. Cortes, ranking, superposiciones, tabla final y exportaciones.
+    Devuelve (tabla_final, convergencia); convergencia es la grilla del motor
+    raster (None con los demás motores), reutilizable para el mapa de densidad.
+    Con delta=True (motor strtree) cortes y superposiciones se actualizan solo
+    para las features que cambiaron desde la corrida anterior (actualizar_por_delta).
+    """
+    cc_3116, res_3116, zrc_3116, cfa_3116, dep_3116 = capas
+
+    # Unidades mínimas de cálculo (los propios departamentos por defecto)
+    with inst.etapa(f"unidades:{nivel}") as e:
+        unidades, clave, columnas = cargar_unidades(
+            nivel, dep_3116, usar_cache=usar_cache, ruta=unidades_shp, campo=campo_unidad,
+            departamento=departamento, lote=lote
+        )
+        e.salida(unidades)
+    columnas_corte = list(dict.fromkeys([clave, "dpto_cnmbr"] + columnas))
+    capas_tematicas = {"zrc": zrc_3116, "res": res_3116, "cc": cc_3116, "cfa": cfa_3116}
+    convergencia = None
+    hechos = None
+    if delta and (motor != "strtree" or por_departamento):
+        print("--delta requiere el motor strtree sin --por-departamento; se calcula todo.")
+        delta = False
+    if delta and departamento:
+        # El estado de cache/delta es el de las capas nacionales
+        print("--delta no se combina con --departamento; se calcula todo.")
+        delta = False
+
+    if delta:
+        # 4-5. Solo las features que cambiaron; tabla_super y tabla_final llegan ya por departamento
+        with inst.etapa("delta", entradas=capas) as e:
+            cortes, hechos, tabla_super, tabla_final = actualizar_por_delta(
+                capas_tematicas, unidades, columnas_corte, workers
+            )
+            zrc_dep, res_dep, cc_dep, cfa_dep = cortes
+            e.salida(hechos)
+    else:
+        # 4. Cortes por unidad y ranking (el departamental sale de los mismos cortes)
+        with inst.etapa("cortar_por_departamento", entradas=capas) as e:
+            zrc_dep, res_dep, cc_dep, cfa_dep = e.salida(cortar_por_departamento(
+                cc_3116, res_3116, zrc_3116, cfa_3116, unidades, workers=workers, columnas=columnas_corte
+            ))
+        with inst.etapa("ranking_departamental") as e:
+            ranking_dep = e.salida(construir_ranking_departamental(zrc_dep, res_dep, cc_dep, cfa_dep))
+
+        # 5. Superposiciones (la grilla del motor raster se reutiliza para el mapa de densidad)
+        with inst.etapa(f"superposiciones:{motor}", entradas=capas) as e:
+            if motor == "strtree" and not por_departamento:
+                # Tabla de hechos por fragmento: cualquier nivel de resumen sale de ella
+                hechos = construir_hechos_superposicion(capas_tematicas, unidades, columnas_corte, workers)
+                tabla_super = resumir_superposiciones(hechos, clave)
+            else:
+                if motor == "raster":
+                    convergencia = convergencia_raster(capas_tematicas, unidades, resolucion, clave)
+                tabla_super = calcular_superposiciones(
+                    zrc_3116, res_3116, cc_3116, cfa_3116, unidades,
+                    motor=motor, workers=workers, por_departamento=por_departamento,
+                    convergencia=convergencia, clave=clave
+                )
+            e.salida(tabla_super)
+
+    # 5.1 Tabla del nivel fino y suma por departamento (sin repetir overlays)
+    if nivel != "departamento":
+        with inst.etapa(f"agregar:{nivel}") as e:
+            ranking_nivel = construir_ranking_departamental(zrc_dep, res_dep, cc_dep, cfa_dep, clave=columnas)
+            if hechos is not None:
+                super_nivel = resumir_superposiciones(hechos, columnas)
+                if not delta:
+                    tabla_super = resumir_superposiciones(hechos, "dpto_cnmbr")
+            else:
+                super_nivel = agregar_por_unidad(tabla_super, unidades, columnas)
+                tabla_super = agregar_por_unidad(tabla_super, unidades, ["dpto_cnmbr"])
+            tabla_nivel = construir_tabla_final(ranking_nivel, super_nivel)
+            e.salida(tabla_nivel)
+            exportar_tabla_nivel(tabla_nivel, nivel)
+    if motor == "raster" and validar_raster:
+        with inst.etapa("validar_raster", entradas=capas):
+            exacta = calcular_superposiciones(zrc_3116, res_3116, cc_3116, cfa_3116, dep_3116,
+                                              motor="particion")
+            errores = comparar_superposiciones(tabla_super, exacta)
+            errores.to_csv(os.path.join(TABLAS_DIR, "error_raster.csv"), encoding="utf-8-sig")
+            print(errores.round(2).to_string())
 
     # 6. Tabla final y exportaciones
-    tabla_final = construir_tabla_final(ranking_dep, tabla_super)
-    exportar_tablas(tabla_super, tabla_final)
+    if not delta:
+        with inst.etapa("tabla_final") as e:
+            tabla_final = e.salida(construir_tabla_final(ranking_dep, tabla_super))
+    with inst.etapa("exportar_tablas"):
+        exportar_tablas(tabla_super, tabla_final)
+        if hechos is not None:
+            exportar_hechos(hechos)
+    return tabla_final, convergencia
+
+
+def etapa_mapas(inst, capas, tabla_final, teselas=False, niveles_detalle=False,
+                datos_externos=False, mapa_densidad=False, resolucion=1000, convergencia=None,
+                sitio_fragmentado=False):
+    """
+    7. Mapas (departamentos con tabla_final se preparan una sola vez para todos).
+    Con sitio_fragmentado se escriben además los datos por departamento del micrositio.
+    """
+    cc_3116, res_3116, zrc_3116, cfa_3116, dep_3116 = capas
+    with inst.etapa("preparar_departamentos_mapa") as e:
+        dep_map = e.salida(preparar_departamentos_mapa(dep_3116, tabla_final))
+    with inst.etapa("mapa_full", entradas=capas):
+        construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final,
+                            datos_externos, dep_map=dep_map)
+    with inst.etapa("mapa_light", entradas=capas):
+        construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final,
+                             datos_externos, dep_map=dep_map)
+    if teselas:
+        with inst.etapa("mapa_teselas", entradas=capas):
+            construir_mapa_teselas(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final,
+                                   dep_map=dep_map)
+    if sitio_fragmentado:
+        with inst.etapa("datos_micrositio", entradas=capas):
+            construir_datos_micrositio(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final,
+                                       dep_map=dep_map)
+    if mapa_densidad:
+        with inst.etapa("mapa_densidad", entradas=capas):
+            if convergencia is None:
+                capas_tematicas = {"zrc": zrc_3116, "res": res_3116, "cc": cc_3116, "cfa": cfa_3116}
+                convergencia = convergencia_raster(capas_tematicas, dep_3116, resolucion)
+            construir_mapa_densidad(dep_3116, convergencia)
+    if niveles_detalle:
+        with inst.etapa("niveles_detalle", entradas=capas):
+            reportar_niveles_detalle(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116)
+
+
+def etapa_llm(inst, tabla_final, departamentos=False, concurrencia=4):
+    """8. (Opcional) Análisis LLM; devuelve el texto nacional o None."""
+    with inst.etapa("analisis_llm"):
+        texto_llm = generar_analisis_llm(tabla_final, departamentos=departamentos,
+                                         concurrencia=concurrencia)
+    return texto_llm if texto_llm else None
+
+
+def etapa_micrositio(inst, tabla_final, texto_llm=None, teselas=False, fragmentado=False):
+    """
+    9. Micrositio (con teselas, el iframe apunta al mapa que las carga bajo demanda;
+    fragmentado, la página carga micrositio/datos/ sin iframe).
+    """
+    with inst.etapa("micrositio"):
+        if fragmentado:
+            from micrositio import MANIFIESTO
+            if not os.path.exists(os.path.join(MICRO_DIR, "datos", MANIFIESTO)):
+                print("⚠️ No existe micrositio/datos/; ejecuta: python conv.py mapas --sitio-fragmentado")
+            construir_micrositio(tabla_final, texto_llm, datos_rel="datos")
+        elif teselas:
+            construir_micrositio(
+                tabla_final, texto_llm,
+                mapa_rel="../mapas/mapa_multicapas_superposicion_teselas.html"
+            )
+        else:
+            construir_micrositio(tabla_final, texto_llm)
+
+
+def _cerrar_instrumentacion(inst, reporte, nombre="ejecucion"):
+    """Escribe outputs/reporte_<nombre>.json o, sin reporte, imprime la memoria pico."""
+    if reporte:
+        inst.guardar(os.path.join(OUTPUT_DIR, f"reporte_{nombre}.json"))
+    else:
+        print(f"Memoria pico (RSS): {memoria_pico_mb():.0f} MB")
+
+
+def main(motor="strtree", usar_cache=True, workers=1, por_departamento=False, teselas=False,
+         niveles_detalle=False, datos_externos=False, reporte=True, perfil=None,
+         departamento=None, lote=None, resolucion=1000, validar_raster=False, mapa_densidad=False,
+         nivel="departamento", unidades_shp=None, campo_unidad=None,
+         llm_departamentos=False, llm_concurrencia=4, delta=False, sitio_fragmentado=False):
+    """
+    Pipeline completo. Cada etapa queda medida (tiempo, CPU, memoria pico,
+    features y vértices); con reporte=True se escribe outputs/reporte_ejecucion.json.
+    perfil ("cprofile" o "pyinstrument") guarda además un perfil por etapa en
+    outputs/perfiles/.
+    departamento restringe la lectura de todas las capas a ese departamento;
+    lote lee los SHP por lotes de ese número de features (memoria acotada).
+    Con motor="raster" (grilla de `resolucion` m), validar_raster compara contra
+    el motor de partición exacto (tablas/error_raster.csv); mapa_densidad genera
+    el mapa de figuras superpuestas por celda con cualquier motor.
+    nivel ("municipio" o "personalizado" con unidades_shp y campo_unidad)
+    calcula cortes y superposiciones una vez por unidad, exporta
+    tablas/tabla_final_<nivel> y suma esas mismas áreas por departamento.
+    llm_departamentos agrega un análisis LLM por departamento (llm_concurrencia
+    solicitudes simultáneas).
+    delta recalcula cortes y superposiciones solo para las features que cambiaron
+    desde la corrida anterior con delta (estado en cache/delta).
+    sitio_fragmentado escribe los datos del micrositio por departamento
+    (micrositio/datos/, con .gz/.br) y un index.html que los carga bajo demanda.
+    Es la composición de etapa_cargar, etapa_analizar, etapa_mapas, etapa_llm y
+    etapa_micrositio, que los subcomandos de la CLI ejecutan por separado.
+    """
+    if departamento:
+        configurar_salidas_departamento(departamento)
+    crear_directorios_salida()
+    inst = Instrumentacion(
+        perfil=perfil,
+        dir_perfiles=os.path.join(OUTPUT_DIR, "perfiles"),
+        parametros={
+            "motor": motor, "usar_cache": usar_cache, "workers": workers,
+            "por_departamento": por_departamento, "teselas": teselas,
+            "niveles_detalle": niveles_detalle, "datos_externos": datos_externos,
+            "departamento": departamento, "lote": lote,
+            "resolucion": resolucion, "validar_raster": validar_raster,
+            "mapa_densidad": mapa_densidad, "nivel": nivel,
+            "unidades_shp": unidades_shp, "campo_unidad": campo_unidad,
+            "llm_departamentos": llm_departamentos, "llm_concurrencia": llm_concurrencia,
+            "delta": delta, "sitio_fragmentado": sitio_fragmentado,
+        },
+    )
 
-    # 7. Mapas
-    construir_mapa_full(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final)
-    construir_mapa_light(dep_3116, zrc_3116, res_3116, cc_3116, cfa_3116, tabla_final)
+    capas = etapa_cargar(inst, usar_cache, workers, departamento, lote)
+    tabla_final, convergencia = etapa_analizar(
+        inst, capas, motor=motor, usar_cache=usar_cache, workers=workers,
+        por_departamento=por_departamento, departamento=departamento, lote=lote,
+        resolucion=resolucion, validar_raster=validar_raster, nivel=nivel,
+        unidades_shp=unidades_shp, campo_unidad=campo_unidad, delta=delta
+    )
+    etapa_mapas(inst, capas, tabla_final, teselas=teselas, niveles_detalle=niveles_detalle,
+                datos_externos=datos_externos, mapa_densidad=mapa_densidad,
+                resolucion=resolucion, convergencia=convergencia, sitio_fragmentado=sitio_fragmentado)
+    texto_llm = etapa_llm(inst, tabla_final, llm_departamentos, llm_concurrencia)
+    etapa_micrositio(inst, tabla_final, texto_llm, teselas, sitio_fragmentado)
+
+    _cerrar_instrumentacion(inst, reporte)
+    return inst
 
-    # 8. (Opcional) Análisis LLM
-    texto_llm = generar_analisis_llm(tabla_final)
-    texto_para_micrositio = texto_llm if texto_llm else None
 
-    # 9. Micrositio
-    construir_micrositio(tabla_final, texto_para_micrositio)
+# Subcomandos de la CLI (nombre canónico y alias en inglés). Sin subcomando se
+# ejecuta el pipeline completo, como antes.
+SUBCOMANDOS = {
+    "cargar": ("load", "Prepara las capas (limpieza, reproyección, áreas) y llena la caché GeoParquet."),
+    "analizar": ("analyze", "Cortes, ranking, superposiciones y tablas (outputs/tablas)."),
+    "mapas": ("maps", "Mapas HTML a partir de las capas en caché y la tabla_final exportada."),
+    "llm": (None, "Análisis LLM a partir de la tabla_final exportada (sin geometría)."),
+    "micrositio": ("site", "index.html a partir de la tabla_final y el texto LLM exportados (sin geometría)."),
+    "todo": ("all", "Pipeline completo (equivale a no indicar subcomando)."),
+}
+
+
+def ejecutar_subcomando(args):
+    """
+    Ejecuta un subcomando de la CLI con su propia instrumentación
+    (outputs/reporte_<subcomando>.json). llm y micrositio leen las tablas
+    exportadas por `analizar` y no importan geopandas, shapely ni folium.
+    """
+    if args.departamento:
+        configurar_salidas_departamento(args.departamento)
+    crear_directorios_salida()
+    comando = args.comando
+    inst = Instrumentacion(
+        perfil=args.perfil,
+        dir_perfiles=os.path.join(OUTPUT_DIR, "perfiles"),
+        parametros={"comando": comando, **{k: v for k, v in vars(args).items() if k != "comando"}},
+    )
+    usar_cache = not args.sin_cache
+
+    if comando in ("cargar", "analizar", "mapas"):
+        capas = etapa_cargar(inst, usar_cache, args.workers, args.departamento, args.lote)
+    if comando == "analizar":
+        etapa_analizar(
+            inst, capas, motor=args.motor, usar_cache=usar_cache, workers=args.workers,
+            por_departamento=args.por_departamento, departamento=args.departamento,
+            lote=args.lote, resolucion=args.resolucion, validar_raster=args.validar_raster,
+            nivel=args.nivel, unidades_shp=args.unidades, campo_unidad=args.campo_unidad,
+            delta=args.delta
+        )
+    elif comando == "mapas":
+        etapa_mapas(inst, capas, leer_tabla_final(), teselas=args.teselas,
+                    niveles_detalle=args.niveles_detalle, datos_externos=args.geojson_externo,
+                    mapa_densidad=args.mapa_densidad, resolucion=args.resolucion,
+                    sitio_fragmentado=args.sitio_fragmentado)
+    elif comando == "llm":
+        etapa_llm(inst, leer_tabla_final(), args.llm_departamentos, args.llm_concurrencia)
+    elif comando == "micrositio":
+        etapa_micrositio(inst, leer_tabla_final(), leer_analisis_llm(), args.teselas,
+                         args.sitio_fragmentado)
+
+    _cerrar_instrumentacion(inst, not args.sin_reporte, comando)
+    return inst
+
+
+def _agregar_opciones(parser, suprimir=False):
+    """
+    Opciones del pipeline. Se aceptan antes o después del subcomando: en los
+    subcomandos (suprimir=True) no tienen valor por defecto, así que no pisan
+    lo que se indicó antes del subcomando.
+    """
+    def defecto(valor):
+        return argparse.SUPPRESS if suprimir else valor
+
+    parser.add_argument(
+        "--base-dir",
+        default=defecto(None),
+        help="Carpeta base del proyecto (inputs/ y outputs/); por defecto CONVERGENCIA_BASE_DIR."
+    )
+    parser.add_argument(
+        "--motor",
+        choices=MOTORES_SUPERPOSICION,
+        default=defecto("strtree"),
+        help="Motor para calcular superposiciones (strtree por defecto; overlay para comparar; "
+             "particion para todas las combinaciones sin doble conteo; raster para una "
+             "aproximación en grilla)."
+    )
+    parser.add_argument(
+        "--resolucion",
+        type=float,
+        default=defecto(1000),
+        help="Tamaño de celda en metros del motor raster y del mapa de densidad."
+    )
+    parser.add_argument(
+        "--validar-raster",
+        action="store_true",
+        default=defecto(False),
+        help="Con --motor raster, compara contra el motor de partición (tablas/error_raster.csv)."
+    )
+    parser.add_argument(
+        "--mapa-densidad",
+        action="store_true",
+        default=defecto(False),
+        help="Genera mapas/mapa_densidad_convergencia.html (figuras superpuestas por celda)."
+    )
+    parser.add_argument(
+        "--nivel",
+        choices=NIVELES_AGREGACION,
+        default=defecto("departamento"),
+        help="Nivel de agregación adicional: municipio (MGN) o personalizado (--unidades); "
+             "se calcula una vez en ese nivel y se suma por departamento."
+    )
+    parser.add_argument(
+        "--unidades",
+        default=defecto(None),
+        help="Con --nivel personalizado: archivo vectorial con los polígonos de agregación."
+    )
+    parser.add_argument(
+        "--campo-unidad",
+        default=defecto(None),
+        help="Con --nivel personalizado: campo que identifica cada polígono de --unidades."
+    )
+    parser.add_argument(
+        "--llm-departamentos",
+        action="store_true",
+        default=defecto(False),
+        help="Además del análisis nacional, un análisis LLM por departamento (llm/departamentos/)."
+    )
+    parser.add_argument(
+        "--llm-concurrencia",
+        type=int,
+        default=defecto(4),
+        help="Solicitudes simultáneas al LLM."
+    )
+    parser.add_argument(
+        "--sin-cache",
+        action="store_true",
+        default=defecto(False),
+        help="Ignora la caché de capas preparadas y lee siempre los SHP."
+    )
+    parser.add_argument(
+        "--limpiar-cache",
+        action="store_true",
+        default=defecto(False),
+        help="Borra la caché de capas preparadas antes de ejecutar."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=defecto(False),
+        help="Re-ejecuta solo las etapas aguas abajo de las capas que cambiaron."
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        default=defecto(False),
+        help="Compara cada feature con la versión anterior de las capas y recalcula solo "
+             "las que cambiaron y los departamentos que tocan (motor strtree; estado en cache/delta)."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=defecto(1),
+        help="Procesos para carga, cortes y superposiciones (1 = secuencial)."
+    )
+    parser.add_argument(
+        "--por-departamento",
+        action="store_true",
+        default=defecto(False),
+        help="Reparte las superposiciones por departamento entre los workers (motor strtree)."
+    )
+    parser.add_argument(
+        "--teselas",
+        action="store_true",
+        default=defecto(False),
+        help="Genera teselas vectoriales (MVT z/x/y) y un mapa que las carga bajo demanda."
+    )
+    parser.add_argument(
+        "--sitio-fragmentado",
+        action="store_true",
+        default=defecto(False),
+        help="Micrositio sin iframe: vista nacional liviana y un archivo por departamento "
+             "(micrositio/datos/, con .gz/.br) que la página carga al seleccionarlo."
+    )
+    parser.add_argument(
+        "--niveles-detalle",
+        action="store_true",
+        default=defecto(False),
+        help="Reporta vértices y bytes por capa y nivel de detalle (tablas/niveles_detalle.csv)."
+    )
+    parser.add_argument(
+        "--geojson-externo",
+        action="store_true",
+        default=defecto(False),
+        help="Los mapas cargan el GeoJSON compacto desde mapas/datos/ en lugar de incrustarlo."
+    )
+    parser.add_argument(
+        "--departamento",
+        default=defecto(None),
+        help="Lee solo las features que tocan este departamento (p. ej. Cauca); "
+             "las salidas van a outputs/<DEPARTAMENTO>/."
+    )
+    parser.add_argument(
+        "--lote",
+        type=int,
+        default=defecto(None),
+        help="Lee los SHP por lotes de N features para acotar la memoria."
+    )
+    parser.add_argument(
+        "--sin-reporte",
+        action="store_true",
+        default=defecto(False),
+        help="No escribe outputs/reporte_<subcomando>.json (tiempos y memoria por etapa)."
+    )
+    parser.add_argument(
+        "--perfil",
+        choices=PERFILADORES,
+        default=defecto(None),
+        help="Perfila cada etapa con cProfile o pyinstrument (outputs/perfiles/)."
+    )
+
+
+def parse_args(argv=None):
+    """Argumentos de línea de comandos (los alias en inglés se normalizan al nombre canónico)."""
+    parser = argparse.ArgumentParser(description="MVP Convergencia de figuras territoriales")
+    _agregar_opciones(parser)
+    subcomandos = parser.add_subparsers(dest="comando")
+    for nombre, (alias, ayuda) in SUBCOMANDOS.items():
+        sub = subcomandos.add_parser(nombre, aliases=[alias] if alias else [], help=ayuda)
+        _agregar_opciones(sub, suprimir=True)
+        sub.set_defaults(comando=nombre)
+    consulta = subcomandos.add_parser(
+        "departamento",
+        help="Ranking y superposiciones de un solo departamento (sin el pipeline nacional)."
+    )
+    consulta.add_argument("nombre", help="Nombre del departamento (dpto_cnmbr), p. ej. Cauca.")
+    _agregar_opciones(consulta, suprimir=True)
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    cargar_entorno()
+    configurar_rutas(args.base_dir or os.getenv("CONVERGENCIA_BASE_DIR", BASE_DIR))
+    if args.limpiar_cache:
+        limpiar_cache()
+    if args.comando == "departamento":
+        from tabulate import tabulate
+        tabla = analizar_departamento(args.nombre, motor=args.motor, usar_cache=not args.sin_cache)
+        print(tabulate(formatear_tabla(tabla).T, headers="keys", tablefmt="github"))
+        exportar_departamento(tabla)
+    elif args.incremental:
+        main_incremental(motor=args.motor, usar_cache=not args.sin_cache)
+    elif args.comando not in (None, "todo"):
+        ejecutar_subcomando(args)
+    else:
+        main(
+            motor=args.motor,
+            usar_cache=not args.sin_cache,
+            workers=args.workers,
+            por_departamento=args.por_departamento,
+            teselas=args.teselas,
+            niveles_detalle=args.niveles_detalle,
+            datos_externos=args.geojson_externo,
+            reporte=not args.sin_reporte,
+            perfil=args.perfil,
+            departamento=args.departamento,
+            lote=args.lote,
+            resolucion=args.resolucion,
+            validar_raster=args.validar_raster,
+            mapa_densidad=args.mapa_densidad,
+            nivel=args.nivel,
+            unidades_shp=args.unidades,
+            campo_unidad=args.campo_unidad,
+            llm_departamentos=args.llm_departamentos,
+            llm_concurrencia=args.llm_concurrencia,
+            delta=args.delta,
+            sitio_fragmentado=args.sitio_fragmentado
+        )
@@ -0,0 +1,163 @@
+# ============================================================
+# GRAFO DE ETAPAS CON ARTEFACTOS DIRECCIONADOS POR CONTENIDO
+#
+# Cada etapa declara de qué etapas depende. Su clave es el hash de:
+#   nombre + versión + parámetros + hash de contenido de cada dependencia
+# El resultado se guarda en disco (pickle) con esa clave, de modo que en
+# la siguiente corrida solo se re-ejecutan las etapas aguas abajo de una
+# entrada que cambió. Si una etapa re-ejecutada produce exactamente el
+# mismo contenido, sus dependientes tampoco se re-ejecutan.
+# ============================================================
+
+import os
+import glob
+import json
+import pickle
+import hashlib
+
+
+def _hash_bytes(datos: bytes) -> str:
+    return hashlib.sha256(datos).hexdigest()[:16]
+
+
+class Etapa:
+    """Nodo del grafo: función + dependencias (o fuente con huella conocida)."""
+
+    def __init__(self, nombre, funcion, dependencias=(), parametros=None,
+                 version="1", salidas=(), huella=None):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.dependencias = list(dependencias)
+        self.parametros = parametros or {}
+        self.version = version
+        # Archivos que la etapa escribe; si falta alguno, se re-ejecuta
+        self.salidas = list(salidas)
+        # Solo para fuentes: hash de contenido ya conocido (p. ej. huella del SHP)
+        self.huella = huella
+
+    @property
+    def es_fuente(self):
+        return self.huella is not None
+
+
+class GrafoEtapas:
+    """Ejecuta etapas en orden topológico reutilizando artefactos vigentes."""
+
+    def __init__(self, dir_artefactos):
+        self.dir_artefactos = dir_artefactos
+        self.etapas = {}
+        self._valores = {}
+        self._contenido = {}
+        self.ejecutadas = []
+        self.reutilizadas = []
+
+    # --------------------------------------------------------
+    # Declaración
+    # --------------------------------------------------------
+    def fuente(self, nombre, huella, cargar):
+        """Entrada del grafo. `cargar` solo se llama si alguna etapa necesita el valor."""
+        self.etapas[nombre] = Etapa(nombre, cargar, huella=huella)
+
+    def etapa(self, nombre, funcion, dependencias, **kwargs):
+        """Etapa derivada: funcion(*valores_de_dependencias)."""
+        for dep in dependencias:
+            if dep not in self.etapas:
+                raise KeyError(f"La etapa '{nombre}' depende de '{dep}', que no está declarada.")
+        self.etapas[nombre] = Etapa(nombre, funcion, dependencias, **kwargs)
+
+    # --------------------------------------------------------
+    # Ejecución
+    # --------------------------------------------------------
+    def _orden(self, objetivos):
+        orden, visitadas = [], set()
+
+        def visitar(nombre):
+            if nombre in visitadas:
+                return
+            visitadas.add(nombre)
+            for dep in self.etapas[nombre].dependencias:
+                visitar(dep)
+            orden.append(nombre)
+
+        for nombre in objetivos:
+            visitar(nombre)
+        return orden
+
+    def _clave(self, etapa):
+        partes = {
+            "nombre": etapa.nombre,
+            "version": etapa.version,
+            "parametros": etapa.parametros,
+            "dependencias": [self._contenido[d] for d in etapa.dependencias],
+        }
+        return _hash_bytes(json.dumps(partes, sort_keys=True, default=str).encode())
+
+    def _rutas(self, etapa, clave):
+        base = os.path.join(self.dir_artefactos, f"{etapa.nombre.replace(':', '__')}-{clave}")
+        return base + ".pkl", base + ".json"
+
+    def valor(self, nombre):
+        """Valor de una etapa ya resuelta (se carga del disco o de la fuente si hace falta)."""
+        if nombre not in self._valores:
+            etapa = self.etapas[nombre]
+            if etapa.es_fuente:
+                self._valores[nombre] = etapa.funcion()
+            else:
+                ruta_pkl, _ = self._rutas(etapa, self._clave(etapa))
+                with open(ruta_pkl, "rb") as f:
+                    self._valores[nombre] = pickle.load(f)
+        return self._valores[nombre]
+
+    def _vigente(self, etapa, ruta_json):
+        if not os.path.exists(ruta_json):
+            return False
+        return all(os.path.exists(s) for s in etapa.salidas)
+
+    def _descartar_anteriores(self, etapa, clave):
+        """Elimina artefactos de la misma etapa con otra clave (ya no vigentes)."""
+        prefijo = os.path.join(self.dir_artefactos, etapa.nombre.replace(":", "__") + "-")
+        for ruta in glob.glob(glob.escape(prefijo) + "*"):
+            if not os.path.basename(ruta).startswith(os.path.basename(prefijo) + clave):
+                os.remove(ruta)
+
+    def ejecutar(self, objetivos=None):
+        """
+        Resuelve los objetivos (por defecto, todas las etapas). Los valores se
+        obtienen después con valor(), que solo carga lo que se pida.
+        """
+        os.makedirs(self.dir_artefactos, exist_ok=True)
+        objetivos = list(objetivos or self.etapas)
+
+        for nombre in self._orden(objetivos):
+            etapa = self.etapas[nombre]
+            if etapa.es_fuente:
+                self._contenido[nombre] = etapa.huella
+                continue
+
+            clave = self._clave(etapa)
+            ruta_pkl, ruta_json = self._rutas(etapa, clave)
+
+            if self._vigente(etapa, ruta_json):
+                with open(ruta_json, encoding="utf-8") as f:
+                    self._contenido[nombre] = json.load(f)["contenido"]
+                self.reutilizadas.append(nombre)
+                continue
+
+            print(f"▶ Etapa {nombre}")
+            valor = etapa.funcion(*[self.valor(d) for d in etapa.dependencias])
+            datos = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+            contenido = _hash_bytes(datos)
+
+            with open(ruta_pkl, "wb") as f:
+                f.write(datos)
+            with open(ruta_json, "w", encoding="utf-8") as f:
+                json.dump({"etapa": nombre, "clave": clave, "contenido": contenido}, f)
+
+            self._descartar_anteriores(etapa, clave)
+
+            self._valores[nombre] = valor
+            self._contenido[nombre] = contenido
+            self.ejecutadas.append(nombre)
+
+        print(f"Etapas ejecutadas: {len(self.ejecutadas)} | reutilizadas: {len(self.reutilizadas)}")
+        return self
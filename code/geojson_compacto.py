@@ -0,0 +1,171 @@
+# ============================================================
+# ESCRITOR DE GEOJSON COMPACTO PARA MAPAS Y MICROSITIO
+#
+# - Solo las columnas que usan los tooltips
+# - Coordenadas EPSG:4326 redondeadas (5 decimales ≈ 1 m)
+# - Escritura por lotes directamente al archivo, sin copiar la capa
+#   completa ni convertir fechas con fix_dates_any
+# - GeoJsonCompacto: capa folium que incrusta ese texto tal cual en el
+#   HTML, sin pasarlo a dict ni volver a serializarlo
+# ============================================================
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import folium
+
+from branca.element import Element
+from folium.features import GeoJsonStyleMapper
+from folium.utilities import get_obj_in_upper_tree
+from pandas.api.types import is_datetime64_any_dtype
+
+
+def _propiedades_lote(df):
+    """Registros JSON-serializables: fechas a texto y nulos a None."""
+    for col in df.columns:
+        if is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].astype(str)
+    df = df.astype(object)
+    return df.where(df.notna(), None).to_dict(orient="records")
+
+
+def _json_simple(valor):
+    """Tipos NumPy a tipos nativos para json.dumps."""
+    return valor.item() if hasattr(valor, "item") else str(valor)
+
+
+def features_compactas(gdf, campos, decimales=5, lote=5000, geometria=None, con_id=False):
+    """
+    Genera el texto JSON de cada Feature de gdf (EPSG:4326, solo `campos`),
+    procesando `lote` features a la vez. Las geometrías nulas se omiten.
+    `geometria` (arreglo alineado con gdf, mismo CRS) reemplaza gdf.geometry.
+    con_id=True agrega "id" (posición en gdf, como texto), el identificador
+    con el que folium asocia estilos a cada feature.
+    """
+    separadores = (",", ":")
+    for inicio in range(0, len(gdf), lote):
+        parte = gdf.iloc[inicio:inicio + lote]
+
+        geoms = parte.geometry
+        if geometria is not None:
+            geoms = gpd.GeoSeries(geometria[inicio:inicio + lote], crs=gdf.crs)
+        if geoms.crs is not None and geoms.crs.to_epsg() != 4326:
+            geoms = geoms.to_crs(4326)
+        geoms = shapely.transform(np.asarray(geoms.values), lambda c: np.round(c, decimales))
+        textos = shapely.to_geojson(geoms)
+
+        props = _propiedades_lote(pd.DataFrame(parte[campos]))
+        for i, (texto, p) in enumerate(zip(textos, props), start=inicio):
+            if texto is None:
+                continue
+            yield ('{"type":"Feature",' + (f'"id":"{i}",' if con_id else "") + '"properties":'
+                   + json.dumps(p, ensure_ascii=False, separators=separadores, default=_json_simple)
+                   + ',"geometry":' + texto + "}")
+
+
+def geojson_compacto(gdf, campos, decimales=5, geometria=None, con_id=False):
+    """FeatureCollection compacta (ver features_compactas) como texto."""
+    return ('{"type":"FeatureCollection","features":['
+            + ",".join(features_compactas(gdf, campos, decimales, geometria=geometria, con_id=con_id))
+            + "]}")
+
+
+def escribir_geojson_compacto(gdf, ruta, campos, decimales=5, lote=5000, geometria=None, con_id=False):
+    """
+    Escribe gdf como FeatureCollection (EPSG:4326) en `ruta` con solo `campos`
+    como propiedades. Procesa `lote` features a la vez. Devuelve el tamaño en bytes.
+    `geometria` (arreglo alineado con gdf, mismo CRS) reemplaza gdf.geometry.
+    """
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write('{"type":"FeatureCollection","features":[')
+        for i, feature in enumerate(features_compactas(gdf, campos, decimales, lote, geometria, con_id)):
+            if i:
+                f.write(",")
+            f.write(feature)
+        f.write("]}")
+
+    return os.path.getsize(ruta)
+
+
+# Marcador que ocupa el lugar de los datos al generar el script de la capa
+_MARCA_DATOS = "__geojson_compacto__"
+
+
+def _json_para_html(texto):
+    """
+    Escapa <, >, & y ' como lo hace el filtro tojson de Jinja: en JSON solo
+    pueden aparecer dentro de cadenas, así que el texto sigue siendo el mismo
+    JSON y no puede cerrar el <script> que lo contiene.
+    """
+    return (texto.replace("&", "\\u0026").replace("<", "\\u003c")
+            .replace(">", "\\u003e").replace("'", "\\u0027"))
+
+
+class _ScriptCrudo(Element):
+    """Script ya generado; se escribe tal cual, sin pasar por Jinja."""
+
+    def __init__(self, texto):
+        super().__init__()
+        self.texto = texto
+
+    def render(self, **kwargs):
+        return self.texto
+
+
+class GeoJsonCompacto(folium.GeoJson):
+    """
+    folium.GeoJson a partir del GeoJSON compacto de una capa.
+
+    folium solo recibe un esqueleto con el id y las propiedades de cada feature
+    (lo que usan estilos y tooltips); las geometrías nunca pasan a dict.
+    Incrustada, el texto compacto se inserta tal cual en el script del mapa;
+    con url (embed=False) el navegador descarga el archivo, que debe haberse
+    escrito con con_id=True.
+    """
+
+    def __init__(self, gdf, campos, texto=None, url=None, **kwargs):
+        propiedades = _propiedades_lote(pd.DataFrame(gdf[campos]))
+        esqueleto = {
+            "type": "FeatureCollection",
+            "features": [{"type": "Feature", "id": str(i), "properties": p, "geometry": None}
+                         for i, p in enumerate(propiedades)],
+        }
+        if not propiedades:
+            # Capa vacía (p. ej. un departamento sin ZRC): GeoJsonTooltip y GeoJsonPopup
+            # validan sus campos contra la primera feature y fallarían
+            kwargs.pop("tooltip", None)
+            kwargs.pop("popup", None)
+        super().__init__(esqueleto, embed=url is None, **kwargs)
+        self.embed = url is None
+        self.embed_link = url
+        self.texto = texto
+
+    def render(self, **kwargs):
+        # Como folium.GeoJson.render, pero el script se genera con un marcador en
+        # lugar de los datos y el marcador se reemplaza por el texto compacto
+        self.parent_map = get_obj_in_upper_tree(self, folium.Map)
+        if (self.style or self.highlight) and self.data["features"]:
+            mapper = GeoJsonStyleMapper(self.data, self.feature_identifier, self)
+            if self.style:
+                self.style_map = mapper.get_style_map(self.style_function)
+            if self.highlight:
+                self.highlight_map = mapper.get_highlight_map(self.highlight_function)
+
+        esqueleto, self.data = self.data, _MARCA_DATOS
+        try:
+            script = Element(self._template.module.script(self, kwargs)).render()
+        finally:
+            self.data = esqueleto
+        if self.embed:
+            script = script.replace(json.dumps(_MARCA_DATOS), _json_para_html(self.texto), 1)
+        self.get_root().script.add_child(_ScriptCrudo(script), name=self.get_name())
+
+        # Tooltips y popups (validan sus campos contra el esqueleto)
+        for hijo in self._children.values():
+            hijo.render(**kwargs)
@@ -0,0 +1,79 @@
+# ============================================================
+# LECTURA SELECTIVA DE SHAPEFILES (pyogrio)
+#
+# - Solo se leen las columnas que usa el pipeline (el resto del DBF
+#   nunca llega a memoria)
+# - Filtro espacial en la lectura (máscara o bbox), p. ej. un departamento
+# - Lectura por lotes (Arrow): cada lote se transforma (limpieza,
+#   reproyección) antes de leer el siguiente, así que el pico de memoria
+#   depende del tamaño del lote y no del archivo completo
+# ============================================================
+
+import warnings
+
+import pandas as pd
+import geopandas as gpd
+import pyogrio
+
+
+def columnas_existentes(ruta, columnas):
+    """Filtra `columnas` a las que existen en el archivo, avisando de las que faltan."""
+    if columnas is None:
+        return None
+    campos = set(pyogrio.read_info(ruta)["fields"])
+    faltantes = [c for c in columnas if c not in campos]
+    if faltantes:
+        warnings.warn(f"{ruta}: columnas inexistentes {faltantes}; se omiten.")
+    return [c for c in columnas if c in campos]
+
+
+def _en_crs_de(ruta, geometria, crs_geometria):
+    """Lleva una geometría (máscara) al CRS del archivo."""
+    crs_archivo = pyogrio.read_info(ruta)["crs"]
+    if crs_archivo is None or crs_geometria is None:
+        return geometria
+    return gpd.GeoSeries([geometria], crs=crs_geometria).to_crs(crs_archivo).iloc[0]
+
+
+def leer_por_lotes(ruta, columnas=None, mascara=None, bbox=None, lote=50000):
+    """
+    Genera GeoDataFrames de hasta `lote` features. `mascara` (geometría en el
+    CRS del archivo) y `bbox` (minx, miny, maxx, maxy) filtran en la lectura.
+    """
+    with pyogrio.raw.open_arrow(
+        ruta, columns=columnas, mask=mascara, bbox=bbox,
+        batch_size=lote, use_pyarrow=True
+    ) as (meta, lector):
+        col_geom = meta["geometry_name"] or "wkb_geometry"
+        for tabla in lector:
+            df = tabla.drop_columns([col_geom]).to_pandas()
+            geoms = gpd.GeoSeries.from_wkb(tabla[col_geom].to_numpy(zero_copy_only=False),
+                                           crs=meta["crs"])
+            yield gpd.GeoDataFrame(df, geometry=geoms.values, crs=meta["crs"])
+
+
+def leer_capa(ruta, columnas=None, mascara=None, crs_mascara=None, bbox=None,
+              lote=None, transformar=None):
+    """
+    Lee un shapefile con solo `columnas` (None = todas) y, opcionalmente, solo
+    las features que tocan `mascara` (en crs_mascara) o `bbox` (CRS del archivo).
+
+    Con `lote` se lee por lotes y `transformar(gdf)` se aplica a cada lote
+    antes de concatenarlos; sin `lote` se lee de una vez y se transforma al final.
+    """
+    columnas = columnas_existentes(ruta, columnas)
+    if mascara is not None and crs_mascara is not None:
+        mascara = _en_crs_de(ruta, mascara, crs_mascara)
+
+    if not lote:
+        gdf = pyogrio.read_dataframe(ruta, columns=columnas, mask=mascara, bbox=bbox)
+        return transformar(gdf) if transformar else gdf
+
+    partes = []
+    for parte in leer_por_lotes(ruta, columnas, mascara, bbox, lote):
+        partes.append(transformar(parte) if transformar else parte)
+    if not partes:
+        gdf = pyogrio.read_dataframe(ruta, columns=columnas, max_features=0)
+        return transformar(gdf) if transformar else gdf
+    gdf = pd.concat(partes, ignore_index=True)
+    return gpd.GeoDataFrame(gdf, geometry="geometry", crs=partes[0].crs)
@@ -0,0 +1,300 @@
+# ============================================================
+# INSTRUMENTACIÓN DEL PIPELINE POR ETAPAS
+#
+# Cada etapa de main() se ejecuta dentro de `with inst.etapa(...)` y deja
+# un registro con tiempo de reloj y CPU, memoria, y conteos de
+# features/vértices de entrada y salida. Al final se escribe un reporte
+# JSON junto a los resultados (outputs/reporte_ejecucion.json).
+#
+# Memoria por etapa: un hilo muestrea el RSS del proceso y de sus hijos
+# (workers) mientras corre la etapa, así que rss_pico_mb es el pico de
+# esa etapa y no el máximo acumulado de la corrida (rss_pico_proceso_mb).
+#
+# El costo base es mínimo (dos relojes, un hilo que muestrea cada 0.1 s y
+# un conteo vectorizado de coordenadas), así que puede quedar activo
+# siempre. Opcionalmente cada etapa se perfila con cProfile o pyinstrument.
+# ============================================================
+
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import platform
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime
+from importlib import metadata
+
+try:
+    import resource  # no existe en Windows
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # sin psutil el RSS actual se lee de /proc (Linux) y sin los hijos
+    psutil = None
+
+PERFILADORES = ("cprofile", "pyinstrument")
+
+# Segundos entre muestras de memoria durante una etapa
+INTERVALO_MUESTREO = 0.1
+
+
+def memoria_pico_mb():
+    """
+    Memoria residente máxima (RSS pico) del proceso en MB, acumulada desde que
+    arrancó: nunca baja y no incluye procesos hijos.
+    """
+    if resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reporta KB; macOS, bytes
+        return pico / 1024 ** 2 if sys.platform == "darwin" else pico / 1024
+    try:
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+    except AttributeError:
+        return float("nan")
+
+
+def memoria_actual_mb():
+    """RSS actual en MB del proceso más el de sus procesos hijos (p. ej. workers)."""
+    if psutil is not None:
+        proceso = psutil.Process()
+        total = proceso.memory_info().rss
+        for hijo in proceso.children(recursive=True):
+            try:
+                total += hijo.memory_info().rss
+            except psutil.Error:  # el hijo terminó entre la lista y la lectura
+                pass
+        return total / 1024 ** 2
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return float("nan")
+
+
+class MuestreoMemoria:
+    """
+    RSS al iniciar y pico durante un bloque (proceso + hijos), muestreado en
+    un hilo cada `intervalo` segundos:
+
+        with MuestreoMemoria() as m:
+            ...
+        m.inicio_mb, m.pico_mb
+    """
+
+    def __init__(self, intervalo=INTERVALO_MUESTREO):
+        self.intervalo = intervalo
+        self.inicio_mb = self.pico_mb = float("nan")
+        self._fin = threading.Event()
+        self._hilo = None
+
+    def _muestrear(self):
+        while not self._fin.wait(self.intervalo):
+            self.pico_mb = max(self.pico_mb, memoria_actual_mb())
+
+    def __enter__(self):
+        self.inicio_mb = self.pico_mb = memoria_actual_mb()
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._fin.set()
+        self._hilo.join()
+        self.pico_mb = max(self.pico_mb, memoria_actual_mb())
+
+
+def _version(paquete):
+    """Versión instalada de un paquete sin importarlo."""
+    try:
+        return metadata.version(paquete)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def contar(obj):
+    """
+    Features y vértices de un objeto del pipeline: GeoDataFrame, DataFrame
+    (solo filas) o tupla/lista/dict de ellos (sumados). None si no aplica.
+    """
+    if isinstance(obj, dict):
+        obj = list(obj.values())
+    if isinstance(obj, (list, tuple)):
+        conteos = [c for c in map(contar, obj) if c is not None]
+        if not conteos:
+            return None
+        return {
+            "features": sum(c["features"] for c in conteos),
+            "vertices": sum(c.get("vertices", 0) for c in conteos),
+        }
+    # Tipos por nombre, para no importar geopandas/pandas si el pipeline no los usó
+    tipos = {f"{c.__module__.split('.')[0]}.{c.__name__}" for c in type(obj).__mro__}
+    if "geopandas.GeoDataFrame" in tipos:
+        import shapely
+        return {
+            "features": len(obj),
+            "vertices": int(shapely.get_num_coordinates(obj.geometry.values).sum()),
+        }
+    if "pandas.DataFrame" in tipos:
+        return {"features": len(obj)}
+    return None
+
+
+class Instrumentacion:
+    """
+    Registro de etapas de una corrida.
+
+    perfil: None, "cprofile" o "pyinstrument". Los perfiles se guardan en
+    dir_perfiles (<etapa>.prof o <etapa>.html) y el reporte incluye las
+    funciones más costosas de cada etapa.
+    """
+
+    def __init__(self, perfil=None, dir_perfiles=None, parametros=None):
+        if perfil is not None and perfil not in PERFILADORES:
+            raise ValueError(f"Perfilador desconocido: {perfil}. Opciones: {PERFILADORES}")
+        if perfil == "pyinstrument":
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                print("⚠️ pyinstrument no está instalado; se usará cProfile.")
+                perfil = "cprofile"
+        self.perfil = perfil
+        self.dir_perfiles = dir_perfiles
+        self.parametros = parametros or {}
+        self.etapas = []
+        self._inicio = datetime.now()
+        self._t0 = time.perf_counter()
+        self._c0 = time.process_time()
+
+    # --------------------------------------------------------
+    # Perfiladores
+    # --------------------------------------------------------
+    def _iniciar_perfil(self):
+        if self.perfil == "cprofile":
+            perfilador = cProfile.Profile()
+            perfilador.enable()
+            return perfilador
+        if self.perfil == "pyinstrument":
+            from pyinstrument import Profiler
+            perfilador = Profiler()
+            perfilador.start()
+            return perfilador
+        return None
+
+    def _cerrar_perfil(self, perfilador, nombre):
+        """Detiene el perfil, lo guarda y devuelve (ruta, funciones más costosas)."""
+        archivo = nombre.replace(":", "_").replace(" ", "_")
+        os.makedirs(self.dir_perfiles, exist_ok=True)
+
+        if self.perfil == "cprofile":
+            perfilador.disable()
+            ruta = os.path.join(self.dir_perfiles, f"{archivo}.prof")
+            perfilador.dump_stats(ruta)
+            stats = pstats.Stats(perfilador, stream=io.StringIO())
+            top = []
+            for (arch, linea, func), (_, ncalls, _, acumulado, _) in stats.stats.items():
+                top.append({
+                    "funcion": f"{os.path.basename(arch)}:{linea}({func})",
+                    "llamadas": ncalls,
+                    "acumulado_s": round(acumulado, 3),
+                })
+            top = sorted(top, key=lambda f: f["acumulado_s"], reverse=True)[:15]
+            return ruta, top
+
+        perfilador.stop()
+        ruta = os.path.join(self.dir_perfiles, f"{archivo}.html")
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(perfilador.output_html())
+        return ruta, None
+
+    # --------------------------------------------------------
+    # Etapas
+    # --------------------------------------------------------
+    @contextmanager
+    def etapa(self, nombre, entradas=None):
+        """
+        Mide el bloque como una etapa. Uso:
+
+            with inst.etapa("superposiciones", entradas=capas) as e:
+                tabla = calcular_superposiciones(...)
+                e.salida(tabla)
+        """
+        registro = _RegistroEtapa(nombre, contar(entradas))
+        perfilador = self._iniciar_perfil()
+        memoria = MuestreoMemoria()
+        t0, c0 = time.perf_counter(), time.process_time()
+        try:
+            with memoria:
+                yield registro
+        except BaseException as error:
+            registro.datos["error"] = repr(error)
+            raise
+        finally:
+            registro.datos["segundos"] = round(time.perf_counter() - t0, 3)
+            registro.datos["cpu_segundos"] = round(time.process_time() - c0, 3)
+            # rss_pico_mb: pico de esta etapa (proceso + workers); rss_pico_proceso_mb: acumulado
+            registro.datos["rss_inicio_mb"] = round(memoria.inicio_mb, 1)
+            registro.datos["rss_pico_mb"] = round(memoria.pico_mb, 1)
+            registro.datos["rss_aumento_mb"] = round(memoria.pico_mb - memoria.inicio_mb, 1)
+            registro.datos["rss_pico_proceso_mb"] = round(memoria_pico_mb(), 1)
+            if perfilador is not None:
+                ruta, top = self._cerrar_perfil(perfilador, nombre)
+                registro.datos["perfil"] = ruta
+                if top:
+                    registro.datos["perfil_top"] = top
+            self.etapas.append(registro.datos)
+            print(f"⏱ {nombre}: {registro.datos['segundos']:.2f} s "
+                  f"(CPU {registro.datos['cpu_segundos']:.2f} s, RSS pico {registro.datos['rss_pico_mb']:.0f} MB, "
+                  f"+{registro.datos['rss_aumento_mb']:.0f} MB en la etapa)")
+
+    # --------------------------------------------------------
+    # Reporte
+    # --------------------------------------------------------
+    def reporte(self):
+        return {
+            "inicio": self._inicio.isoformat(timespec="seconds"),
+            "segundos": round(time.perf_counter() - self._t0, 3),
+            "cpu_segundos": round(time.process_time() - self._c0, 3),
+            # Máximo de los picos por etapa (incluye workers) y del pico acumulado del proceso
+            "rss_pico_mb": round(max([memoria_pico_mb()] + [e["rss_pico_mb"] for e in self.etapas]), 1),
+            "rss_pico_proceso_mb": round(memoria_pico_mb(), 1),
+            "parametros": self.parametros,
+            "entorno": {
+                "python": platform.python_version(),
+                "plataforma": platform.platform(),
+                **{lib: _version(lib) for lib in ("geopandas", "shapely", "pandas")},
+            },
+            "perfil": self.perfil,
+            "etapas": self.etapas,
+        }
+
+    def guardar(self, ruta):
+        """Escribe el reporte JSON y devuelve su contenido."""
+        reporte = self.reporte()
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, ensure_ascii=False, indent=2, default=str)
+        print(f"Reporte de ejecución: {ruta} ({reporte['segundos']:.1f} s, "
+              f"RSS pico {reporte['rss_pico_mb']:.0f} MB)")
+        return reporte
+
+
+class _RegistroEtapa:
+    """Datos de una etapa en curso; salida() agrega conteos del resultado."""
+
+    def __init__(self, nombre, entradas):
+        self.datos = {"etapa": nombre}
+        if entradas is not None:
+            self.datos["entradas"] = entradas
+
+    def salida(self, obj):
+        conteo = contar(obj)
+        if conteo is not None:
+            self.datos["salidas"] = conteo
+        return obj
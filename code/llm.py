@@ -0,0 +1,243 @@
+# ============================================================
+# CLIENTE LLM CONCURRENTE CON CACHÉ (aiohttp)
+#
+# - Una sesión HTTP (pool de conexiones) para todas las solicitudes de una
+#   tanda; a lo sumo `concurrencia` solicitudes en vuelo a la vez
+# - Reintentos con espera exponencial (y jitter) ante 429, 5xx, cortes de
+#   red y timeouts; respeta Retry-After y el estimated_time de Hugging Face
+#   cuando el modelo está cargando (503)
+# - Caché en disco: un JSON por respuesta, con nombre = hash de
+#   (url, prompt, parámetros); una segunda corrida no llama al modelo
+#
+# El endpoint es configurable, así que se puede probar contra un servidor
+# local que imita la respuesta de Hugging Face:
+#
+#   python llm.py simulador --puerto 8081 --fallos 0.3
+#   HF_API_KEY=x HF_API_URL=http://127.0.0.1:8081/modelo python conv.py
+# ============================================================
+
+import os
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+
+import aiohttp
+
+from aiohttp import web
+
+# Estados HTTP que vale la pena reintentar
+ESTADOS_REINTENTABLES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def parametros_generacion(max_tokens=700):
+    """Parámetros de generación del endpoint de inferencia de Hugging Face."""
+    return {
+        "max_new_tokens": max_tokens,
+        "temperature": 0.3,
+        "do_sample": True,
+        "top_p": 0.9,
+        "return_full_text": False
+    }
+
+
+def texto_de_respuesta(data):
+    """Texto generado de una respuesta de Hugging Face ([{"generated_text": ...}])."""
+    if isinstance(data, list) and len(data) > 0 and "generated_text" in data[0]:
+        return data[0]["generated_text"]
+    return str(data)
+
+
+class ClienteLLM:
+    """
+    Cliente asíncrono para un endpoint tipo Hugging Face Inference.
+
+        async with ClienteLLM(url, headers, dir_cache) as cliente:
+            textos = await cliente.generar_varios({"Cauca": prompt1, "Meta": prompt2})
+
+    generar() devuelve "" si el modelo no respondió tras todos los reintentos;
+    las respuestas vacías o fallidas no se guardan en la caché.
+    """
+
+    def __init__(self, api_url, headers, dir_cache=None, concurrencia=4, reintentos=4,
+                 espera_base=1.0, timeout=120):
+        self.api_url = api_url
+        self.headers = headers
+        self.dir_cache = dir_cache
+        self.concurrencia = concurrencia
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.estadisticas = {"cache": 0, "llamadas": 0, "reintentos": 0, "fallidas": 0}
+        self._sesion = None
+        self._semaforo = None
+
+    async def __aenter__(self):
+        self._semaforo = asyncio.Semaphore(self.concurrencia)
+        self._sesion = aiohttp.ClientSession(
+            headers=self.headers, timeout=self.timeout,
+            connector=aiohttp.TCPConnector(limit=self.concurrencia)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._sesion.close()
+
+    # --------------------------------------------------------
+    # Caché en disco
+    # --------------------------------------------------------
+    def clave(self, prompt, parametros):
+        contenido = json.dumps([self.api_url, prompt, parametros], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()[:24]
+
+    def _ruta_cache(self, clave):
+        return os.path.join(self.dir_cache, f"{clave}.json") if self.dir_cache else None
+
+    def _leer_cache(self, clave):
+        ruta = self._ruta_cache(clave)
+        if ruta and os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                return json.load(f)["texto"]
+        return None
+
+    def _guardar_cache(self, clave, prompt, texto):
+        ruta = self._ruta_cache(clave)
+        if not ruta:
+            return
+        os.makedirs(self.dir_cache, exist_ok=True)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"url": self.api_url, "prompt": prompt, "texto": texto}, f, ensure_ascii=False)
+        os.replace(temporal, ruta)
+
+    # --------------------------------------------------------
+    # Solicitudes
+    # --------------------------------------------------------
+    def _espera(self, intento, sugerida=None):
+        if sugerida is not None:
+            return sugerida
+        return self.espera_base * 2 ** intento * (0.5 + random.random())
+
+    async def _solicitar(self, prompt, parametros):
+        """POST con reintentos; devuelve el texto generado o "" si se agotan los intentos."""
+        payload = {"inputs": prompt, "parameters": parametros}
+        for intento in range(self.reintentos + 1):
+            sugerida = None
+            try:
+                self.estadisticas["llamadas"] += 1
+                async with self._sesion.post(self.api_url, json=payload) as resp:
+                    if resp.status == 200:
+                        return texto_de_respuesta(await resp.json(content_type=None))
+                    cuerpo = await resp.text()
+                    if resp.status not in ESTADOS_REINTENTABLES:
+                        print(f"⚠️ LLM respondió {resp.status}: {cuerpo[:300]}")
+                        return ""
+                    sugerida = _espera_sugerida(resp, cuerpo)
+                    motivo = f"estado {resp.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                motivo = type(error).__name__
+
+            if intento < self.reintentos:
+                espera = self._espera(intento, sugerida)
+                self.estadisticas["reintentos"] += 1
+                print(f"  LLM: {motivo}; reintento {intento + 1}/{self.reintentos} en {espera:.1f} s")
+                await asyncio.sleep(espera)
+        print("⚠️ LLM sin respuesta tras todos los reintentos.")
+        return ""
+
+    async def generar(self, prompt, max_tokens=700):
+        """Texto generado para un prompt (desde la caché si ya se pidió antes)."""
+        parametros = parametros_generacion(max_tokens)
+        clave = self.clave(prompt, parametros)
+        texto = self._leer_cache(clave)
+        if texto is not None:
+            self.estadisticas["cache"] += 1
+            return texto
+
+        async with self._semaforo:
+            texto = await self._solicitar(prompt, parametros)
+        if texto:
+            self._guardar_cache(clave, prompt, texto)
+        else:
+            self.estadisticas["fallidas"] += 1
+        return texto
+
+    async def generar_varios(self, prompts, max_tokens=700):
+        """{clave: prompt} -> {clave: texto}, con a lo sumo `concurrencia` solicitudes simultáneas."""
+        claves = list(prompts)
+        textos = await asyncio.gather(*(self.generar(prompts[c], max_tokens) for c in claves))
+        return dict(zip(claves, textos))
+
+
+def _espera_sugerida(resp, cuerpo):
+    """Segundos de Retry-After, o estimated_time de Hugging Face (modelo cargando)."""
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    try:
+        return float(json.loads(cuerpo)["estimated_time"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def generar_textos(prompts, api_url, headers, dir_cache=None, concurrencia=4, max_tokens=700, **opciones):
+    """Versión síncrona de ClienteLLM.generar_varios (una sesión para toda la tanda)."""
+
+    async def _tanda():
+        async with ClienteLLM(api_url, headers, dir_cache, concurrencia, **opciones) as cliente:
+            textos = await cliente.generar_varios(prompts, max_tokens)
+        e = cliente.estadisticas
+        print(f"LLM: {len(prompts)} textos ({e['cache']} desde caché, {e['llamadas']} llamadas, "
+              f"{e['reintentos']} reintentos, {e['fallidas']} fallidas)")
+        return textos
+
+    return asyncio.run(_tanda())
+
+
+# ------------------------------------------------------------
+# Servidor local que imita el endpoint de Hugging Face (pruebas)
+# ------------------------------------------------------------
+def crear_simulador(fallos=0.0, demora=0.0, semilla=None):
+    """
+    Aplicación aiohttp que responde [{"generated_text": ...}] a cualquier POST.
+    fallos: fracción de solicitudes que responden 503 (reintentables);
+    demora: segundos de latencia simulada por solicitud.
+    """
+    azar = random.Random(semilla)
+
+    async def responder(request):
+        datos = await request.json()
+        request.app["solicitudes"] += 1
+        if demora:
+            await asyncio.sleep(demora)
+        if azar.random() < fallos:
+            return web.json_response({"error": "Model is loading", "estimated_time": 0.05}, status=503)
+        prompt = datos.get("inputs", "")
+        texto = f"Texto simulado ({len(prompt)} caracteres de prompt, {hashlib.sha1(prompt.encode()).hexdigest()[:8]})."
+        return web.json_response([{"generated_text": texto}])
+
+    app = web.Application()
+    app["solicitudes"] = 0
+    app.router.add_post("/{ruta:.*}", responder)
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Utilidades del cliente LLM")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    simulador = subcomandos.add_parser("simulador", help="Servidor local que imita Hugging Face.")
+    simulador.add_argument("--host", default="127.0.0.1")
+    simulador.add_argument("--puerto", type=int, default=8081)
+    simulador.add_argument("--fallos", type=float, default=0.0, help="Fracción de respuestas 503.")
+    simulador.add_argument("--demora", type=float, default=0.0, help="Latencia simulada (s).")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.comando == "simulador":
+        web.run_app(crear_simulador(args.fallos, args.demora), host=args.host, port=args.puerto)
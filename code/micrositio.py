@@ -0,0 +1,184 @@
+# ============================================================
+# DATOS FRAGMENTADOS DEL MICROSITIO (CARGA PEREZOSA)
+#
+# El micrositio no incrusta un mapa completo: index.html descarga un
+# manifiesto y la vista nacional (departamentos muy simplificados) y
+# pide el fragmento de un departamento (figuras + estadísticas) solo
+# cuando se selecciona. Cada archivo se escribe también precomprimido
+# (.gz y, si está instalado brotli, .br) para servidores que sirven
+# variantes estáticas; en GitHub Pages la página descarga el .gz y lo
+# descomprime en el navegador (DecompressionStream).
+#
+# Este módulo no importa geopandas ni shapely: lo usa también el
+# subcomando micrositio, que solo escribe index.html.
+# ============================================================
+
+import os
+import json
+import gzip
+
+try:
+    import brotli
+except ImportError:  # sin brotli solo se escriben las variantes .gz
+    brotli = None
+
+# Archivos de micrositio/datos/
+MANIFIESTO = "manifest.json"
+VISTA_NACIONAL = "nacional.json"
+DIR_FRAGMENTOS = "dep"
+
+# Sube si cambia el formato de los archivos de datos
+VERSION_DATOS = 1
+
+LEAFLET_CSS = "https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"
+LEAFLET_JS = "https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"
+
+
+def compresiones_disponibles():
+    """Variantes precomprimidas que se escriben junto a cada archivo."""
+    return ["gz", "br"] if brotli is not None else ["gz"]
+
+
+def escribir_precomprimido(ruta, texto):
+    """
+    Escribe `texto` en ruta, ruta.gz y (con brotli) ruta.br.
+    Devuelve los bytes de cada variante: {"json": ..., "gz": ..., "br": ...}.
+    """
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    datos = texto.encode("utf-8")
+    variantes = {"json": datos, "gz": gzip.compress(datos, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variantes["br"] = brotli.compress(datos, quality=11)
+
+    for extension, contenido in variantes.items():
+        destino = ruta if extension == "json" else f"{ruta}.{extension}"
+        with open(destino, "wb") as f:
+            f.write(contenido)
+    return {extension: len(contenido) for extension, contenido in variantes.items()}
+
+
+def bytes_primera_carga(dir_datos):
+    """Bytes .gz del manifiesto y la vista nacional (lo que la página descarga al abrir)."""
+    return sum(
+        os.path.getsize(os.path.join(dir_datos, f"{nombre}.gz"))
+        for nombre in (MANIFIESTO, VISTA_NACIONAL)
+    )
+
+
+def cabecera_mapa():
+    """Enlaces a Leaflet para el <head> de index.html."""
+    return (f'<link rel="stylesheet" href="{LEAFLET_CSS}">\n'
+            f'    <script src="{LEAFLET_JS}"></script>')
+
+
+def script_mapa(datos_rel="datos"):
+    """<script> de index.html que carga la vista nacional y los fragmentos bajo demanda."""
+    constantes = (f"const DATOS = {json.dumps(datos_rel.rstrip('/') + '/')};\n"
+                  f"const MANIFIESTO = {json.dumps(MANIFIESTO)};\n")
+    return f"<script>\n{constantes}{SCRIPT_MAPA}</script>"
+
+
+SCRIPT_MAPA = r"""
+// JSON desde el .gz precomprimido (descomprimido en el navegador) o, si no se
+// puede, desde el archivo sin comprimir
+async function leerJSON(ruta, comprimido) {
+    if (comprimido && "DecompressionStream" in window) {
+        try {
+            const resp = await fetch(DATOS + ruta + ".gz");
+            if (resp.ok) {
+                const flujo = resp.body.pipeThrough(new DecompressionStream("gzip"));
+                return JSON.parse(await new Response(flujo).text());
+            }
+        } catch (error) {
+            // servidor que ya descomprime el .gz, o navegador sin soporte: archivo plano
+        }
+    }
+    const resp = await fetch(DATOS + ruta);
+    if (!resp.ok) throw new Error(ruta + ": " + resp.status);
+    return resp.json();
+}
+
+function escapar(texto) {
+    return String(texto).replace(/[&<>"]/g, c => ({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"}[c]));
+}
+
+function tablaHTML(filas) {
+    return "<table>" + filas.map(([etiqueta, valor]) =>
+        "<tr><th>" + escapar(etiqueta) + "</th><td>" + escapar(valor ?? "") + "</td></tr>"
+    ).join("") + "</table>";
+}
+
+const mapa = L.map("mapa").setView([4.5, -74.1], 5);
+L.tileLayer("https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}{r}.png", {
+    attribution: "&copy; OpenStreetMap &copy; CARTO", subdomains: "abcd", maxZoom: 19
+}).addTo(mapa);
+
+const selector = document.getElementById("selector-departamento");
+const detalle = document.getElementById("detalle-departamento");
+const fragmentos = new Map();
+let manifiesto, capaNacional, grupos = {};
+
+async function mostrarDepartamento(nombre) {
+    const entrada = manifiesto.departamentos[nombre];
+    if (!entrada) return;
+    selector.value = nombre;
+    detalle.innerHTML = "<p>Cargando " + escapar(nombre) + "…</p>";
+    if (!fragmentos.has(nombre)) {
+        fragmentos.set(nombre, leerJSON(entrada.archivo, manifiesto.comprimidos.length > 0));
+    }
+    let fragmento;
+    try {
+        fragmento = await fragmentos.get(nombre);
+    } catch (error) {
+        fragmentos.delete(nombre);
+        detalle.innerHTML = "<p>No se pudo cargar " + escapar(nombre) + " (" + escapar(error.message) + ").</p>";
+        return;
+    }
+
+    for (const [capa, estilo] of Object.entries(manifiesto.capas)) {
+        grupos[capa].clearLayers();
+        const datos = fragmento.capas[capa];
+        if (!datos) continue;
+        L.geoJSON(datos, {
+            style: {color: estilo.color, fillColor: estilo.relleno, fillOpacity: estilo.opacidad, weight: 1},
+            onEachFeature: (feature, capaLeaflet) => capaLeaflet.bindTooltip(tablaHTML(
+                estilo.campos.map(([campo, alias]) => [alias, feature.properties[campo]])
+            ))
+        }).addTo(grupos[capa]);
+    }
+    capaNacional.eachLayer(capa => {
+        if (capa.feature.properties.dpto_cnmbr === nombre) mapa.fitBounds(capa.getBounds());
+    });
+    detalle.innerHTML = "<h2>" + escapar(nombre) + "</h2>" + tablaHTML(fragmento.estadisticas);
+}
+
+async function iniciar() {
+    manifiesto = await leerJSON(MANIFIESTO, false);
+    const nacional = await leerJSON(manifiesto.vista_nacional, manifiesto.comprimidos.length > 0);
+
+    capaNacional = L.geoJSON(nacional, {
+        style: {color: "#555555", fillColor: "#ffffff", fillOpacity: 0.1, weight: 1},
+        onEachFeature: (feature, capa) => {
+            capa.bindTooltip(escapar(feature.properties.dpto_cnmbr) + "<br>Área superpuesta: "
+                             + escapar(feature.properties.area_total_super_km2_txt) + " km²");
+            capa.on("click", () => mostrarDepartamento(feature.properties.dpto_cnmbr));
+        }
+    }).addTo(mapa);
+
+    const control = L.control.layers(null, {"Departamentos": capaNacional}, {collapsed: false}).addTo(mapa);
+    for (const [capa, estilo] of Object.entries(manifiesto.capas)) {
+        grupos[capa] = L.layerGroup().addTo(mapa);
+        control.addOverlay(grupos[capa], estilo.nombre);
+    }
+
+    for (const nombre of Object.keys(manifiesto.departamentos).sort((a, b) => a.localeCompare(b, "es"))) {
+        selector.add(new Option(nombre, nombre));
+    }
+    selector.addEventListener("change", () => mostrarDepartamento(selector.value));
+}
+
+iniciar().catch(error => {
+    detalle.innerHTML = "<p>No se pudieron cargar los datos del mapa (" + escapar(error.message)
+        + "). El micrositio debe servirse por HTTP, p. ej. GitHub Pages.</p>";
+});
+"""
@@ -0,0 +1,183 @@
+# ============================================================
+# CONVERGENCIA APROXIMADA EN GRILLA (modo exploratorio)
+#
+# Las cuatro capas temáticas se rasterizan sobre una grilla EPSG:3116
+# (100 m – 1 km) como bits de una máscara uint8 por celda, y los
+# departamentos como un índice por celda. Las áreas de todas las
+# combinaciones por departamento salen de un solo np.bincount sobre
+# (departamento, máscara), sin ninguna operación vectorial.
+#
+# Una celda pertenece a un polígono si su centro cae dentro (mismo
+# criterio que rasterio sin all_touched), así que el error es del orden
+# de media celda a lo largo de los bordes.
+# ============================================================
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from pyproj import Transformer
+
+try:
+    from rasterio import features
+    from rasterio.transform import from_origin
+except ImportError:  # sin rasterio se rasteriza con shapely.contains_xy
+    features = None
+
+# Número de figuras presentes para cada máscara de 4 bits
+N_FIGURAS_MASCARA = np.array([bin(m).count("1") for m in range(16)], dtype=np.uint8)
+
+# Colores del mapa de densidad (1, 2, 3 y 4 figuras superpuestas), RGBA
+COLORES_DENSIDAD = np.array([
+    [0, 0, 0, 0],
+    [255, 237, 160, 110],
+    [254, 178, 76, 170],
+    [240, 59, 32, 210],
+    [128, 0, 38, 235],
+], dtype=np.uint8)
+
+
+class Grilla:
+    """Grilla regular alineada a múltiplos de la resolución (coordenadas EPSG:3116)."""
+
+    def __init__(self, bounds, resolucion):
+        minx, miny, maxx, maxy = bounds
+        self.resolucion = float(resolucion)
+        self.x0 = float(np.floor(minx / resolucion) * resolucion)
+        self.y1 = float(np.ceil(maxy / resolucion) * resolucion)
+        self.ancho = int(np.ceil((maxx - self.x0) / resolucion))
+        self.alto = int(np.ceil((self.y1 - miny) / resolucion))
+
+    @property
+    def forma(self):
+        return self.alto, self.ancho
+
+    @property
+    def area_celda_km2(self):
+        return self.resolucion ** 2 / 1e6
+
+    def ventana(self, bounds):
+        """Filas y columnas (slices) de la grilla que cubren bounds."""
+        minx, miny, maxx, maxy = bounds
+        c0 = max(int(np.floor((minx - self.x0) / self.resolucion)), 0)
+        c1 = min(int(np.ceil((maxx - self.x0) / self.resolucion)), self.ancho)
+        f0 = max(int(np.floor((self.y1 - maxy) / self.resolucion)), 0)
+        f1 = min(int(np.ceil((self.y1 - miny) / self.resolucion)), self.alto)
+        return slice(f0, f1), slice(c0, c1)
+
+    def centros(self, filas, columnas):
+        """Coordenadas x, y de los centros de celda de una ventana."""
+        xs = self.x0 + (np.arange(columnas.start, columnas.stop) + 0.5) * self.resolucion
+        ys = self.y1 - (np.arange(filas.start, filas.stop) + 0.5) * self.resolucion
+        return np.meshgrid(xs, ys)
+
+
+def rasterizar(geometrias, grilla, valores=None, dtype=np.uint8):
+    """
+    Arreglo (alto, ancho) con el valor de cada geometría en las celdas cuyo
+    centro cae dentro (por defecto 1). Si varias se solapan queda la última.
+    """
+    geometrias = np.asarray(geometrias)
+    valores = np.ones(len(geometrias), dtype=dtype) if valores is None else np.asarray(valores, dtype=dtype)
+    validas = ~(shapely.is_missing(geometrias) | shapely.is_empty(geometrias))
+
+    if features is not None:
+        return features.rasterize(
+            zip(geometrias[validas], valores[validas].tolist()),
+            out_shape=grilla.forma,
+            transform=from_origin(grilla.x0, grilla.y1, grilla.resolucion, grilla.resolucion),
+            fill=0, dtype=np.dtype(dtype).name
+        )
+
+    salida = np.zeros(grilla.forma, dtype=dtype)
+    shapely.prepare(geometrias[validas])
+    for geom, valor, limites in zip(geometrias[validas], valores[validas],
+                                    shapely.bounds(geometrias[validas])):
+        filas, columnas = grilla.ventana(limites)
+        if filas.start >= filas.stop or columnas.start >= columnas.stop:
+            continue
+        xx, yy = grilla.centros(filas, columnas)
+        dentro = shapely.contains_xy(geom, xx, yy)
+        salida[filas, columnas][dentro] = valor
+    return salida
+
+
+class ConvergenciaRaster:
+    """
+    Máscara de figuras por celda y departamento de cada celda.
+
+    capas: {nombre: GeoDataFrame EPSG:3116}; bits: {nombre: bit de la máscara}.
+    clave: columna de dep_3116 que identifica cada unidad (departamento o municipio).
+    """
+
+    def __init__(self, capas, bits, dep_3116, resolucion=1000, clave="dpto_cnmbr"):
+        self.grilla = Grilla(dep_3116.total_bounds, resolucion)
+        self.clave = clave
+        self.nombres_dep = dep_3116[clave].to_numpy()
+
+        # Índice de departamento por celda (0 = fuera de todo departamento)
+        tipo_dep = np.uint8 if len(dep_3116) < 255 else np.uint16
+        self.id_dep = rasterizar(dep_3116.geometry.values, self.grilla,
+                                 np.arange(1, len(dep_3116) + 1), dtype=tipo_dep)
+
+        self.mascara = np.zeros(self.grilla.forma, dtype=np.uint8)
+        for nombre, gdf in capas.items():
+            self.mascara |= rasterizar(gdf.geometry.values, self.grilla, dtype=np.uint8) * np.uint8(bits[nombre])
+
+    def particion(self, filas_bloque=2048):
+        """
+        Área (km²) por departamento y máscara, con la misma forma que la
+        partición planar vectorial: columnas dpto_cnmbr (o clave), mascara, area_km2.
+        Se recorre por bloques de filas para acotar la memoria en grillas finas.
+        """
+        n_dep = len(self.nombres_dep)
+        conteo = np.zeros((n_dep + 1) * 16, dtype=np.int64)
+        for f0 in range(0, self.grilla.alto, filas_bloque):
+            clave = self.id_dep[f0:f0 + filas_bloque].astype(np.int64) * 16 + self.mascara[f0:f0 + filas_bloque]
+            conteo += np.bincount(clave.ravel(), minlength=len(conteo))
+
+        conteo = conteo.reshape(n_dep + 1, 16)[1:]
+        idx_dep, mascaras = np.nonzero(conteo)
+        return pd.DataFrame({
+            self.clave: self.nombres_dep[idx_dep],
+            "mascara": mascaras.astype(np.uint8),
+            "area_km2": conteo[idx_dep, mascaras] * self.grilla.area_celda_km2,
+        })
+
+    def conteo_figuras(self):
+        """Número de figuras distintas que cubren cada celda (0–4)."""
+        conteo = N_FIGURAS_MASCARA[self.mascara]
+        conteo[self.id_dep == 0] = 0
+        return conteo
+
+    def imagen_densidad(self, ancho_px=1200):
+        """
+        Imagen RGBA en Web Mercator (filas uniformes en y de EPSG:3857, como
+        la dibuja Leaflet) con el número de figuras por celda, y sus límites
+        [[lat_min, lon_min], [lat_max, lon_max]] para folium.ImageOverlay.
+        """
+        g = self.grilla
+        conteo = self.conteo_figuras()
+        a_3857 = Transformer.from_crs(3116, 3857, always_xy=True)
+        a_3116 = Transformer.from_crs(3857, 3116, always_xy=True)
+        a_4326 = Transformer.from_crs(3857, 4326, always_xy=True)
+
+        minx, miny, maxx, maxy = a_3857.transform_bounds(
+            g.x0, g.y1 - g.alto * g.resolucion, g.x0 + g.ancho * g.resolucion, g.y1
+        )
+        alto_px = max(int(ancho_px * (maxy - miny) / (maxx - minx)), 1)
+        xs = minx + (np.arange(ancho_px) + 0.5) * (maxx - minx) / ancho_px
+        ys = maxy - (np.arange(alto_px) + 0.5) * (maxy - miny) / alto_px
+        xx, yy = np.meshgrid(xs, ys)
+
+        # Vecino más cercano: centro de cada píxel → celda de la grilla EPSG:3116
+        x, y = a_3116.transform(xx, yy)
+        col = np.floor((x - g.x0) / g.resolucion).astype(np.int64)
+        fila = np.floor((g.y1 - y) / g.resolucion).astype(np.int64)
+        dentro = (col >= 0) & (col < g.ancho) & (fila >= 0) & (fila < g.alto)
+        valores = np.zeros(xx.shape, dtype=np.uint8)
+        valores[dentro] = conteo[fila[dentro], col[dentro]]
+
+        lon_min, lat_min = a_4326.transform(minx, miny)
+        lon_max, lat_max = a_4326.transform(maxx, maxy)
+        return COLORES_DENSIDAD[valores], [[lat_min, lon_min], [lat_max, lon_max]]
@@ -0,0 +1,89 @@
+# ============================================================
+# SIMPLIFICACIÓN CON TOPOLOGÍA COMPARTIDA Y NIVELES DE DETALLE
+#
+# Los bordes de todos los polígonos de una capa se nodan y se parten
+# en arcos entre nudos. Cada arco se simplifica UNA vez y lo comparten
+# los polígonos vecinos, así que no aparecen huecos ni traslapes entre
+# resguardos o departamentos contiguos. Los polígonos se reconstruyen
+# a partir de las caras de los arcos simplificados.
+# ============================================================
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# Tolerancias (m, EPSG:3116) por nivel de detalle y banda de zoom web
+NIVELES_DETALLE = {
+    "nacional": {"tolerancia": 1500, "zoom": (0, 6)},
+    "regional": {"tolerancia": 400,  "zoom": (7, 9)},
+    "local":    {"tolerancia": 100,  "zoom": (10, 22)},
+}
+
+
+class TopologiaCompartida:
+    """Arcos compartidos de una capa poligonal, listos para simplificar a varias tolerancias."""
+
+    def __init__(self, geometrias):
+        self.geoms = np.asarray(geometrias)
+        bordes = shapely.boundary(self.geoms)
+        red = shapely.union_all(bordes[~shapely.is_empty(bordes)])
+        self.arcos = shapely.get_parts(shapely.line_merge(red))
+        self.arbol = shapely.STRtree(self.geoms)
+
+    def simplificar(self, tolerancia):
+        """Devuelve un arreglo de geometrías simplificadas, alineado con las originales."""
+        arcos = shapely.simplify(self.arcos, tolerancia, preserve_topology=True)
+        # Arcos distintos pueden cruzarse tras simplificar: se vuelven a nodar
+        red = shapely.union_all(arcos[~shapely.is_empty(arcos)])
+        caras = shapely.get_parts(shapely.polygonize(shapely.get_parts(red)))
+
+        # Cada cara pertenece a los polígonos originales que contienen su punto interior
+        idx_cara, idx_geom = self.arbol.query(shapely.point_on_surface(caras), predicate="within")
+        orden = np.argsort(idx_geom, kind="stable")
+        idx_cara, idx_geom = idx_cara[orden], idx_geom[orden]
+
+        resultado = np.full(len(self.geoms), None, dtype=object)
+        grupos, inicios = np.unique(idx_geom, return_index=True)
+        for i, caras_i in zip(grupos, np.split(idx_cara, inicios[1:])):
+            resultado[i] = shapely.coverage_union_all(caras[caras_i])
+
+        # Polígonos que colapsaron (más pequeños que la tolerancia): simplificación simple
+        faltantes = np.array([g is None or g.is_empty for g in resultado], dtype=bool)
+        resultado[faltantes] = shapely.simplify(self.geoms[faltantes], tolerancia, preserve_topology=True)
+        return resultado
+
+
+def simplificar_topologia(gdf, tolerancia):
+    """Geometrías de gdf simplificadas sobre arcos compartidos (arreglo alineado con gdf)."""
+    return TopologiaCompartida(gdf.geometry.values).simplificar(tolerancia)
+
+
+def _medir(geoms, crs):
+    """Vértices y bytes del GeoJSON (EPSG:4326) de un arreglo de geometrías."""
+    serie = gpd.GeoSeries(geoms, crs=crs)
+    return int(shapely.get_num_coordinates(np.asarray(geoms)).sum()), len(serie.to_crs(4326).to_json())
+
+
+def niveles_de_detalle(gdf, nombre, niveles=None):
+    """
+    Genera un GeoDataFrame por nivel de detalle (ver NIVELES_DETALLE) reutilizando
+    los mismos arcos, y una tabla con vértices y bytes por nivel.
+    """
+    niveles = niveles or NIVELES_DETALLE
+    topologia = TopologiaCompartida(gdf.geometry.values)
+
+    vertices, peso = _medir(topologia.geoms, gdf.crs)
+    filas = [{"capa": nombre, "nivel": "original", "tolerancia_m": 0,
+              "vertices": vertices, "bytes_geojson": peso}]
+    capas = {}
+    for nivel, cfg in niveles.items():
+        geoms = topologia.simplificar(cfg["tolerancia"])
+        capa = gdf.copy()
+        capa["geometry"] = geoms
+        capas[nivel] = capa
+
+        vertices, peso = _medir(geoms, gdf.crs)
+        filas.append({"capa": nombre, "nivel": nivel, "tolerancia_m": cfg["tolerancia"],
+                      "vertices": vertices, "bytes_geojson": peso})
+    return capas, pd.DataFrame(filas)
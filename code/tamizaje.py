@@ -0,0 +1,164 @@
+# ============================================================
+# TAMIZAJE DE PROYECTOS CONTRA LAS FIGURAS TERRITORIALES
+#
+# Dado un archivo con miles de huellas candidatas (polígonos o puntos),
+# responde en una sola pasada vectorizada qué ZRC, resguardos, consejos
+# comunitarios y municipios CFA toca cada candidato y con cuánta área.
+#
+# - Los índices espaciales (STRtree) de las capas EPSG:3116 se construyen
+#   una vez y se reutilizan para todos los lotes
+# - Cuando la figura contiene por completo al candidato (lo más común: un
+#   proyecto dentro de un municipio) el área es la del candidato y no se
+#   calcula ninguna intersección
+#
+# USO
+#   python tamizaje.py candidatos.gpkg
+#   python tamizaje.py puntos.shp --buffer 500 --salida resultados/
+# ============================================================
+
+import os
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+import conv
+
+# El primer campo del tooltip de cada capa es el nombre de la figura
+CAMPO_NOMBRE = {capa: campos[0] for capa, campos in conv.CAMPOS_MAPA.items()}
+
+
+class IndiceFiguras:
+    """Geometrías preparadas, STRtree y nombres de las capas temáticas (EPSG:3116)."""
+
+    def __init__(self, cc_3116, res_3116, zrc_3116, cfa_3116, dep_3116=None):
+        capas = {"zrc": zrc_3116, "res": res_3116, "cc": cc_3116, "cfa": cfa_3116}
+        self.geoms, self.nombres, self.arboles = {}, {}, {}
+        for capa, gdf in capas.items():
+            geoms = np.asarray(gdf.geometry.values)
+            shapely.prepare(geoms)
+            self.geoms[capa] = geoms
+            self.nombres[capa] = gdf[CAMPO_NOMBRE[capa]].astype(str).to_numpy()
+            self.arboles[capa] = shapely.STRtree(geoms)
+
+        self.dep_geoms, self.dep_nombres, self.arbol_dep = None, None, None
+        if dep_3116 is not None:
+            self.dep_geoms = np.asarray(dep_3116.geometry.values)
+            self.dep_nombres = dep_3116["dpto_cnmbr"].astype(str).to_numpy()
+            self.arbol_dep = shapely.STRtree(self.dep_geoms)
+
+    @classmethod
+    def desde_cache(cls, usar_cache=True, workers=1):
+        """Índice sobre las capas preparadas de conv (caché GeoParquet)."""
+        return cls(*conv.cargar_capas_preparadas(usar_cache=usar_cache, workers=workers))
+
+
+def _areas_interseccion(candidatos, figuras, idx_cand, idx_fig):
+    """Área (km²) de cada par candidato-figura; evita la intersección si la figura lo contiene."""
+    a = candidatos[idx_cand]
+    b = figuras[idx_fig]
+    area = np.zeros(len(idx_cand))
+
+    poligonal = shapely.area(a) > 0
+    if not poligonal.any():
+        return area
+    contenido = np.zeros(len(idx_cand), dtype=bool)
+    contenido[poligonal] = shapely.contains_properly(b[poligonal], a[poligonal])
+    area[contenido] = shapely.area(a[contenido])
+
+    resto = poligonal & ~contenido
+    area[resto] = shapely.area(shapely.intersection(a[resto], b[resto]))
+    return area / 1e6
+
+
+def tamizar(candidatos, indice, buffer_m=0):
+    """
+    Cruza candidatos (GeoDataFrame, cualquier CRS) con las capas del índice.
+    Devuelve (resumen, detalle):
+    - resumen: una fila por candidato con n_<capa>, area_<capa>_km2 y nombres_<capa>
+    - detalle: una fila por par candidato-figura (capa, figura_id, nombre, area_km2)
+    buffer_m convierte puntos/líneas (o amplía polígonos) en un área de influencia.
+    """
+    geoms = np.asarray(candidatos.to_crs(3116).geometry.values)
+    if buffer_m:
+        geoms = shapely.buffer(geoms, buffer_m)
+    n = len(geoms)
+
+    resumen = pd.DataFrame(index=candidatos.index)
+    resumen["area_candidato_km2"] = shapely.area(geoms) / 1e6
+    detalles = []
+
+    for capa, arbol in indice.arboles.items():
+        idx_cand, idx_fig = arbol.query(geoms, predicate="intersects")
+        orden = np.lexsort((idx_fig, idx_cand))
+        idx_cand, idx_fig = idx_cand[orden], idx_fig[orden]
+        area = _areas_interseccion(geoms, indice.geoms[capa], idx_cand, idx_fig)
+        nombres = indice.nombres[capa][idx_fig]
+
+        resumen[f"n_{capa}"] = np.bincount(idx_cand, minlength=n)
+        resumen[f"area_{capa}_km2"] = np.bincount(idx_cand, weights=area, minlength=n)
+        por_cand = pd.Series(nombres).groupby(idx_cand).agg("; ".join)
+        resumen[f"nombres_{capa}"] = por_cand.reindex(np.arange(n), fill_value="").to_numpy()
+
+        detalles.append(pd.DataFrame({
+            "candidato": candidatos.index.to_numpy()[idx_cand],
+            "capa": capa,
+            "figura_id": idx_fig,
+            "nombre": nombres,
+            "area_km2": area,
+        }))
+
+    if indice.arbol_dep is not None:
+        idx_cand, idx_dep = indice.arbol_dep.query(geoms, predicate="intersects")
+        orden = np.lexsort((idx_dep, idx_cand))
+        por_cand = pd.Series(indice.dep_nombres[idx_dep[orden]]).groupby(idx_cand[orden]).agg("; ".join)
+        resumen["departamentos"] = por_cand.reindex(np.arange(n), fill_value="").to_numpy()
+
+    detalle = pd.concat(detalles, ignore_index=True)
+    return resumen, detalle
+
+
+def tamizar_archivo(ruta, indice=None, buffer_m=0, dir_salida=None):
+    """Lee candidatos de un archivo vectorial, tamiza y escribe <nombre>_resumen/_detalle.csv."""
+    candidatos = gpd.read_file(ruta)
+    if candidatos.crs is None:
+        raise ValueError(f"{ruta} no tiene CRS definido.")
+    indice = indice or IndiceFiguras.desde_cache()
+
+    t0 = time.perf_counter()
+    resumen, detalle = tamizar(candidatos, indice, buffer_m=buffer_m)
+    segundos = time.perf_counter() - t0
+    print(f"Tamizaje: {len(candidatos)} candidatos en {segundos:.2f} s "
+          f"({len(candidatos) / max(segundos, 1e-9):,.0f} por segundo)")
+
+    dir_salida = dir_salida or os.path.join(conv.TABLAS_DIR, "tamizaje")
+    os.makedirs(dir_salida, exist_ok=True)
+    base = os.path.splitext(os.path.basename(ruta))[0]
+    atributos = pd.DataFrame(candidatos.drop(columns="geometry"))
+    resumen = atributos.join(resumen)
+    path_resumen = os.path.join(dir_salida, f"{base}_resumen.csv")
+    path_detalle = os.path.join(dir_salida, f"{base}_detalle.csv")
+    resumen.to_csv(path_resumen, index_label="candidato", encoding="utf-8-sig")
+    detalle.to_csv(path_detalle, index=False, encoding="utf-8-sig")
+    print("Resultados de tamizaje en:", dir_salida)
+    return resumen, detalle
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tamizaje de huellas de proyectos contra las figuras territoriales")
+    parser.add_argument("candidatos", help="Archivo vectorial (SHP, GPKG, GeoJSON...) con polígonos o puntos.")
+    parser.add_argument("--buffer", type=float, default=0,
+                        help="Área de influencia en metros alrededor de cada candidato.")
+    parser.add_argument("--salida", default=None, help="Carpeta de salida (por defecto outputs/tablas/tamizaje).")
+    parser.add_argument("--base-dir", default=None, help="Carpeta base del proyecto (por defecto CONVERGENCIA_BASE_DIR del entorno/.env).")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    conv.cargar_entorno()
+    conv.configurar_rutas(args.base_dir or os.getenv("CONVERGENCIA_BASE_DIR", conv.BASE_DIR))
+    tamizar_archivo(args.candidatos, buffer_m=args.buffer, dir_salida=args.salida)
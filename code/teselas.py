@@ -0,0 +1,154 @@
+# ============================================================
+# TESELAS VECTORIALES (MVT) PARA LOS MAPAS DEL MICROSITIO
+#
+# Genera una pirámide estática z/x/y.pbf por capa (Web Mercator),
+# apta para GitHub Pages. El mapa carga solo las teselas visibles,
+# así que el peso de la página no depende del tamaño de las capas.
+# ============================================================
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import shapely
+import mapbox_vector_tile
+
+from branca.element import MacroElement
+from jinja2 import Template
+
+from simplificacion import TopologiaCompartida
+
+# Semieje de la proyección Web Mercator (EPSG:3857)
+ORIGEN_3857 = 20037508.342789244
+
+
+def _tamano_tesela(z):
+    return 2 * ORIGEN_3857 / (2 ** z)
+
+
+def _rango_teselas(bounds, z):
+    """Índices x/y de las teselas que cubren bounds (minx, miny, maxx, maxy) en 3857."""
+    tam = _tamano_tesela(z)
+    n = 2 ** z
+    minx, miny, maxx, maxy = bounds
+    x0 = int(np.clip((minx + ORIGEN_3857) // tam, 0, n - 1))
+    x1 = int(np.clip((maxx + ORIGEN_3857) // tam, 0, n - 1))
+    y0 = int(np.clip((ORIGEN_3857 - maxy) // tam, 0, n - 1))
+    y1 = int(np.clip((ORIGEN_3857 - miny) // tam, 0, n - 1))
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+def _limites_tesela(x, y, z):
+    tam = _tamano_tesela(z)
+    minx = -ORIGEN_3857 + x * tam
+    maxy = ORIGEN_3857 - y * tam
+    return minx, maxy - tam, minx + tam, maxy
+
+
+def _propiedades(df):
+    """Atributos como tipos simples de Python (MVT no admite nulos ni fechas)."""
+    registros = []
+    for fila in df.to_dict(orient="records"):
+        props = {}
+        for k, v in fila.items():
+            if v is None or (isinstance(v, float) and np.isnan(v)):
+                continue
+            if isinstance(v, (np.integer, np.floating, np.bool_)):
+                v = v.item()
+            elif not isinstance(v, (str, int, float, bool)):
+                v = str(v)
+            props[k] = v
+        registros.append(props)
+    return registros
+
+
+def exportar_teselas(gdf, dir_salida, nombre_capa, zoom_min=4, zoom_max=10,
+                     extent=4096, buffer_px=64):
+    """
+    Escribe dir_salida/{z}/{x}/{y}.pbf con una capa MVT `nombre_capa`.
+    En cada zoom la geometría se simplifica a medio píxel de pantalla sobre
+    arcos compartidos (sin huecos entre vecinos) y se recorta al tamaño de la
+    tesela (más un margen para evitar cortes visibles).
+    Devuelve un resumen con el número de teselas y bytes escritos.
+    """
+    gdf_3857 = gdf.to_crs(3857)
+    geoms = np.asarray(gdf_3857.geometry.values)
+    props = _propiedades(pd.DataFrame(gdf_3857.drop(columns="geometry")))
+    bounds = gdf_3857.total_bounds
+    topologia = TopologiaCompartida(geoms)
+
+    n_teselas, n_bytes = 0, 0
+    # Capa vacía (p. ej. un departamento sin ZRC): sin teselas, solo metadatos
+    zooms = range(zoom_min, zoom_max + 1) if len(geoms) else range(0)
+    for z in zooms:
+        tam = _tamano_tesela(z)
+        margen = tam * buffer_px / extent
+        geoms_z = topologia.simplificar(tam / 512)
+        arbol = shapely.STRtree(geoms_z)
+
+        xs, ys = _rango_teselas(bounds, z)
+        teselas = [(x, y) for x in xs for y in ys]
+        cajas = shapely.box(*np.array([
+            _limites_tesela(x, y, z) for x, y in teselas
+        ]).T)
+        idx_tesela, idx_geom = arbol.query(cajas, predicate="intersects")
+
+        for i in np.unique(idx_tesela):
+            x, y = teselas[i]
+            limites = _limites_tesela(x, y, z)
+            candidatos = idx_geom[idx_tesela == i]
+            recortes = shapely.clip_by_rect(
+                geoms_z[candidatos],
+                limites[0] - margen, limites[1] - margen,
+                limites[2] + margen, limites[3] + margen
+            )
+            features = [
+                {"geometry": g, "properties": props[j], "id": int(j)}
+                for g, j in zip(recortes, candidatos)
+                if not g.is_empty and g.area > 0
+            ]
+            if not features:
+                continue
+
+            datos = mapbox_vector_tile.encode(
+                [{"name": nombre_capa, "features": features}],
+                default_options={"quantize_bounds": limites, "extents": extent}
+            )
+            ruta = os.path.join(dir_salida, str(z), str(x), f"{y}.pbf")
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            with open(ruta, "wb") as f:
+                f.write(datos)
+            n_teselas += 1
+            n_bytes += len(datos)
+
+    # Metadatos mínimos (estilo TileJSON) para depuración y otros visores
+    lon_lat = gdf.to_crs(4326).total_bounds
+    metadatos = {
+        "name": nombre_capa,
+        "minzoom": zoom_min,
+        "maxzoom": zoom_max,
+        "bounds": [float(v) for v in lon_lat] if len(geoms) else None,
+        "tiles": ["{z}/{x}/{y}.pbf"],
+        "n_teselas": n_teselas,
+        "bytes": n_bytes,
+    }
+    os.makedirs(dir_salida, exist_ok=True)
+    with open(os.path.join(dir_salida, "metadata.json"), "w", encoding="utf-8") as f:
+        json.dump(metadatos, f, indent=2)
+
+    print(f"Teselas '{nombre_capa}': {n_teselas} archivos, {n_bytes / 1e6:.1f} MB (z{zoom_min}-{zoom_max})")
+    return metadatos
+
+
+class PopupTeselas(MacroElement):
+    """Popup con los atributos de la figura al hacer clic sobre una capa de teselas."""
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            {{ this._parent.get_name() }}.on("click", function (e) {
+                var p = e.layer.properties, html = "";
+                for (var k in p) { html += "<b>" + k + ":</b> " + p[k] + "<br>"; }
+                L.popup().setLatLng(e.latlng).setContent(html).openOn({{ this._parent._parent.get_name() }});
+            });
+        {% endmacro %}
+    """)
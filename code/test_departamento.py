@@ -0,0 +1,67 @@
+# ============================================================
+# PRUEBA: PIPELINE FILTRADO POR UN DEPARTAMENTO SIN ZRC
+#
+# Corre el pipeline nacional y luego --departamento sobre capas
+# sintéticas (benchmark.py). El departamento elegido no tiene ZRC:
+# la capa queda vacía en mapas y teselas, y las salidas deben ir a
+# outputs/<DEPARTAMENTO>/ sin tocar las tablas nacionales.
+#
+#   python -m pytest code/test_departamento.py
+# ============================================================
+
+import os
+import hashlib
+
+import pandas as pd
+import geopandas as gpd
+
+import conv
+from benchmark import escribir_shapes_sinteticos
+
+SALIDAS_NACIONALES = [
+    ("tablas", "tabla_final_geografica.parquet"),
+    ("tablas", "tablas_convergencia.xlsx"),
+    ("micrositio", "tabla_final_min.json"),
+]
+
+
+def _huellas(output_dir):
+    huellas = {}
+    for partes in SALIDAS_NACIONALES:
+        with open(os.path.join(output_dir, *partes), "rb") as f:
+            huellas[partes] = hashlib.sha256(f.read()).hexdigest()
+    return huellas
+
+
+def _departamento_sin_zrc():
+    dep = gpd.read_file(conv.DEP_PATH)
+    zrc = gpd.read_file(conv.ZRC_PATH).to_crs(dep.crs)
+    con_zrc = gpd.sjoin(dep, zrc, predicate="intersects")["dpto_cnmbr"].unique()
+    return sorted(set(dep["dpto_cnmbr"]) - set(con_zrc))[0]
+
+
+def test_departamento_sin_zrc(tmp_path):
+    base_dir = str(tmp_path)
+    escribir_shapes_sinteticos(base_dir, escala=0.05, vertices=60)
+    try:
+        conv.main(reporte=False)
+        nacional = conv.OUTPUT_DIR
+        huellas = _huellas(nacional)
+        n_departamentos = len(pd.read_parquet(os.path.join(conv.TABLAS_DIR, "tabla_final_geografica.parquet")))
+
+        departamento = _departamento_sin_zrc()
+        conv.main(departamento=departamento, teselas=True, reporte=False)
+
+        salida = os.path.join(base_dir, "outputs", conv._nombre_archivo(departamento))
+        assert conv.OUTPUT_DIR == salida
+        tabla = pd.read_parquet(os.path.join(salida, "tablas", "tabla_final_geografica.parquet"))
+        assert len(tabla) == 1
+        for mapa in ("full", "light", "teselas"):
+            assert os.path.exists(os.path.join(salida, "mapas", f"mapa_multicapas_superposicion_{mapa}.html"))
+        assert os.path.exists(os.path.join(salida, "micrositio", "index.html"))
+
+        # Las salidas nacionales no cambian
+        assert _huellas(nacional) == huellas
+        assert len(pd.read_parquet(os.path.join(nacional, "tablas", "tabla_final_geografica.parquet"))) == n_departamentos
+    finally:
+        conv.configurar_rutas(conv.BASE_DIR, crear=False)